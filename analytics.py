@@ -0,0 +1,182 @@
+import json
+import bisect
+
+# Upper bounds (seconds) of the LLM processing-time histogram buckets; the last bucket is open-ended
+PROCESSING_BUCKETS = (0.5, 1, 2, 3, 5, 8, 13, 20, 30, 45, 60, 90, 120, 180, 300)
+
+INCIDENT_CATEGORIES = ("Auto", "Property", "Health", "Other")
+
+_CATEGORY_KEYWORDS = (
+    ("Auto", ("auto", "vehicle", "car", "collision", "accident", "theft", "motor")),
+    ("Property", ("home", "property", "fire", "flood", "water", "burglary", "storm")),
+    ("Health", ("health", "medical", "injury", "hospital", "treatment")),
+)
+
+def create_tables(c):
+    c.execute('''CREATE TABLE IF NOT EXISTS claim_rollup_monthly (
+                 month TEXT NOT NULL,
+                 category TEXT NOT NULL,
+                 claim_count INTEGER NOT NULL DEFAULT 0,
+                 fraud_risk_sum REAL NOT NULL DEFAULT 0,
+                 fraud_risk_count INTEGER NOT NULL DEFAULT 0,
+                 processing_sec_sum REAL NOT NULL DEFAULT 0,
+                 processing_count INTEGER NOT NULL DEFAULT 0,
+                 PRIMARY KEY (month, category))''')
+
+    c.execute('''CREATE TABLE IF NOT EXISTS processing_histogram_monthly (
+                 month TEXT NOT NULL,
+                 bucket INTEGER NOT NULL,
+                 claim_count INTEGER NOT NULL DEFAULT 0,
+                 PRIMARY KEY (month, bucket))''')
+
+    c.execute('''CREATE TABLE IF NOT EXISTS status_rollup_monthly (
+                 month TEXT NOT NULL,
+                 status TEXT NOT NULL,
+                 claim_count INTEGER NOT NULL DEFAULT 0,
+                 PRIMARY KEY (month, status))''')
+
+    c.execute('''CREATE TABLE IF NOT EXISTS activity_rollup_monthly (
+                 month TEXT PRIMARY KEY,
+                 message_count INTEGER NOT NULL DEFAULT 0,
+                 document_count INTEGER NOT NULL DEFAULT 0)''')
+
+def _section(claim_data, key):
+    value = claim_data.get(key)
+    return value if isinstance(value, dict) else {}
+
+def incident_category(claim_data):
+    """Map the free-text policy/incident type onto a dashboard category"""
+    # Policy type is the more reliable signal; fall back to the incident description
+    for text in (_section(claim_data, "policy").get("type", ""), _section(claim_data, "incident").get("type", "")):
+        text = str(text).lower()
+        for category, keywords in _CATEGORY_KEYWORDS:
+            if any(keyword in text for keyword in keywords):
+                return category
+    return "Other"
+
+def _claim_metrics(claim_data):
+    """(category, fraud risk or None, processing seconds or None) for one claim"""
+    if isinstance(claim_data, str):
+        try:
+            claim_data = json.loads(claim_data)
+        except json.JSONDecodeError:
+            claim_data = {}
+    if not isinstance(claim_data, dict):
+        claim_data = {}
+    try:
+        fraud_risk = float(str(_section(claim_data, "assessment").get("fraud_risk", "")).rstrip("%"))
+    except (TypeError, ValueError):
+        fraud_risk = None
+    processing_sec = _section(claim_data, "processing").get("time_sec")
+    if not isinstance(processing_sec, (int, float)):
+        processing_sec = None
+    return incident_category(claim_data), fraud_risk, processing_sec
+
+def apply_claim(c, month, claim_data, sign=1):
+    """Add (sign=1) or remove (sign=-1) one claim's contribution to the monthly rollups"""
+    category, fraud_risk, processing_sec = _claim_metrics(claim_data)
+    c.execute('''INSERT INTO claim_rollup_monthly
+                 (month, category, claim_count, fraud_risk_sum, fraud_risk_count, processing_sec_sum, processing_count)
+                 VALUES (?, ?, ?, ?, ?, ?, ?)
+                 ON CONFLICT (month, category) DO UPDATE SET
+                   claim_count = claim_count + excluded.claim_count,
+                   fraud_risk_sum = fraud_risk_sum + excluded.fraud_risk_sum,
+                   fraud_risk_count = fraud_risk_count + excluded.fraud_risk_count,
+                   processing_sec_sum = processing_sec_sum + excluded.processing_sec_sum,
+                   processing_count = processing_count + excluded.processing_count''',
+              (month, category, sign,
+               sign * (fraud_risk or 0), sign * (fraud_risk is not None),
+               sign * (processing_sec or 0), sign * (processing_sec is not None)))
+    if processing_sec is not None:
+        bucket = bisect.bisect_left(PROCESSING_BUCKETS, processing_sec)
+        c.execute('''INSERT INTO processing_histogram_monthly (month, bucket, claim_count) VALUES (?, ?, ?)
+                     ON CONFLICT (month, bucket) DO UPDATE SET claim_count = claim_count + excluded.claim_count''',
+                  (month, bucket, sign))
+
+def apply_status(c, month, status, sign=1):
+    c.execute('''INSERT INTO status_rollup_monthly (month, status, claim_count) VALUES (?, ?, ?)
+                 ON CONFLICT (month, status) DO UPDATE SET claim_count = claim_count + excluded.claim_count''',
+              (month, status, sign))
+
+def apply_activity(c, month, messages=0, documents=0):
+    c.execute('''INSERT INTO activity_rollup_monthly (month, message_count, document_count) VALUES (?, ?, ?)
+                 ON CONFLICT (month) DO UPDATE SET
+                   message_count = message_count + excluded.message_count,
+                   document_count = document_count + excluded.document_count''',
+              (month, messages, documents))
+
+def rebuild(c):
+    """Recompute every rollup from the base tables (one full scan; used by the migration)"""
+    for table in ("claim_rollup_monthly", "processing_histogram_monthly",
+                  "status_rollup_monthly", "activity_rollup_monthly"):
+        c.execute(f"DELETE FROM {table}")
+    claims = c.execute("SELECT substr(created_at, 1, 7), status, claim_data FROM claims").fetchall()
+    for month, status, claim_data in claims:
+        apply_claim(c, month, claim_data)
+        apply_status(c, month, status or "new")
+    for month, count in c.execute('''SELECT substr(timestamp, 1, 7), COUNT(*) FROM conversations
+                                      GROUP BY 1''').fetchall():
+        apply_activity(c, month, messages=count)
+    for month, count in c.execute('''SELECT substr(cl.created_at, 1, 7), COUNT(*) FROM documents d
+                                      JOIN claims cl ON cl.id = d.claim_id GROUP BY 1''').fetchall():
+        apply_activity(c, month, documents=count)
+
+def _percentile(histogram, fraction):
+    """Upper bound of the bucket holding the given fraction of observations"""
+    total = sum(histogram.values())
+    if not total:
+        return None
+    seen = 0
+    for bucket in sorted(histogram):
+        seen += histogram[bucket]
+        if seen >= fraction * total:
+            return PROCESSING_BUCKETS[bucket] if bucket < len(PROCESSING_BUCKETS) else float(PROCESSING_BUCKETS[-1])
+    return None
+
+def load_dashboard(conn, months=12):
+    """Pre-aggregated dashboard data for the most recent months"""
+    month_rows = conn.execute('''SELECT DISTINCT month FROM claim_rollup_monthly
+                                 ORDER BY month DESC LIMIT ?''', (months,)).fetchall()
+    month_list = sorted(row[0] for row in month_rows)
+    if not month_list:
+        return {"months": [], "by_category": [], "monthly": [], "status": [], "activity": []}
+    since = month_list[0]
+
+    by_category = [{"month": m, "category": cat, "claims": n} for m, cat, n in conn.execute(
+        '''SELECT month, category, claim_count FROM claim_rollup_monthly
+           WHERE month >= ? AND claim_count > 0 ORDER BY month''', (since,))]
+
+    totals = {m: {"claims": 0, "fraud_sum": 0.0, "fraud_n": 0, "proc_sum": 0.0, "proc_n": 0} for m in month_list}
+    for m, claims, fraud_sum, fraud_n, proc_sum, proc_n in conn.execute(
+            '''SELECT month, SUM(claim_count), SUM(fraud_risk_sum), SUM(fraud_risk_count),
+                      SUM(processing_sec_sum), SUM(processing_count)
+               FROM claim_rollup_monthly WHERE month >= ? GROUP BY month''', (since,)):
+        totals[m] = {"claims": claims, "fraud_sum": fraud_sum, "fraud_n": fraud_n,
+                     "proc_sum": proc_sum, "proc_n": proc_n}
+
+    histograms = {m: {} for m in month_list}
+    for m, bucket, count in conn.execute('''SELECT month, bucket, claim_count FROM processing_histogram_monthly
+                                            WHERE month >= ?''', (since,)):
+        if m in histograms and count > 0:
+            histograms[m][bucket] = count
+
+    monthly = []
+    for m in month_list:
+        t = totals[m]
+        monthly.append({
+            "month": m,
+            "claims": t["claims"],
+            "avg_fraud_risk": round(t["fraud_sum"] / t["fraud_n"], 1) if t["fraud_n"] else None,
+            "mean_processing_sec": round(t["proc_sum"] / t["proc_n"], 2) if t["proc_n"] else None,
+            "p95_processing_sec": _percentile(histograms[m], 0.95)
+        })
+
+    status = [{"status": s, "claims": n} for s, n in conn.execute(
+        '''SELECT status, SUM(claim_count) FROM status_rollup_monthly WHERE month >= ?
+           GROUP BY status HAVING SUM(claim_count) > 0 ORDER BY SUM(claim_count) DESC''', (since,))]
+    activity = [{"month": m, "messages": msgs, "documents": docs} for m, msgs, docs in conn.execute(
+        '''SELECT month, message_count, document_count FROM activity_rollup_monthly
+           WHERE month >= ? ORDER BY month''', (since,))]
+
+    return {"months": month_list, "by_category": by_category, "monthly": monthly,
+            "status": status, "activity": activity}
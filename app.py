@@ -1,45 +1,439 @@
-import ollama
+import llm_scheduler
+import ollama_client
 import json
-import re
 import time
-import requests
+import functools
+import hashlib
+import sqlite3
+import threading
+import contextvars
 from datetime import datetime
-from document_processor import extract_entities, classify_document
+from contextlib import contextmanager
+from document_processor import extract_document_entities, classify_document_detailed
+from pipeline import StageGraph
+from database import get_settlement, save_settlement, get_document_blob, update_document_blob
+from llm_cache import cached_chat
+from structured_output import (ResultModel, StructuredOutputError, STRING, STRINGS, STRUCTURED_MAX_REASKS,
+                               object_schema, integer_schema, optional_schema, structured_chat, reask_messages)
+import summarizer
+import tracing
+from json_stream import IncrementalJSONParser
 import logging
 
 # Set up logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-def analyze_claim(user_input, documents=None, model_name="llama3"):
+@tracing.traced()
+def analyze_claim(user_input, documents=None, model_name="llama3", max_workers=None):
     """
     Analyze the claim using GenAI with multimodal input
     Returns structured JSON analysis
     """
     try:
-        # Combine all input sources
-        full_context = user_input
-        extracted_data = {}
-        damage_reports = []
-        document_summaries = []
+        # Classification and entities don't feed the prompt; don't make the reply wait for them
+        precompute_document_details(documents, max_workers=max_workers)
         
-        if documents:
-            for doc in documents:
-                full_context += f"\n\n[Document: {doc.get('type', 'unknown')}]\n{doc.get('text', '')}"
-                
-                # Classify document
-                doc_type = classify_document(doc.get('text', ''))
-                extracted_data.setdefault(doc_type, []).append(doc)
-                
-                # Generate document summary
-                summary = generate_document_summary(doc)
-                document_summaries.append(summary)
+        # Per-document summaries run concurrently, then the analysis call
+        graph = StageGraph(max_workers=max_workers)
+        summary_stages = _add_summary_stages(graph, documents)
+        graph.add("analysis", _run_analysis, user_input, model_name, deps=summary_stages)
         
-        # Extract entities using NLP
-        entities = extract_entities(full_context)
+        run = graph.run()
+        result, output, processing_time = run.results["analysis"]
+        
+        if result is None:
+            logger.error(f"Response content: {output}")
+            return json.dumps({
+                "error": "AI response format issue",
+                "suggestion": "Please provide more claim details",
+                "raw_response": output,
+                "processing_time": round(processing_time, 2)
+            })
+        
+        # Add metadata
+        result["processing"] = {
+            "time_sec": round(processing_time, 2),
+            "model": model_name,
+            "timestamp": datetime.now().isoformat(),
+            "pipeline": run.summary()
+        }
+        
+        return json.dumps(result, indent=2)
+            
+    except Exception as e:
+        logger.exception("Error in analyze_claim")
+        return json.dumps({
+            "error": str(e),
+            "message": "System error - please try again later"
+        })
+
+# Extra top-level keys a single-pass analysis carries for generate_followup/predict_settlement
+SINGLE_PASS_KEYS = ("followup_questions", "settlement")
+
+# Characters of each document's text sent in place of a summary the single pass doesn't have
+SINGLE_PASS_DOCUMENT_CHARS = 1500
+
+# Output schemas, passed to Ollama as the format constraint of each structured call
+ANALYSIS_SCHEMA = object_schema(
+    claimant=object_schema(name=STRING, contact_info=STRING),
+    policy=object_schema(number=STRING, type=STRING, coverage_details=STRING),
+    incident=object_schema(type=STRING, date=STRING, location=STRING, description=STRING),
+    assessment=object_schema(estimated_loss=STRING, fraud_risk=integer_schema(0, 100), liability=STRING,
+                             completeness_score=integer_schema(0, 100)),
+    next_steps=object_schema(required_docs=STRINGS, timeline=STRING, automated_actions=STRINGS),
+    summary=STRING,
+)
+SETTLEMENT_SCHEMA = object_schema(settlement_prediction=STRING, amount_range=STRING,
+                                  confidence=integer_schema(0, 100), key_factors=STRINGS)
+SINGLE_PASS_SCHEMA = object_schema(**ANALYSIS_SCHEMA["properties"], followup_questions=STRINGS,
+                                   settlement=SETTLEMENT_SCHEMA)
+
+ANALYSIS_RESULT = ResultModel("analysis", ANALYSIS_SCHEMA)
+# Incremental turns return only the fields that changed
+CLAIM_DELTA_RESULT = ResultModel("claim_delta", optional_schema(ANALYSIS_SCHEMA), partial=True)
+SINGLE_PASS_RESULT = ResultModel("single_pass", SINGLE_PASS_SCHEMA)
+FOLLOWUP_RESULT = ResultModel("followup", object_schema(questions=STRINGS))
+SETTLEMENT_RESULT = ResultModel("settlement", SETTLEMENT_SCHEMA)
+
+@tracing.traced()
+def analyze_claim_single_pass(user_input, documents=None, model_name="llama3", max_workers=None):
+    """
+    Analysis, follow-up questions and settlement estimate from one schema-constrained call
+    Documents contribute their stored summary, or an excerpt, instead of a summary call each;
+    generate_followup and predict_settlement then read the extra keys instead of calling the model
+    Returns structured JSON analysis
+    """
+    try:
+        precompute_document_details(documents, max_workers=max_workers)
+        graph = StageGraph(max_workers=max_workers)
+        context_stages = [graph.add(f"context:{i}", _document_context, doc) for i, doc in enumerate(documents or [])]
+        run = graph.run()
+        prompt = _build_single_pass_prompt(user_input, [run.results[name] for name in context_stages])
+        
+        start_time = time.time()
+        try:
+            with tracing.span("single_pass_llm"):
+                result, response = structured_chat(SINGLE_PASS_RESULT, _interactive_chat(model_name),
+                                                   [{'role': 'user', 'content': prompt}])
+        except StructuredOutputError as e:
+            return json.dumps({
+                "error": "AI response format issue",
+                "suggestion": "Please provide more claim details",
+                "raw_response": e.output,
+                "processing_time": round(time.time() - start_time, 2)
+            })
+        processing_time = time.time() - start_time
+        logger.info(f"Raw AI response: {response['message']['content']}")
+        
+        result["processing"] = {
+            "time_sec": round(processing_time, 2),
+            "model": model_name,
+            "timestamp": datetime.now().isoformat(),
+            "pipeline": run.summary(),
+            "mode": "single_pass",
+            "prompt_tokens": response.get("prompt_eval_count"),
+            "output_tokens": response.get("eval_count")
+        }
+        return json.dumps(result, indent=2)
+    
+    except Exception as e:
+        logger.exception("Error in analyze_claim_single_pass")
+        return json.dumps({
+            "error": str(e),
+            "message": "System error - please try again later"
+        })
+
+def _interactive_chat(model_name):
+    """Scheduled chat at interactive priority, for structured_chat"""
+    return functools.partial(llm_scheduler.chat, model=model_name, options={'temperature': 0.1},
+                             priority=llm_scheduler.INTERACTIVE)
+
+def _document_context(doc):
+    """What the single pass sees of a document: its stored summary, else the start of its text"""
+    summary = _stored_blob_field(doc, "summary")
+    if summary:
+        return summary
+    return f"[{doc.get('type', 'unknown')} excerpt]\n{doc.get('text', '')[:SINGLE_PASS_DOCUMENT_CHARS]}"
+
+def _build_single_pass_prompt(user_input, document_context):
+    return _build_analysis_prompt(user_input, document_context) + """
+**Also include, in the same JSON object:**
+- "followup_questions": 3 concise questions that gather missing information or clarify details
+  (missing documentation, incident details, policy coverage, medical treatment plans)
+- "settlement": {"settlement_prediction": "<Likely outcome>", "amount_range": "<Min-max estimate>",
+  "confidence": <0-100>, "key_factors": ["List of influencing factors"]}
+"""
+
+@contextmanager
+def measure_turn(mode, claim_id=None):
+    """
+    Log model calls, tokens and wall time for one chat turn, so the analysis modes can be compared
+    The turn is also the root span of its trace
+    """
+    start_time = time.time()
+    with tracing.span("turn", claim_id=claim_id, mode=mode) as turn, ollama_client.track_usage() as usage:
+        try:
+            yield usage
+        finally:
+            # Also when the turn ends by raising (Streamlit's st.rerun does)
+            turn.tag(**usage.summary())
+            logger.info(f"Turn [{mode}]: {usage.calls} model calls, {usage.prompt_tokens} prompt + "
+                        f"{usage.output_tokens} output tokens, {usage.model_sec:.2f}s model time, "
+                        f"{time.time() - start_time:.2f}s wall")
+
+@tracing.traced()
+def analyze_claim_incremental(new_message, previous_analysis, model_name="llama3"):
+    """
+    Update an existing claim analysis with one new user message
+    Only the compact claim state and the new message are sent to the model;
+    the returned delta is merged into the previous analysis
+    Returns structured JSON analysis
+    """
+    try:
+        if isinstance(previous_analysis, str):
+            previous_analysis = json.loads(previous_analysis)
+        # Single-pass extras describe the old state; the views recompute them after this update
+        state = {k: v for k, v in previous_analysis.items()
+                 if k not in ("processing", "error") + SINGLE_PASS_KEYS}
         
-        # Enhanced prompt template with clearer instructions
         prompt = f"""
+You are an expert insurance claim analyst maintaining a structured claim record.
+
+**Current Claim Record (JSON):**
+{json.dumps(state, separators=(',', ':'))}
+
+**New Message From Claimant:**
+{new_message}
+
+**Instructions:**
+1. Output valid JSON only
+2. Return ONLY the fields that the new message adds or changes, using the same nested structure as the claim record
+3. Re-score assessment fields (fraud_risk, completeness_score, liability) if the new information affects them
+4. Update "summary" if the overall picture changes
+5. Return {{}} if the message adds nothing new
+"""
+        start_time = time.time()
+        try:
+            with tracing.span("incremental_llm"):
+                delta, response = structured_chat(CLAIM_DELTA_RESULT, _interactive_chat(model_name),
+                                                  [{'role': 'user', 'content': prompt}])
+        except StructuredOutputError as e:
+            return json.dumps({
+                "error": "AI response format issue",
+                "suggestion": "Please provide more claim details",
+                "raw_response": e.output,
+                "processing_time": round(time.time() - start_time, 2)
+            })
+        processing_time = time.time() - start_time
+        logger.info(f"Raw AI delta: {response['message']['content']}")
+        
+        result = merge_claim_delta(state, delta)
+        result["processing"] = {
+            "time_sec": round(processing_time, 2),
+            "model": model_name,
+            "timestamp": datetime.now().isoformat(),
+            "mode": "incremental",
+            "prompt_chars": len(prompt)
+        }
+        return json.dumps(result, indent=2)
+        
+    except Exception as e:
+        logger.exception("Error in analyze_claim_incremental")
+        return json.dumps({
+            "error": str(e),
+            "message": "System error - please try again later"
+        })
+
+# Values the model uses for "don't know"; never let them overwrite known data
+_PLACEHOLDER_VALUES = ("", "Unknown", "unknown", "Not provided", "N/A")
+
+def merge_claim_delta(state, delta):
+    """Deep-merge a partial analysis into the claim state (lists are replaced, not appended)"""
+    merged = dict(state)
+    for key, value in (delta or {}).items():
+        # null means the model doesn't know; never let it replace a known value
+        if value is None:
+            continue
+        if isinstance(value, dict) and isinstance(merged.get(key), dict):
+            merged[key] = merge_claim_delta(merged[key], value)
+        elif value in _PLACEHOLDER_VALUES or value == []:
+            merged.setdefault(key, value)
+        else:
+            merged[key] = value
+    return merged
+
+def analyze_claim_stream(user_input, documents=None, model_name="llama3", max_workers=None):
+    """
+    Streaming variant of analyze_claim
+    Yields {"event": "section", "key", "value", "elapsed_sec"} as each top-level
+    section of the analysis completes, then {"event": "done", "result": <JSON string>}
+    """
+    start_time = time.time()
+    try:
+        precompute_document_details(documents, max_workers=max_workers)
+        # Only the summaries feed the prompt; wait for nothing else before streaming
+        graph = StageGraph(max_workers=max_workers)
+        summary_stages = _add_summary_stages(graph, documents)
+        run = graph.run()
+        prompt = _build_analysis_prompt(user_input, [run.results[name] for name in summary_stages])
+        
+        parser = IncrementalJSONParser()
+        first_output_sec = None
+        llm_start = time.time()
+        messages = [{'role': 'user', 'content': prompt}]
+        stream = llm_scheduler.stream_chat(
+            model=model_name,
+            messages=messages,
+            options={'temperature': 0.1},
+            format=ANALYSIS_RESULT.schema,
+            priority=llm_scheduler.INTERACTIVE,
+            call_site="analysis_stream_llm"
+        )
+        for chunk in stream:
+            for key, value in parser.feed(chunk['message']['content']):
+                if first_output_sec is None:
+                    first_output_sec = time.time() - start_time
+                yield {"event": "section", "key": key, "value": value,
+                       "elapsed_sec": round(time.time() - start_time, 2)}
+        processing_time = time.time() - llm_start
+        output = parser.buffer
+        # A span can't stay open across the yields above; record the streamed call afterwards
+        tracing.record("analysis_stream_llm", llm_start, processing_time, first_output_sec=first_output_sec)
+        logger.info(f"Raw AI response: {output}")
+        
+        try:
+            try:
+                result = ANALYSIS_RESULT.parse(output)
+            except StructuredOutputError as e:
+                if not STRUCTURED_MAX_REASKS:
+                    raise
+                # Streaming can't be retried mid-reply; ask again without streaming
+                result, response = structured_chat(ANALYSIS_RESULT, _interactive_chat(model_name),
+                                                   reask_messages(ANALYSIS_RESULT, messages, output, e),
+                                                   max_reasks=STRUCTURED_MAX_REASKS - 1)
+                processing_time = time.time() - llm_start
+            result["processing"] = {
+                "time_sec": round(processing_time, 2),
+                "first_output_sec": round(first_output_sec, 2) if first_output_sec is not None else None,
+                "model": model_name,
+                "timestamp": datetime.now().isoformat(),
+                "pipeline": run.summary(),
+                "mode": "stream"
+            }
+            logger.info(f"Streamed analysis: first section after {result['processing']['first_output_sec']}s, "
+                        f"generation {processing_time:.2f}s")
+            yield {"event": "done", "result": json.dumps(result, indent=2)}
+        except StructuredOutputError as e:
+            logger.error(f"Response content: {e.output}")
+            yield {"event": "done", "result": json.dumps({
+                "error": "AI response format issue",
+                "suggestion": "Please provide more claim details",
+                "raw_response": output,
+                "processing_time": round(processing_time, 2)
+            })}
+            
+    except Exception as e:
+        logger.exception("Error in analyze_claim_stream")
+        yield {"event": "done", "result": json.dumps({
+            "error": str(e),
+            "message": "System error - please try again later"
+        })}
+
+def _add_summary_stages(graph, documents):
+    """Register a summary stage per document; returns the stage names"""
+    return [graph.add(f"summary:{i}", _document_summary, doc) for i, doc in enumerate(documents or [])]
+
+def _document_text(doc):
+    return f"[Document: {doc.get('type', 'unknown')}]\n{doc.get('text', '')}"
+
+def _run_detached(graph):
+    try:
+        graph.run()
+    except Exception:
+        logger.exception("Background document stages failed")
+
+def precompute_document_details(documents, max_workers=None):
+    """Classify documents and extract their entities in a background thread (results land in document_blobs)"""
+    if not documents:
+        return None
+    graph = StageGraph(max_workers=max_workers)
+    for i, doc in enumerate(documents):
+        graph.add(f"classify:{i}", _document_classification, doc)
+        graph.add(f"entities:{i}", _document_entities, doc, _document_text(doc))
+    # Same user as the caller for fair scheduling, but queued behind interactive work
+    context = contextvars.copy_context()
+    context.run(llm_scheduler.set_priority, llm_scheduler.BACKGROUND)
+    thread = threading.Thread(target=context.run, args=(_run_detached, graph), daemon=True)
+    thread.start()
+    return thread
+
+# Per-document stages: results for fingerprinted uploads (doc["sha256"]) are stored in
+# document_blobs and reused whenever the same file shows up again
+
+def _stored_blob_field(doc, field):
+    if not doc.get("sha256"):
+        return None
+    try:
+        blob = get_document_blob(doc["sha256"], with_text=False)
+    except sqlite3.Error:
+        return None
+    return blob.get(field) if blob else None
+
+def _store_blob_fields(doc, **fields):
+    if doc.get("sha256"):
+        try:
+            update_document_blob(doc["sha256"], **fields)
+        except sqlite3.Error as e:
+            logger.warning(f"Could not store document {', '.join(fields)}: {str(e)}")
+
+@tracing.traced("document_classification")
+def _document_classification(doc):
+    doc_type = _stored_blob_field(doc, "classification")
+    if doc_type is None:
+        classification = classify_document_detailed(doc.get('text', ''))
+        doc_type = classification["label"]
+        _store_blob_fields(doc, classification=doc_type, classification_source=classification["source"])
+    return doc_type
+
+@tracing.traced("document_summary")
+def _document_summary(doc):
+    summary = _stored_blob_field(doc, "summary")
+    if summary is None:
+        summary = generate_document_summary(doc)
+        # Don't pin the "unavailable" fallback to this document forever
+        if summary != "Document summary unavailable":
+            _store_blob_fields(doc, summary=summary)
+    return summary
+
+@tracing.traced("document_entities")
+def _document_entities(doc, document_text):
+    entities = _stored_blob_field(doc, "entities")
+    if entities is None:
+        entities = extract_document_entities([document_text])[0]
+        _store_blob_fields(doc, entities=entities)
+    return entities
+
+@tracing.traced("analysis_llm")
+def _run_analysis(user_input, model_name, *document_summaries):
+    """Main structured-analysis LLM call; returns (result, or None if unusable, raw output, seconds spent)"""
+    prompt = _build_analysis_prompt(user_input, list(document_summaries))
+    # Send to Ollama
+    start_time = time.time()
+    try:
+        result, response = structured_chat(ANALYSIS_RESULT, _interactive_chat(model_name),
+                                           [{'role': 'user', 'content': prompt}])
+        output = response['message']['content']
+    except StructuredOutputError as e:
+        result, output = None, e.output
+    processing_time = time.time() - start_time
+    
+    logger.info(f"Raw AI response: {output}")
+    return result, output, processing_time
+
+def _build_analysis_prompt(user_input, document_summaries):
+    # Enhanced prompt template with clearer instructions
+    return f"""
 You are an expert insurance claim analyst. Analyze this claim and provide structured output:
 
 **Claim Context:**
@@ -89,60 +483,8 @@ You are an expert insurance claim analyst. Analyze this claim and provide struct
 7. For vehicle claims, VIN should be treated as policy identifier if no policy number found
 8. For medical claims, include treatment details in assessment
 """
-        # Send to Ollama
-        start_time = time.time()
-        response = ollama.chat(
-            model=model_name,
-            messages=[{
-                'role': 'user',
-                'content': prompt
-            }],
-            options={'temperature': 0.1}
-        )
-        processing_time = time.time() - start_time
-        
-        output = response['message']['content']
-        logger.info(f"Raw AI response: {output}")
-        
-        # Extract JSON from response
-        try:
-            # Improved JSON extraction
-            json_match = re.search(r'\{[\s\S]*\}', output)
-            if json_match:
-                json_str = json_match.group(0)
-                # Clean common formatting issues
-                json_str = json_str.replace("\\n", "").replace("\\", "")
-                result = json.loads(json_str)
-            else:
-                # Fallback to direct parsing
-                result = json.loads(output)
-                
-            # Add metadata
-            result["processing"] = {
-                "time_sec": round(processing_time, 2),
-                "model": model_name,
-                "timestamp": datetime.now().isoformat()
-            }
-            
-            return json.dumps(result, indent=2)
-            
-        except json.JSONDecodeError as e:
-            logger.error(f"JSON decode error: {str(e)}")
-            logger.error(f"Response content: {output}")
-            return json.dumps({
-                "error": "AI response format issue",
-                "suggestion": "Please provide more claim details",
-                "raw_response": output,
-                "processing_time": round(processing_time, 2)
-            })
-            
-    except Exception as e:
-        logger.exception("Error in analyze_claim")
-        return json.dumps({
-            "error": str(e),
-            "message": "System error - please try again later"
-        })
 
+@tracing.traced("followup")
 def generate_followup(claim_data):
     """Generate relevant follow-up questions using GenAI"""
     try:
@@ -150,6 +492,11 @@ def generate_followup(claim_data):
         if isinstance(claim_data, str):
             claim_data = json.loads(claim_data)
         
+        # A single-pass analysis already carries the questions
+        questions = claim_data.get("followup_questions")
+        if isinstance(questions, list) and questions:
+            return [str(question) for question in questions]
+        
         claim_summary = claim_data.get("summary", "")
         incident_desc = claim_data.get("incident", {}).get("description", "")
         
@@ -171,29 +518,14 @@ Example: {{ "questions": ["What was the exact location of the accident?", "Do yo
 - Policy coverage questions
 - Medical treatment plans
 """
-        response = ollama.chat(
-            model="llama3",
-            messages=[{'role': 'user', 'content': prompt}],
-            options={'temperature': 0.3}
-        )
-        output = response['message']['content']
-        
-        # Extract JSON
-        json_match = re.search(r'\{.*\}', output, re.DOTALL)
-        if json_match:
-            json_str = json_match.group(0)
-            result = json.loads(json_str)
-            return result.get("questions", [
-                "Can you confirm the date and time of the incident?",
-                "Do you have photos of the damage?",
-                "What is your insurance policy number?"
-            ])
-        else:
-            return [
-                "Can you provide more details about the incident?",
-                "Do you have any supporting documents to upload?",
-                "What is your insurance policy number?"
-            ]
+        send = functools.partial(cached_chat, model="llama3", options={'temperature': 0.3},
+                                 validate=FOLLOWUP_RESULT.accepts)
+        result, _ = structured_chat(FOLLOWUP_RESULT, send, [{'role': 'user', 'content': prompt}])
+        return result["questions"] or [
+            "Can you provide more details about the incident?",
+            "Do you have any supporting documents to upload?",
+            "What is your insurance policy number?"
+        ]
     except Exception as e:
         logger.error(f"Error in generate_followup: {str(e)}")
         return [
@@ -202,30 +534,27 @@ Example: {{ "questions": ["What was the exact location of the accident?", "Do yo
             "What is your insurance policy number?"
         ]
 
+@tracing.traced()
+def generate_claim_outputs(claim_data, claim_id=None, max_workers=None):
+    """Fan out follow-up questions and settlement prediction concurrently"""
+    graph = StageGraph(max_workers=max_workers)
+    graph.add("followup", generate_followup, claim_data)
+    if claim_id:
+        graph.add("settlement", get_settlement_prediction, claim_id, claim_data)
+    else:
+        graph.add("settlement", predict_settlement, claim_data)
+    run = graph.run()
+    return run.results["followup"], run.results["settlement"]
+
 def generate_document_summary(document):
     """Generate summary for uploaded documents"""
-    content = document.get('text', '')[:2000]
-    prompt = f"""
-Generate a concise summary of this document for claim processing:
-
-Document type: {document.get('type', 'unknown')}
-Content:
-{content}
-
-Output format:
-- Key points
-- Relevant details for claim
-- Any concerns or missing information
-"""
     try:
-        response = ollama.chat(
-            model="llama3",
-            messages=[{'role': 'user', 'content': prompt}]
-        )
-        return response['message']['content']
+        return summarizer.summarize_document(document.get('text', ''), document.get('type', 'unknown'),
+                                             pages=document.get('pages'))
     except Exception:
         return "Document summary unavailable"
 
+@tracing.traced("settlement")
 def predict_settlement(claim_data):
     """Predict likely settlement using GenAI"""
     try:
@@ -233,6 +562,11 @@ def predict_settlement(claim_data):
         if isinstance(claim_data, str):
             claim_data = json.loads(claim_data)
         
+        # A single-pass analysis already carries the estimate
+        settlement = claim_data.get("settlement")
+        if isinstance(settlement, dict) and settlement.get("settlement_prediction"):
+            return settlement
+        
         incident_type = claim_data.get("incident", {}).get("type", "")
         loss = claim_data.get("assessment", {}).get("estimated_loss", "")
         
@@ -250,37 +584,56 @@ Output in JSON format:
   "key_factors": ["List of influencing factors"]
 }}
 """
-        response = ollama.chat(
-            model="llama3",
-            messages=[{'role': 'user', 'content': prompt}],
-            format="json"
-        )
-        output = response['message']['content']
-        
-        # Extract JSON
-        json_match = re.search(r'\{.*\}', output, re.DOTALL)
-        if json_match:
-            json_str = json_match.group(0)
-            result = json.loads(json_str)
-            # Ensure confidence is number
-            if "confidence" in result and isinstance(result["confidence"], str):
-                try:
-                    result["confidence"] = int(result["confidence"])
-                except:
-                    result["confidence"] = 75
-            return result
-        else:
-            return {
-                "settlement_prediction": "Partial settlement",
-                "amount_range": "$5,000-$7,500",
-                "confidence": 75,
-                "key_factors": ["Incomplete documentation", "Disputed liability"]
-            }
+        # No call-site priority: a chat turn waits for this, while precompute_settlement
+        # runs it in a BACKGROUND context
+        send = functools.partial(cached_chat, model="llama3", validate=SETTLEMENT_RESULT.accepts)
+        result, _ = structured_chat(SETTLEMENT_RESULT, send, [{'role': 'user', 'content': prompt}])
+        return result
     except Exception as e:
         logger.error(f"Error in predict_settlement: {str(e)}")
-        return {
-            "settlement_prediction": "Analysis in progress",
-            "amount_range": "Not estimated",
-            "confidence": 0,
-            "key_factors": ["Initial assessment underway"]
-        }
\ No newline at end of file
+        return dict(SETTLEMENT_UNAVAILABLE)
+
+# Returned when the model could not be reached or its reply was unusable; never persisted
+SETTLEMENT_UNAVAILABLE = {
+    "settlement_prediction": "Analysis in progress",
+    "amount_range": "Not estimated",
+    "confidence": 0,
+    "key_factors": ["Initial assessment underway"]
+}
+
+def settlement_inputs_hash(claim_data):
+    """Hash of the analysis fields predict_settlement depends on"""
+    if isinstance(claim_data, str):
+        claim_data = json.loads(claim_data)
+    inputs = {
+        "incident_type": str(claim_data.get("incident", {}).get("type", "")).strip().lower(),
+        "estimated_loss": str(claim_data.get("assessment", {}).get("estimated_loss", "")).strip()
+    }
+    return hashlib.sha256(json.dumps(inputs, sort_keys=True).encode("utf-8")).hexdigest()
+
+@tracing.traced("settlement_prediction")
+def get_settlement_prediction(claim_id, claim_data):
+    """Stored settlement prediction for a claim, recomputed only when its inputs change"""
+    tracing.set_claim(claim_id)
+    input_hash = settlement_inputs_hash(claim_data)
+    stored = get_settlement(claim_id)
+    if stored and stored["input_hash"] == input_hash:
+        return stored["prediction"]
+    
+    # No per-claim lock: a background precompute still in flight shares its model call
+    # with this one through the scheduler, which promotes it to this caller's priority,
+    # rather than making an interactive turn wait behind the background lane
+    prediction = predict_settlement(claim_data)
+    if prediction != SETTLEMENT_UNAVAILABLE:
+        save_settlement(claim_id, input_hash, prediction)
+    return prediction
+
+def precompute_settlement(claim_id, claim_data):
+    """Compute and store the settlement prediction in a background thread"""
+    # Same user as the caller for fair scheduling, but queued behind interactive work
+    context = contextvars.copy_context()
+    context.run(llm_scheduler.set_priority, llm_scheduler.BACKGROUND)
+    thread = threading.Thread(target=context.run, args=(get_settlement_prediction, claim_id, claim_data),
+                              daemon=True)
+    thread.start()
+    return thread
\ No newline at end of file
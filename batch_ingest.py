@@ -0,0 +1,218 @@
+"""
+Bulk ingest of legacy claims.
+
+Input is either a directory with one sub-folder per claim (a description.txt
+plus any PDFs/images/text files) or a JSONL manifest with one claim per line:
+
+    {"id": "C-1001", "description": "Rear-ended at ...", "files": ["docs/c1001/report.pdf"]}
+
+    python batch_ingest.py backlog/ --workers 4 --llm-concurrency 2
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import logging
+import mimetypes
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import database
+import llm_scheduler
+
+logger = logging.getLogger(__name__)
+
+DESCRIPTION_FILES = ("description.txt", "claim.txt")
+
+
+class LocalUpload:
+    """File on disk with the interface extract_text_from_upload expects from Streamlit uploads"""
+
+    def __init__(self, path):
+        self.path = path
+        self.name = os.path.basename(path)
+        self.type = mimetypes.guess_type(path)[0] or "application/octet-stream"
+
+    def getvalue(self):
+        with open(self.path, "rb") as f:
+            return f.read()
+
+
+def load_manifest(source):
+    """List of {"key", "description", "files"} claims from a directory or JSONL manifest"""
+    claims = []
+    if os.path.isdir(source):
+        for entry in sorted(os.listdir(source)):
+            folder = os.path.join(source, entry)
+            if not os.path.isdir(folder):
+                continue
+            description, files = "", []
+            for name in sorted(os.listdir(folder)):
+                path = os.path.join(folder, name)
+                if name.lower() in DESCRIPTION_FILES:
+                    with open(path, encoding="utf-8") as f:
+                        description = f.read()
+                elif os.path.isfile(path):
+                    files.append(path)
+            claims.append({"key": entry, "description": description, "files": files})
+    else:
+        base = os.path.dirname(os.path.abspath(source))
+        with open(source, encoding="utf-8") as f:
+            for line_no, line in enumerate(f, 1):
+                if not line.strip():
+                    continue
+                item = json.loads(line)
+                files = [p if os.path.isabs(p) else os.path.join(base, p) for p in item.get("files", [])]
+                claims.append({"key": str(item.get("id", line_no)),
+                               "description": item.get("description", ""), "files": files})
+    return claims
+
+
+def load_checkpoint(path):
+    """Keys of claims already ingested by a previous run"""
+    done = set()
+    if os.path.exists(path):
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    done.add(json.loads(line)["key"])
+    return done
+
+
+def extract_file(path):
+    """Process-pool worker: extract one file; returns (path, result, seconds)"""
+    from document_processor import extract_text_from_upload
+    start = time.time()
+    # Already one process per file; don't fan out again per PDF
+    result = extract_text_from_upload(LocalUpload(path), pdf_workers=1)
+    return path, result, time.time() - start
+
+
+def analyze(claim, llm_model):
+    """Thread-pool worker: run the claim analysis; returns (analysis dict, seconds)"""
+    from app import analyze_claim
+    start = time.time()
+    documents = [doc for _, doc in claim["documents"] if "text" in doc]
+    # One stage at a time per claim so --llm-concurrency bounds total model load
+    with llm_scheduler.request_context(priority=llm_scheduler.BACKGROUND, user="batch_ingest"):
+        analysis = json.loads(analyze_claim(claim["description"], documents=documents,
+                                            model_name=llm_model, max_workers=1))
+    return analysis, time.time() - start
+
+
+def write_batch(batch, source):
+    """
+    Save a batch of analyzed claims in a single transaction, recording their keys in the
+    same one; returns {key: claim id} for the claims written (ones already ingested are skipped)
+    """
+    ids = {}
+    with database.transaction():
+        for claim in batch:
+            if database.is_ingested(source, claim["key"]):
+                logger.info(f"Claim {claim['key']} was already ingested; skipping")
+                continue
+            claim_id = database.save_claim(claim["analysis"])
+            database.save_message(claim_id, "user", claim["description"])
+            if claim["analysis"].get("summary"):
+                database.save_message(claim_id, "ai", claim["analysis"]["summary"])
+            for path, doc in claim["documents"]:
+                if "text" in doc:
+                    database.save_document(claim_id, os.path.basename(path), doc.get("type", "unknown"),
+                                           doc["text"], doc, blob_sha256=doc.get("sha256"))
+            database.save_ingested_key(source, claim["key"], claim_id)
+            ids[claim["key"]] = claim_id
+    return ids
+
+
+def run(claims, source, checkpoint_path, workers, llm_concurrency, batch_size, llm_model):
+    timings = {"extract": 0.0, "analyze": 0.0, "write": 0.0}
+    stats = {"ingested": 0, "failed": 0}
+    start = time.time()
+
+    def submit_extraction(pool, chunk):
+        return [[pool.submit(extract_file, path) for path in claim["files"]] for claim in chunk]
+
+    chunks = [claims[i:i + batch_size] for i in range(0, len(claims), batch_size)]
+    # Workers store extracted blobs; under spawn they don't inherit a configured DB path
+    with ProcessPoolExecutor(max_workers=workers, initializer=database.configure,
+                             initargs=(database.DB_PATH,)) as extract_pool, \
+            ThreadPoolExecutor(max_workers=llm_concurrency) as llm_pool, \
+            open(checkpoint_path, "a", encoding="utf-8") as checkpoint:
+        pending = submit_extraction(extract_pool, chunks[0]) if chunks else []
+        for index, chunk in enumerate(chunks):
+            extraction = pending
+            # Prefetch the next chunk's files while this one is being analyzed
+            if index + 1 < len(chunks):
+                pending = submit_extraction(extract_pool, chunks[index + 1])
+
+            for claim, futures in zip(chunk, extraction):
+                claim["documents"] = []
+                for future in futures:
+                    path, result, seconds = future.result()
+                    timings["extract"] += seconds
+                    claim["documents"].append((path, result))
+
+            analyses = [llm_pool.submit(analyze, claim, llm_model) for claim in chunk]
+            ready = []
+            for claim, future in zip(chunk, analyses):
+                analysis, seconds = future.result()
+                timings["analyze"] += seconds
+                if "error" in analysis:
+                    # Not checkpointed, so the next run retries it
+                    logger.error(f"Claim {claim['key']} failed: {analysis['error']}")
+                    stats["failed"] += 1
+                    continue
+                claim["analysis"] = analysis
+                ready.append(claim)
+
+            write_start = time.time()
+            ids = write_batch(ready, source) if ready else {}
+            timings["write"] += time.time() - write_start
+            # The database is the record of what was ingested; this log is for people
+            for key, claim_id in ids.items():
+                checkpoint.write(json.dumps({"key": key, "claim_id": claim_id}) + "\n")
+            checkpoint.flush()
+            stats["ingested"] += len(ids)
+
+            elapsed = time.time() - start
+            logger.info(f"Batch {index + 1}/{len(chunks)}: {stats['ingested']} claims in {elapsed:.1f}s")
+
+    return stats, timings, time.time() - start
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("source", help="Claims directory or JSONL manifest")
+    parser.add_argument("--db", default=database.DB_PATH, help="SQLite database to write to")
+    parser.add_argument("--checkpoint", help="Resume file (default: <source>.checkpoint)")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 2, help="Extraction processes")
+    parser.add_argument("--llm-concurrency", type=int, default=2, help="Claims analyzed at once")
+    parser.add_argument("--batch-size", type=int, default=25, help="Claims per database transaction")
+    parser.add_argument("--model", default="llama3")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+    database.configure(args.db)
+    database.init_db()
+
+    checkpoint_path = args.checkpoint or args.source.rstrip("/\\") + ".checkpoint"
+    source = os.path.abspath(args.source)
+    done = load_checkpoint(checkpoint_path) | database.get_ingested_keys(source)
+    claims = [claim for claim in load_manifest(args.source) if claim["key"] not in done]
+    print(f"{len(claims)} claims to ingest ({len(done)} already done)")
+    if not claims:
+        return 0
+
+    stats, timings, elapsed = run(claims, source, checkpoint_path, args.workers, args.llm_concurrency,
+                                  args.batch_size, args.model)
+
+    print(f"\nIngested {stats['ingested']} claims ({stats['failed']} failed) in {elapsed:.1f}s")
+    print(f"Throughput: {stats['ingested'] / elapsed * 60:.1f} claims/min")
+    processed = max(1, stats["ingested"] + stats["failed"])
+    for stage, seconds in timings.items():
+        print(f"  {stage:<8} {seconds:8.1f}s total  {seconds / processed:6.2f}s/claim")
+    return 1 if stats["failed"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,108 @@
+"""
+Micro-benchmark for database.py: connection-per-call (the old access pattern)
+versus the pooled WAL connection manager.
+
+    python benchmarks/bench_database.py --ops 2000 --threads 4
+"""
+import os
+import sys
+import json
+import time
+import sqlite3
+import argparse
+import tempfile
+import threading
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import database
+
+CLAIM = {"incident": {"type": "Auto collision"}, "assessment": {"estimated_loss": "$8,750", "fraud_risk": 20},
+         "summary": "Rear-ended at a red light; repair estimate and medical bills provided."}
+
+
+# --- Old pattern: open, execute one statement, commit, close -----------------
+
+def legacy_save_message(path, claim_id, role, content):
+    conn = sqlite3.connect(path)
+    c = conn.cursor()
+    c.execute("INSERT INTO conversations (claim_id, role, content) VALUES (?, ?, ?)", (claim_id, role, content))
+    conn.commit()
+    conn.close()
+
+def legacy_get_claim(path, claim_id):
+    conn = sqlite3.connect(path)
+    c = conn.cursor()
+    c.execute("SELECT claim_data, status, created_at FROM claims WHERE id=?", (claim_id,))
+    row = c.fetchone()
+    conn.close()
+    return json.loads(row[0]) if row else None
+
+
+def run_threads(threads, ops, func):
+    """Run func(i) ops times spread over threads; returns (ops/sec, errors)"""
+    errors = []
+    per_thread = ops // threads
+
+    def worker(offset):
+        for i in range(per_thread):
+            try:
+                func(offset + i)
+            except sqlite3.OperationalError as e:
+                errors.append(str(e))
+
+    workers = [threading.Thread(target=worker, args=(t * per_thread,)) for t in range(threads)]
+    start = time.perf_counter()
+    for w in workers:
+        w.start()
+    for w in workers:
+        w.join()
+    elapsed = time.perf_counter() - start
+    return per_thread * threads / elapsed, len(errors)
+
+
+def bench(ops, threads):
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        # Legacy: default rollback journal, connection per call
+        legacy_path = os.path.join(tmp, "legacy.db")
+        database.configure(legacy_path)
+        database.init_db()
+        claim_id = database.save_claim(CLAIM)
+        database.get_connection().execute("PRAGMA journal_mode=DELETE")
+        database.close_connection()
+        results["legacy_write"] = run_threads(
+            threads, ops, lambda i: legacy_save_message(legacy_path, claim_id, "user", f"message {i}"))
+        results["legacy_read"] = run_threads(
+            threads, ops, lambda i: legacy_get_claim(legacy_path, claim_id))
+
+        # Pooled: thread-local WAL connections
+        pooled_path = os.path.join(tmp, "pooled.db")
+        database.configure(pooled_path)
+        database.init_db()
+        claim_id = database.save_claim(CLAIM)
+        results["pooled_write"] = run_threads(
+            threads, ops, lambda i: database.save_message(claim_id, "user", f"message {i}"))
+        results["pooled_read"] = run_threads(
+            threads, ops, lambda i: database.get_claim(claim_id))
+        database.close_connection()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--ops", type=int, default=2000)
+    parser.add_argument("--threads", type=int, default=4)
+    args = parser.parse_args()
+
+    results = bench(args.ops, args.threads)
+    print(f"{'operation':<14}{'ops/sec':>12}{'errors':>8}")
+    for name, (rate, errors) in results.items():
+        print(f"{name:<14}{rate:>12.0f}{errors:>8}")
+    for op in ("write", "read"):
+        speedup = results[f"pooled_{op}"][0] / results[f"legacy_{op}"][0]
+        print(f"{op} speedup: {speedup:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
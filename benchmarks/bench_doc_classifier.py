@@ -0,0 +1,126 @@
+"""
+Benchmark for the local document classifier: agreement with the LLM's labels,
+share of LLM calls avoided at each confidence threshold, and latency.
+
+Labelled documents come from the LLM classifications stored in a claims
+database, or from a JSONL file of {"text": ..., "label": ...} lines. Each fold
+is scored by a model trained on the seeds plus the other folds.
+
+--simulate instead replays the documents oldest first as a fresh install
+would see them: starting from the seeds only, each document the model is
+unsure about costs an LLM call and adds its label, and the model is retrained
+every DOC_CLASSIFIER_RETRAIN_LABELS labels, as the app does.
+
+    python benchmarks/bench_doc_classifier.py --db claims_ai.db
+    python benchmarks/bench_doc_classifier.py --jsonl labelled_docs.jsonl --folds 5
+    python benchmarks/bench_doc_classifier.py --db claims_ai.db --simulate
+"""
+import os
+import sys
+import json
+import time
+import argparse
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import database
+import doc_classifier
+
+THRESHOLDS = (0.5, 0.6, 0.7, 0.8, 0.9, 0.95)
+
+
+def load_examples(args):
+    if args.jsonl:
+        with open(args.jsonl, encoding="utf-8") as f:
+            return [(item["label"], item["text"]) for item in map(json.loads, f) if item.get("text")]
+    database.configure(args.db)
+    database.init_db()
+    # Newest first from the database; oldest first is the order they arrived in
+    return list(database.get_labelled_documents(doc_classifier.LABELS, source="llm"))[::-1]
+
+
+def cross_validate(examples, folds):
+    """(llm_label, local_label, confidence, seconds) for every example, each scored out of fold"""
+    scored = []
+    for fold in range(folds):
+        train = [example for i, example in enumerate(examples) if i % folds != fold]
+        test = [example for i, example in enumerate(examples) if i % folds == fold]
+        model = doc_classifier.DocumentClassifier().fit(list(doc_classifier.SEEDS) + train)
+        for label, text in test:
+            start = time.perf_counter()
+            predicted, confidence = model.predict(text)
+            scored.append((label, predicted, confidence, time.perf_counter() - start))
+    return scored
+
+
+def report(scored):
+    total = len(scored)
+    correct = sum(label == predicted for label, predicted, _, _ in scored)
+    latencies = sorted(seconds * 1000 for *_, seconds in scored)
+    print(f"{total} labelled documents")
+    print(f"local accuracy vs LLM labels (no fallback): {correct / total:.1%}")
+    print(f"latency: mean {sum(latencies) / total:.3f}ms, p99 {latencies[int(0.99 * (total - 1))]:.3f}ms\n")
+    print(f"{'threshold':>10}{'LLM avoided':>13}{'local acc':>11}{'overall acc':>13}")
+    for threshold in THRESHOLDS:
+        local = [(label, predicted) for label, predicted, confidence, _ in scored if confidence >= threshold]
+        local_correct = sum(label == predicted for label, predicted in local)
+        # Escalated documents get the LLM's own label, so only local mistakes count against accuracy
+        overall = (total - len(local) + local_correct) / total
+        local_acc = f"{local_correct / len(local):.1%}" if local else "-"
+        marker = "  <- DOC_CLASSIFIER_THRESHOLD" if threshold == doc_classifier.CONFIDENCE_THRESHOLD else ""
+        print(f"{threshold:>10.2f}{len(local) / total:>13.1%}{local_acc:>11}{overall:>13.1%}{marker}")
+
+
+def simulate(examples, threshold, retrain_after):
+    """(LLM calls avoided, local mistakes, avoided per block of 100) replaying examples in order"""
+    model = doc_classifier.DocumentClassifier().fit(list(doc_classifier.SEEDS))
+    labels, pending, local, mistakes, blocks = [], 0, 0, 0, []
+    for n, (label, text) in enumerate(examples):
+        if n % 100 == 0:
+            blocks.append(0)
+        predicted, confidence = model.predict(text)
+        if confidence >= threshold:
+            local += 1
+            blocks[-1] += 1
+            mistakes += predicted != label
+            continue
+        labels.append((label, text))
+        pending += 1
+        if retrain_after and pending >= retrain_after:
+            recent = labels[-doc_classifier.TRAIN_LIMIT:]
+            model = doc_classifier.DocumentClassifier().fit(list(doc_classifier.SEEDS) + recent)
+            pending = 0
+    return local / len(examples), mistakes, blocks
+
+
+def report_simulation(examples, retrain_after):
+    print(f"{len(examples)} labelled documents, seeds-only start, retrain every {retrain_after} LLM labels\n")
+    print(f"{'threshold':>10}{'LLM avoided':>13}{'mistakes':>10}  avoided per 100 documents")
+    for threshold in THRESHOLDS:
+        avoided, mistakes, blocks = simulate(examples, threshold, retrain_after)
+        marker = "  <- DOC_CLASSIFIER_THRESHOLD" if threshold == doc_classifier.CONFIDENCE_THRESHOLD else ""
+        print(f"{threshold:>10.2f}{avoided:>13.1%}{mistakes:>10}  {' '.join(map(str, blocks))}{marker}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--db", default=database.DB_PATH, help="Claims database with LLM-labelled documents")
+    parser.add_argument("--jsonl", help="Labelled documents to use instead of the database")
+    parser.add_argument("--folds", type=int, default=5)
+    parser.add_argument("--simulate", action="store_true", help="Replay the documents from a seeds-only model")
+    parser.add_argument("--retrain-after", type=int, default=doc_classifier.RETRAIN_AFTER_LABELS)
+    args = parser.parse_args()
+
+    examples = load_examples(args)
+    if args.simulate:
+        report_simulation(examples, args.retrain_after)
+        return 0
+    if len(examples) < args.folds:
+        print(f"Only {len(examples)} labelled documents; need at least {args.folds}")
+        return 1
+    report(cross_validate(examples, args.folds))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
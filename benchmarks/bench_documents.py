@@ -0,0 +1,135 @@
+"""
+Benchmark for document storage: text stored inline twice (documents.content plus
+the copy inside documents.analysis) versus the compressed, lazily loaded
+content store.
+
+    python benchmarks/bench_documents.py --claims 200 --docs 3 --pages 8
+"""
+import os
+import sys
+import json
+import time
+import random
+import sqlite3
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import database
+
+WORDS = ("claim policy vehicle collision repair estimate invoice police report officer "
+         "damage bumper insurer deductible coverage medical treatment hospital witness "
+         "statement date location intersection adjuster payment total amount signature").split()
+
+
+def synthetic_document(rng, pages):
+    """Extraction result shaped like extract_pdf's, with ~2.5 KB of text per page"""
+    page_texts = []
+    for number in range(pages):
+        lines = [" ".join(rng.choice(WORDS) for _ in range(12)) + f" {rng.randint(100, 99999)}"
+                 for _ in range(30)]
+        page_texts.append(f"Page {number + 1}\n" + "\n".join(lines))
+    text = "\n\n".join(page_texts)
+    offsets, position = [], 0
+    for page in page_texts:
+        offsets.append(position)
+        position += len(page) + 2
+    return {"text": text, "type": "police_report", "pages": pages, "page_offsets": offsets,
+            "metadata": {"producer": "bench"}, "ocr_pages": []}
+
+
+def legacy_schema(conn):
+    conn.execute('''CREATE TABLE claims (id INTEGER PRIMARY KEY AUTOINCREMENT, claim_data TEXT NOT NULL,
+                    status TEXT DEFAULT 'new', created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)''')
+    conn.execute('''CREATE TABLE documents (id INTEGER PRIMARY KEY AUTOINCREMENT, claim_id INTEGER NOT NULL,
+                    filename TEXT NOT NULL, doc_type TEXT NOT NULL, content TEXT, analysis TEXT)''')
+    conn.execute("CREATE INDEX idx_documents_claim ON documents(claim_id)")
+
+
+def legacy_get_claim_documents(conn, claim_id):
+    rows = conn.execute("SELECT id, filename, doc_type, analysis FROM documents WHERE claim_id=?",
+                        (claim_id,)).fetchall()
+    return [{"id": row[0], "filename": row[1], "type": row[2],
+             "analysis": json.loads(row[3]) if row[3] else None} for row in rows]
+
+
+def file_size(path):
+    """Database size once the WAL has been folded back in"""
+    conn = sqlite3.connect(path)
+    conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    conn.close()
+    return os.path.getsize(path)
+
+
+def time_page_loads(claim_ids, load, repeat):
+    """Mean milliseconds to load one claim's document list"""
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for claim_id in claim_ids:
+            load(claim_id)
+    return (time.perf_counter() - start) * 1000 / (repeat * len(claim_ids))
+
+
+def bench(claims, docs, pages, repeat):
+    rng = random.Random(42)
+    documents = [[synthetic_document(rng, pages) for _ in range(docs)] for _ in range(claims)]
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        # Legacy: text inline in content and again inside the analysis JSON
+        legacy_path = os.path.join(tmp, "legacy.db")
+        conn = database.open_connection(legacy_path)
+        legacy_schema(conn)
+        legacy_ids = []
+        with conn:
+            for claim_docs in documents:
+                claim_id = conn.execute("INSERT INTO claims (claim_data) VALUES ('{}')").lastrowid
+                legacy_ids.append(claim_id)
+                for i, doc in enumerate(claim_docs):
+                    conn.execute('''INSERT INTO documents (claim_id, filename, doc_type, content, analysis)
+                                    VALUES (?, ?, ?, ?, ?)''',
+                                 (claim_id, f"doc{i}.pdf", doc["type"], doc["text"], json.dumps(doc)))
+        results["legacy_list_ms"] = time_page_loads(
+            legacy_ids, lambda claim_id: legacy_get_claim_documents(conn, claim_id), repeat)
+        conn.close()
+        results["legacy_size"] = file_size(legacy_path)
+
+        # Content store: metadata in documents, compressed text loaded on demand
+        store_path = os.path.join(tmp, "store.db")
+        database.configure(store_path)
+        database.init_db()
+        store_ids = []
+        for claim_docs in documents:
+            claim_id = database.save_claim({})
+            store_ids.append(claim_id)
+            for i, doc in enumerate(claim_docs):
+                database.save_document(claim_id, f"doc{i}.pdf", doc["type"], doc["text"], doc)
+        results["store_list_ms"] = time_page_loads(store_ids, database.get_claim_documents, repeat)
+        opened = [database.get_claim_documents(claim_id)[0]["id"] for claim_id in store_ids]
+        results["store_open_ms"] = time_page_loads(opened, database.get_document_content, repeat)
+        database.close_connection()
+        results["store_size"] = file_size(store_path)
+    results["codec"] = database.CONTENT_CODEC
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--claims", type=int, default=200)
+    parser.add_argument("--docs", type=int, default=3, help="Documents per claim")
+    parser.add_argument("--pages", type=int, default=8, help="Pages per document")
+    parser.add_argument("--repeat", type=int, default=5, help="Times each page load is timed")
+    args = parser.parse_args()
+
+    results = bench(args.claims, args.docs, args.pages, args.repeat)
+    print(f"{args.claims} claims x {args.docs} documents x {args.pages} pages (codec: {results['codec']})")
+    print(f"{'layout':<10}{'db size':>12}{'list docs':>12}")
+    print(f"{'legacy':<10}{results['legacy_size'] / 1e6:>10.1f}MB{results['legacy_list_ms']:>10.2f}ms")
+    print(f"{'store':<10}{results['store_size'] / 1e6:>10.1f}MB{results['store_list_ms']:>10.2f}ms")
+    print(f"size reduction: {results['legacy_size'] / results['store_size']:.1f}x, "
+          f"page load speedup: {results['legacy_list_ms'] / results['store_list_ms']:.1f}x")
+    print(f"opening one document's text: {results['store_open_ms']:.2f}ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+"""
+Benchmark for History tab paging: keyset cursors (list_claims_page) versus
+LIMIT/OFFSET, measured at increasing depths into a large claims table.
+
+    python benchmarks/bench_history.py --claims 100000 --page-size 10
+"""
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import database
+
+INCIDENTS = ("Auto collision", "Water damage", "Burglary", "Medical treatment")
+STATUSES = ("new", "in_review", "approved", "rejected")
+
+
+def seed(claims):
+    """Insert claims spread over two years, one per ~10 minutes"""
+    rng = random.Random(7)
+    rows = []
+    for i in range(claims):
+        data = {"incident": {"type": rng.choice(INCIDENTS)},
+                "assessment": {"fraud_risk": rng.randint(0, 100), "estimated_loss": f"${rng.randint(500, 50000)}"},
+                "summary": "Synthetic claim " * 20}
+        rows.append((json.dumps(data), rng.choice(STATUSES),
+                     time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime(1.65e9 + i * 600))))
+    with database.transaction() as c:
+        c.executemany("INSERT INTO claims (claim_data, status, created_at) VALUES (?, ?, ?)", rows)
+
+
+def offset_page(page, page_size, status=None):
+    """The OFFSET query a naive pager would run"""
+    where, params = ("WHERE status = ?", [status]) if status else ("", [])
+    return database.get_connection().execute(
+        f"SELECT id, status, created_at FROM claims {where} ORDER BY created_at DESC, id DESC LIMIT ? OFFSET ?",
+        params + [page_size, page * page_size]).fetchall()
+
+
+def timed(func, repeat=20):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        func()
+    return (time.perf_counter() - start) * 1000 / repeat
+
+
+def bench(claims, page_size, depths, status):
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        database.configure(os.path.join(tmp, "history.db"))
+        database.init_db()
+        seed(claims)
+
+        # Walk the keyset pages once, remembering the cursor that starts each target depth
+        cursors, cursor, page = {}, None, 0
+        while page <= max(depths):
+            if page in depths:
+                cursors[page] = cursor
+            _, cursor = database.list_claims_page(cursor, status=status, limit=page_size)
+            if cursor is None:
+                break
+            page += 1
+
+        for depth in depths:
+            if depth not in cursors:
+                continue
+            keyset_ms = timed(lambda: database.list_claims_page(cursors[depth], status=status, limit=page_size))
+            offset_ms = timed(lambda: offset_page(depth, page_size, status))
+            results.append((depth, keyset_ms, offset_ms))
+        database.close_connection()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--claims", type=int, default=100000)
+    parser.add_argument("--page-size", type=int, default=10)
+    parser.add_argument("--status", help="Also filter on this status, e.g. approved")
+    args = parser.parse_args()
+
+    last_page = args.claims // args.page_size - 1
+    depths = sorted({0, 10, 100, 1000, last_page // 2, last_page} - {d for d in (10, 100, 1000) if d > last_page})
+    results = bench(args.claims, args.page_size, depths, args.status)
+    print(f"{args.claims} claims, {args.page_size} per page" + (f", status={args.status}" if args.status else ""))
+    print(f"{'page':>8}{'keyset ms':>12}{'offset ms':>12}")
+    for depth, keyset_ms, offset_ms in results:
+        print(f"{depth:>8}{keyset_ms:>12.3f}{offset_ms:>12.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,174 @@
+"""
+Offline benchmark suite: per-stage timings against a local Ollama stub.
+
+    python -m pytest benchmarks -q
+    python -m pytest benchmarks -q --bench-compare benchmarks/results/<earlier commit>.json
+
+Every test times its stage with the `bench` fixture. At the end of the run the
+timings are written to benchmarks/results/<commit>.json (or --bench-json) and,
+with --bench-compare, checked against an earlier results file; stages slower
+than --bench-regression times their earlier median are reported.
+"""
+import os
+import sys
+import json
+import time
+import platform
+import statistics
+import subprocess
+
+import pytest
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, ROOT)
+
+import database
+import llm_cache
+import ollama_client
+import tracing
+from ollama_stub import OllamaStub
+
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "results")
+
+_results = {}
+
+
+def pytest_addoption(parser):
+    group = parser.getgroup("benchmarks")
+    group.addoption("--bench-rounds", type=int, default=int(os.environ.get("BENCH_ROUNDS", "10")),
+                    help="Timed rounds per benchmark")
+    group.addoption("--bench-json", help="Results file (default: benchmarks/results/<commit>.json)")
+    group.addoption("--bench-compare", help="Earlier results file to compare against")
+    group.addoption("--bench-regression", type=float, default=1.25,
+                    help="Median ratio above which a stage counts as regressed")
+    group.addoption("--bench-latency", type=float, default=float(os.environ.get("BENCH_OLLAMA_LATENCY", "0")),
+                    help="Seconds the Ollama stub waits before each reply")
+    group.addoption("--bench-token-latency", type=float,
+                    default=float(os.environ.get("BENCH_OLLAMA_TOKEN_LATENCY", "0")),
+                    help="Seconds the Ollama stub adds per output token")
+
+
+def _summary(seconds):
+    ms = sorted(s * 1000 for s in seconds)
+    return {
+        "rounds": len(ms),
+        "min_ms": round(ms[0], 4),
+        "median_ms": round(statistics.median(ms), 4),
+        "mean_ms": round(statistics.fmean(ms), 4),
+        "p95_ms": round(ms[min(len(ms) - 1, int(0.95 * len(ms)))], 4),
+        "max_ms": round(ms[-1], 4),
+        "stdev_ms": round(statistics.stdev(ms), 4) if len(ms) > 1 else 0.0,
+    }
+
+
+@pytest.fixture
+def bench(request):
+    """
+    bench(func, *args, rounds=None, warmup=1, name=None, **kwargs): time func over
+    warmup + rounds calls and record the timings under name (default: the test name without "test_").
+    Returns the last call's result.
+    """
+    def run(func, *args, rounds=None, warmup=1, name=None, **kwargs):
+        rounds = rounds or request.config.getoption("--bench-rounds")
+        result = None
+        for _ in range(warmup):
+            result = func(*args, **kwargs)
+        timings = []
+        for _ in range(rounds):
+            start = time.perf_counter()
+            result = func(*args, **kwargs)
+            timings.append(time.perf_counter() - start)
+        _results[name or request.node.name.removeprefix("test_")] = _summary(timings)
+        return result
+    return run
+
+
+@pytest.fixture(scope="session")
+def ollama_stub(pytestconfig):
+    """Ollama stub all model calls go to, with the LLM response cache bypassed"""
+    stub = OllamaStub(latency_sec=pytestconfig.getoption("--bench-latency"),
+                      token_latency_sec=pytestconfig.getoption("--bench-token-latency"))
+    with stub, pytest.MonkeyPatch.context() as patch:
+        patch.setattr(ollama_client, "OLLAMA_HOST", stub.url)
+        patch.setattr(llm_cache, "CACHE_ENABLED", False)
+        yield stub
+
+
+@pytest.fixture(scope="session", autouse=True)
+def session_db(tmp_path_factory):
+    """Keep everything the run writes (e.g. trace spans) out of the real claims database"""
+    previous = database.DB_PATH
+    database.configure(str(tmp_path_factory.mktemp("session") / "claims.db"))
+    database.init_db()
+    yield
+    tracing.flush()
+    database.configure(previous)
+
+
+@pytest.fixture(scope="module")
+def claims_db(tmp_path_factory):
+    """A fresh, migrated claims database for the module"""
+    previous = database.DB_PATH
+    database.configure(str(tmp_path_factory.mktemp("db") / "claims.db"))
+    database.init_db()
+    yield database.DB_PATH
+    # Spans from this module belong in its database, not the next one
+    tracing.flush()
+    database.configure(previous)
+
+
+def _commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def _results_path(config):
+    return config.getoption("--bench-json") or os.path.join(RESULTS_DIR, f"{_commit()}.json")
+
+
+def pytest_sessionfinish(session):
+    if not _results:
+        return
+    path = _results_path(session.config)
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump({
+            "commit": _commit(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+            "cpus": os.cpu_count(),
+            "ollama_latency_sec": session.config.getoption("--bench-latency"),
+            "results": dict(sorted(_results.items()))
+        }, f, indent=2)
+
+
+def pytest_terminal_summary(terminalreporter, config):
+    if not _results:
+        return
+    baseline = {}
+    compare = config.getoption("--bench-compare")
+    if compare:
+        with open(compare, encoding="utf-8") as f:
+            baseline = json.load(f)["results"]
+    threshold = config.getoption("--bench-regression")
+
+    terminalreporter.section("benchmarks")
+    terminalreporter.write_line(f"{'stage':<48}{'median ms':>12}{'p95 ms':>12}" + (f"{'vs base':>10}" if baseline else ""))
+    regressed = []
+    for name, stats in sorted(_results.items()):
+        line = f"{name:<48}{stats['median_ms']:>12.3f}{stats['p95_ms']:>12.3f}"
+        if name in baseline and baseline[name]["median_ms"]:
+            ratio = stats["median_ms"] / baseline[name]["median_ms"]
+            line += f"{ratio:>9.2f}x"
+            if ratio > threshold:
+                regressed.append(name)
+                line += "  REGRESSED"
+        terminalreporter.write_line(line)
+    terminalreporter.write_line(f"results written to {_results_path(config)}")
+    if regressed:
+        terminalreporter.write_line(f"{len(regressed)} stage(s) slower than {threshold}x the baseline median",
+                                    red=True)
@@ -0,0 +1,331 @@
+"""
+Load test for claim intake: N concurrent simulated claimant sessions drive the
+same calls as new_claim_tab (multi-turn analysis, follow-up questions,
+settlement, document uploads and database writes) against the Ollama stub.
+Concurrency ramps through the given steps; each step reports throughput,
+p50/p95/p99 turn latency, SQLite write-lock waits and model queueing delay.
+
+    python benchmarks/load_test.py --concurrency 1,2,4,8,16 --duration 30 --service-time lognormal:1.2:0.5 --parallel 2
+    python benchmarks/load_test.py --mode single_pass --turns 2 --uploads 0 --think-time 2
+    python benchmarks/load_test.py --ollama http://gpu-box:11434 --concurrency 1,4   # a real server instead
+
+The number of model calls in flight is capped by LLM_MAX_CONCURRENCY, as in the app.
+"""
+import os
+import sys
+import json
+import time
+import random
+import logging
+import argparse
+import tempfile
+import itertools
+import threading
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import fitz
+
+import app
+import database
+import llm_cache
+import llm_scheduler
+import ollama_client
+import tracing
+from document_processor import extract_text_from_upload, INTERACTIVE_PAGE_BUDGET
+from ollama_stub import OllamaStub, service_time_sampler
+
+logger = logging.getLogger(__name__)
+
+# The UI's analysis-mode switches (see streamlit_ui.py)
+INCREMENTAL_ANALYSIS = os.environ.get("CLAIMS_INCREMENTAL_ANALYSIS", "1") != "0"
+STREAM_ANALYSIS = os.environ.get("CLAIMS_STREAM_ANALYSIS", "1") != "0"
+SINGLE_PASS_ANALYSIS = os.environ.get("CLAIMS_SINGLE_PASS", "0") == "1"
+
+MODES = ("ui", "full", "stream", "incremental", "single_pass")
+
+# What a claimant types, turn by turn; {name} keeps prompts distinct across sessions
+MESSAGES = (
+    "My car was rear-ended at a red light on Main St on 14 March 2024. Policy AB123456. "
+    "The bumper and trunk are damaged and my neck hurts. {name}, 555-0142.",
+    "The police report number is SPD-2024-0311.",
+    "The body shop quoted $1,328.40 for the rear bumper, paint and labour.",
+    "I saw my doctor the next day and was diagnosed with a mild cervical strain.",
+    "The other driver was insured with Acme Mutual, policy XY-99812.",
+)
+PAGE_TEXT = ("Invoice 4471 for policy AB123456. Rear bumper replacement, paint and labour. "
+             "Total due $1,328.40. Claimant {name}, Springfield, 14 March 2024.\n")
+
+
+class Upload:
+    """Just enough of Streamlit's UploadedFile for extract_text_from_upload"""
+
+    def __init__(self, name, type, data):
+        self.name = name
+        self.type = type
+        self._data = data
+
+    def getvalue(self):
+        return self._data
+
+
+def make_uploads(name, count):
+    """A two-page invoice PDF and a text note, unique per session so uploads aren't deduplicated"""
+    with fitz.open() as doc:
+        for number in range(2):
+            page = doc.new_page()
+            page.insert_textbox(fitz.Rect(50, 50, 550, 800),
+                                f"Page {number + 1}\n" + PAGE_TEXT.format(name=name) * 12, fontsize=9)
+        pdf = doc.tobytes()
+    note = f"Statement from {name}: the other driver admitted fault at the scene.\n".encode()
+    files = [Upload("invoice.pdf", "application/pdf", pdf), Upload("statement.txt", "text/plain", note)]
+    return files[:count]
+
+
+def turn_mode(mode, previous):
+    """The analysis mode new_claim_tab would pick for this turn"""
+    if mode == "ui":
+        if SINGLE_PASS_ANALYSIS:
+            return "single_pass"
+        mode = "incremental" if INCREMENTAL_ANALYSIS else "stream" if STREAM_ANALYSIS else "full"
+    if mode == "incremental" and not (previous and "error" not in previous):
+        return "stream" if STREAM_ANALYSIS else "full"
+    return mode
+
+
+def analyze(mode, conversation, user_input, previous):
+    if mode == "incremental":
+        return app.analyze_claim_incremental(user_input, previous)
+    context = "\n".join(f"user: {msg['content']}" for msg in conversation if msg["role"] == "user")
+    if mode == "single_pass":
+        return app.analyze_claim_single_pass(context)
+    if mode == "stream":
+        events = list(app.analyze_claim_stream(context))
+        return events[-1]["result"]
+    return app.analyze_claim(context)
+
+
+class Step:
+    """Timings and counts for one concurrency step, shared by its session threads"""
+
+    def __init__(self, concurrency):
+        self.concurrency = concurrency
+        self.sessions = 0
+        self.turns = 0
+        self.turn_sec = []
+        self.upload_sec = []
+        self.modes = {}
+        self.errors = 0
+        self._lock = threading.Lock()
+
+    def record(self, kind, seconds, mode=None, error=False):
+        with self._lock:
+            if kind == "turn":
+                self.turns += 1
+                self.turn_sec.append(seconds)
+                self.modes[mode] = self.modes.get(mode, 0) + 1
+            else:
+                self.upload_sec.append(seconds)
+            self.errors += error
+
+
+def run_turn(session, user_input, step, mode):
+    """One chat turn as new_claim_tab runs it; the turn ends once the AI reply is saved"""
+    session["conversation"].append({"role": "user", "content": user_input})
+    mode = turn_mode(mode, session["analysis"])
+    start = time.perf_counter()
+    error = False
+    try:
+        with app.measure_turn(mode, session["claim_id"]):
+            error = _turn(session, user_input, mode)
+    except Exception:
+        logger.exception("Turn failed")
+        error = True
+    step.record("turn", time.perf_counter() - start, mode=mode, error=error)
+
+
+def _turn(session, user_input, mode):
+    """The turn's work; returns whether the analysis came back as an error"""
+    analysis_result = analyze(mode, session["conversation"], user_input, session["analysis"])
+    analysis = json.loads(analysis_result)
+    session["analysis"] = analysis
+    error = "error" in analysis
+    claim_id = session["claim_id"]
+    if claim_id is None:
+        claim_id = session["claim_id"] = database.save_claim(analysis)
+        tracing.set_claim(claim_id)
+        if not error:
+            app.precompute_settlement(claim_id, analysis)
+        for msg in session["conversation"]:
+            database.save_message(claim_id, msg["role"], msg["content"])
+    else:
+        database.save_message(claim_id, "user", user_input)
+        if not error:
+            database.update_claim_data(claim_id, analysis)
+    followups, _ = app.generate_claim_outputs(analysis_result, claim_id)
+    reply = analysis.get("summary", "Analysis completed.") + "\n" + "\n".join(followups[:3])
+    session["conversation"].append({"role": "ai", "content": reply})
+    database.save_message(claim_id, "ai", reply)
+    return error
+
+
+def run_upload(session, file, step):
+    start = time.perf_counter()
+    with tracing.span("upload", claim_id=session["claim_id"], filename=file.name):
+        result = extract_text_from_upload(file, page_budget=INTERACTIVE_PAGE_BUDGET)
+        if "text" in result and session["claim_id"]:
+            database.save_document(session["claim_id"], file.name, result.get("type", "unknown"),
+                                   result["text"], result, blob_sha256=result.get("sha256"))
+    step.record("upload", time.perf_counter() - start, error="text" not in result)
+
+
+def run_session(number, args, step, rng):
+    """A claimant describing their incident over several turns, uploading documents after the first"""
+    name = f"Claimant {number}"
+    session = {"claim_id": None, "analysis": None, "conversation": [
+        {"role": "ai", "content": "Hello! I'm your AI claims assistant. Please describe your incident."}]}
+    with llm_scheduler.request_context(priority=llm_scheduler.INTERACTIVE, user=f"session-{number}"):
+        for turn in range(args.turns):
+            if turn:
+                time.sleep(rng.expovariate(1 / args.think_time) if args.think_time else 0)
+            run_turn(session, MESSAGES[turn % len(MESSAGES)].format(name=name), step, args.mode)
+            if turn == 0:
+                for file in make_uploads(name, args.uploads):
+                    run_upload(session, file, step)
+    with step._lock:
+        step.sessions += 1
+
+
+def wait_for_background(timeout=60):
+    """Let settlement precomputes from the last step finish before the next one starts"""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        stats = llm_scheduler.get_stats()
+        if not stats["running"] and not any(stats["queued"].values()):
+            return
+        time.sleep(0.05)
+
+
+def percentile(values, p):
+    """Nearest-rank percentile"""
+    ordered = sorted(values)
+    return ordered[max(0, min(len(ordered) - 1, int(round(p / 100 * len(ordered))) - 1))] if ordered else 0.0
+
+
+def run_step(concurrency, args, numbers, stub):
+    """Keep `concurrency` sessions going for args.duration seconds; sessions in progress then finish"""
+    step = Step(concurrency)
+    database.reset_lock_stats()
+    llm_scheduler.reset_stats()
+    requests_before = sum(stub.requests.values()) if stub else 0
+    deadline = time.monotonic() + args.duration
+
+    def worker(index):
+        rng = random.Random(args.seed * 1000 + index)
+        while time.monotonic() < deadline:
+            run_session(next(numbers), args, step, rng)
+
+    start = time.perf_counter()
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    wait_for_background()
+
+    scheduler = llm_scheduler.get_stats()
+    locks = database.lock_stats()
+    return {
+        "concurrency": concurrency,
+        "elapsed_sec": round(elapsed, 2),
+        "sessions": step.sessions,
+        "turns": step.turns,
+        "turns_per_sec": round(step.turns / elapsed, 3),
+        "sessions_per_min": round(step.sessions * 60 / elapsed, 2),
+        "errors": step.errors,
+        "modes": step.modes,
+        "turn_ms": {f"p{p}": round(percentile(step.turn_sec, p) * 1000, 1) for p in (50, 95, 99)},
+        "upload_ms": {f"p{p}": round(percentile(step.upload_sec, p) * 1000, 1) for p in (50, 95)},
+        "db_lock": {"transactions": locks["transactions"], "waited": locks["waited"],
+                    "mean_wait_ms": round(locks["wait_sec"] * 1000 / max(1, locks["transactions"]), 3),
+                    "max_wait_ms": round(locks["max_wait_sec"] * 1000, 1)},
+        "llm_queue": {lane: {"count": w["count"], "mean_ms": round(w["mean_sec"] * 1000, 1),
+                             "max_ms": round(w["max_sec"] * 1000, 1)} for lane, w in scheduler["wait"].items()},
+        "llm_requests": scheduler["requests"],
+        "llm_coalesced": scheduler["coalesced"],
+        "ollama_requests": sum(stub.requests.values()) - requests_before if stub else None,
+    }
+
+
+def print_step(result):
+    turn, db, queue = result["turn_ms"], result["db_lock"], result["llm_queue"]
+    print(f"{result['concurrency']:>5}{result['turns_per_sec']:>9.2f}{turn['p50']:>10.0f}{turn['p95']:>10.0f}"
+          f"{turn['p99']:>10.0f}{result['errors']:>7}"
+          f"{db['waited']:>7}/{db['transactions']:<6}{db['max_wait_ms']:>11.1f}"
+          f"{queue['interactive']['mean_ms']:>10.0f}{queue['interactive']['max_ms']:>10.0f}"
+          f"{queue['background']['mean_ms']:>10.0f}", flush=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--concurrency", default="1,2,4,8", help="Comma-separated concurrent sessions per step")
+    parser.add_argument("--duration", type=float, default=20, help="Seconds each step starts new sessions for")
+    parser.add_argument("--turns", type=int, default=3, help="Chat turns per session")
+    parser.add_argument("--uploads", type=int, default=2, choices=(0, 1, 2), help="Documents uploaded per session")
+    parser.add_argument("--think-time", type=float, default=0.0, help="Mean seconds between a session's turns")
+    parser.add_argument("--mode", default="ui", choices=MODES,
+                        help="Analysis mode; ui picks per turn from the CLAIMS_* switches like the app")
+    parser.add_argument("--service-time", default="lognormal:0.5:0.5",
+                        help="Stub per-reply delay distribution: fixed:S, uniform:LOW:HIGH, exp:MEAN or "
+                             "lognormal:MEDIAN:SIGMA")
+    parser.add_argument("--token-latency", type=float, default=0.0, help="Stub seconds added per output token")
+    parser.add_argument("--parallel", type=int, help="Replies the stub generates at once (default: unlimited)")
+    parser.add_argument("--ollama", metavar="URL", help="Load a running Ollama server instead of the stub")
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--json", help="Also write the results to this file")
+    args = parser.parse_args()
+    steps = [int(n) for n in args.concurrency.split(",")]
+
+    # Per-turn INFO logs would drown the table
+    logging.getLogger().setLevel(logging.WARNING)
+    # Every session is new text; cached replies would hide the model load
+    llm_cache.CACHE_ENABLED = False
+    stub = None
+    if args.ollama:
+        ollama_client.OLLAMA_HOST = args.ollama
+    else:
+        random.seed(args.seed)
+        stub = OllamaStub(service_time=service_time_sampler(args.service_time),
+                          token_latency_sec=args.token_latency, parallel=args.parallel).start()
+        ollama_client.OLLAMA_HOST = stub.url
+
+    results = []
+    numbers = itertools.count(1)
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            database.configure(os.path.join(tmp, "load.db"))
+            database.init_db()
+            print(f"{args.turns} turns, {args.uploads} uploads per session; mode {args.mode}; "
+                  f"model {args.ollama or args.service_time}; "
+                  f"LLM_MAX_CONCURRENCY={llm_scheduler.get_scheduler().max_concurrency}")
+            print(f"{'conc':>5}{'turns/s':>9}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'errors':>7}"
+                  f"{'db waits':>14}{'db max ms':>11}{'queue ms':>10}{'q max ms':>10}{'bg q ms':>10}")
+            for concurrency in steps:
+                result = run_step(concurrency, args, numbers, stub)
+                results.append(result)
+                print_step(result)
+            tracing.flush()
+            database.close_connection()
+    finally:
+        if stub:
+            stub.stop()
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"args": vars(args), "steps": results}, f, indent=2)
+        print(f"Results written to {args.json}")
+
+
+if __name__ == "__main__":
+    main()
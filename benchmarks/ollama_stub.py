@@ -0,0 +1,272 @@
+"""
+Local stand-in for the Ollama HTTP API, for offline benchmarks.
+
+Speaks /api/chat and /api/generate (streamed and not) and /api/tags. Replies
+come from a recordings file: first an exact recording of the same request,
+then the first rule whose "match" text appears in the prompt, and otherwise an
+instance of the request's JSON Schema format (or a short text reply).
+Latency is injected per request: a fixed delay plus a per-output-token delay,
+so benchmarks see model time without a GPU. For load tests the fixed delay
+can instead be drawn from a service-time distribution, and --parallel caps how
+many replies are generated at once (like OLLAMA_NUM_PARALLEL); the rest queue.
+
+    python benchmarks/ollama_stub.py --port 11434 --latency 0.2 --token-latency 0.005
+    python benchmarks/ollama_stub.py --port 11434 --service-time lognormal:1.5:0.4 --parallel 2
+    python benchmarks/ollama_stub.py --port 11434 --record http://gpu-box:11434   # proxy and save replies
+"""
+import os
+import sys
+import json
+import math
+import time
+import socket
+import random
+import hashlib
+import argparse
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+import requests
+
+RECORDINGS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures", "ollama_recordings.json")
+
+
+def request_key(path, body):
+    """Identity of a request for exact replay: endpoint, model, prompt/messages and format"""
+    data = {"path": path, "model": body.get("model"), "format": body.get("format"),
+            "prompt": body.get("prompt"), "messages": body.get("messages")}
+    return hashlib.sha256(json.dumps(data, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+def schema_instance(schema):
+    """A plausible value of a JSON Schema, for formats no recording covers"""
+    kind = schema.get("type")
+    if kind == "object":
+        return {key: schema_instance(prop) for key, prop in schema.get("properties", {}).items()}
+    if kind == "array":
+        return [schema_instance(schema.get("items", {"type": "string"})) for _ in range(3)]
+    if kind in ("integer", "number"):
+        return max(schema.get("minimum", 0), min(schema.get("maximum", 35), 35))
+    if "enum" in schema:
+        return schema["enum"][0]
+    return "Not provided"
+
+
+def service_time_sampler(spec):
+    """
+    Seconds-per-reply sampler from "fixed:S", "uniform:LOW:HIGH", "exp:MEAN" or
+    "lognormal:MEDIAN:SIGMA"
+    """
+    kind, *params = spec.split(":")
+    params = [float(p) for p in params]
+    samplers = {
+        "fixed": lambda s: lambda: s,
+        "uniform": lambda low, high: lambda: random.uniform(low, high),
+        "exp": lambda mean: lambda: random.expovariate(1 / mean),
+        "lognormal": lambda median, sigma: lambda: random.lognormvariate(math.log(median), sigma),
+    }
+    if kind not in samplers:
+        raise ValueError(f"Unknown service-time distribution {kind!r}; use one of {', '.join(samplers)}")
+    return samplers[kind](*params)
+
+
+def load_recordings(path=RECORDINGS_PATH):
+    """{"rules": [{"endpoint", "match", "content"}], "recorded": {request_key: content}}"""
+    recordings = {"recorded": {}, "rules": []}
+    if path and os.path.exists(path):
+        with open(path, encoding="utf-8") as f:
+            recordings.update(json.load(f))
+    return recordings
+
+
+def _prompt(body):
+    if body.get("prompt") is not None:
+        return body["prompt"]
+    return "\n".join(message.get("content", "") for message in body.get("messages", []))
+
+
+class OllamaStub:
+    """Threaded HTTP server answering like Ollama; use as a context manager or start()/stop()"""
+
+    def __init__(self, recordings_path=RECORDINGS_PATH, latency_sec=0.0, token_latency_sec=0.0,
+                 host="127.0.0.1", port=0, record_upstream=None, service_time=None, parallel=None):
+        self.recordings_path = recordings_path
+        self.latency_sec = latency_sec
+        self.token_latency_sec = token_latency_sec
+        # Callable returning each reply's delay; overrides latency_sec
+        self.service_time = service_time
+        self._slots = threading.BoundedSemaphore(parallel) if parallel else None
+        self.record_upstream = record_upstream.rstrip("/") if record_upstream else None
+        self.recordings = load_recordings(recordings_path)
+        self.requests = {"/api/chat": 0, "/api/generate": 0}
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer((host, port), self._handler())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def reply(self, path, body):
+        """Reply text for a request"""
+        recorded = self.recordings["recorded"].get(request_key(path, body))
+        if recorded is not None:
+            return recorded
+        prompt = _prompt(body)
+        for rule in self.recordings["rules"]:
+            if rule.get("endpoint", path) == path and rule["match"] in prompt:
+                content = rule["content"]
+                return content if isinstance(content, str) else json.dumps(content)
+        if isinstance(body.get("format"), dict):
+            return json.dumps(schema_instance(body["format"]))
+        if body.get("format") == "json":
+            return "{}"
+        return "Stub reply."
+
+    def _upstream(self, path, body):
+        """Ask the real server and keep its reply for replay"""
+        response = requests.post(f"{self.record_upstream}{path}", json=dict(body, stream=False), timeout=600)
+        response.raise_for_status()
+        data = response.json()
+        content = data["message"]["content"] if path == "/api/chat" else data["response"]
+        with self._lock:
+            self.recordings["recorded"][request_key(path, body)] = content
+            with open(self.recordings_path, "w", encoding="utf-8") as f:
+                json.dump(self.recordings, f, indent=2)
+        return content
+
+    def _handler(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def setup(self):
+                super().setup()
+                # Small replies would otherwise sit out the client's delayed ACK (~40ms)
+                self.request.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+            def log_message(self, *args):
+                pass
+
+            def _send(self, status, data, content_type="application/json"):
+                self.send_response(status)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def do_GET(self):
+                if self.path == "/api/tags":
+                    self._send(200, json.dumps({"models": [{"name": "llama3:latest"}]}).encode())
+                else:
+                    self._send(404, b'{"error": "not found"}')
+
+            def do_POST(self):
+                if self.path not in stub.requests:
+                    self._send(404, b'{"error": "not found"}')
+                    return
+                body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+                with stub._lock:
+                    stub.requests[self.path] += 1
+                if stub._slots is None:
+                    self._reply(body)
+                else:
+                    with stub._slots:
+                        self._reply(body)
+
+            def _reply(self, body):
+                start = time.perf_counter()
+                text = stub._upstream(self.path, body) if stub.record_upstream else stub.reply(self.path, body)
+                stream = body.get("stream", True)
+                chunks = [text[i:i + 16] for i in range(0, len(text), 16)] if stream else [text]
+                final = {"model": body.get("model", ""), "done": True, "done_reason": "stop",
+                         "prompt_eval_count": len(_prompt(body)) // 4 + 1, "eval_count": len(text) // 4 + 1}
+                lines = [self._chunk(body, chunk, done=False) for chunk in chunks] if stream else []
+                final.update(self._chunk(body, "" if stream else text, done=True))
+
+                # Streamed replies arrive a chunk at a time, like tokens from a model
+                time.sleep(stub.service_time() if stub.service_time else stub.latency_sec)
+                # The wait before the first token stands in for prompt evaluation; the model is always loaded
+                prompt_done = time.perf_counter()
+                final.update(load_duration=0, prompt_eval_duration=int((prompt_done - start) * 1e9))
+                if not stream:
+                    time.sleep(stub.token_latency_sec * final["eval_count"])
+                    self._finish(final, start, prompt_done)
+                    self._send(200, json.dumps(final).encode())
+                    return
+                self.send_response(200)
+                self.send_header("Content-Type", "application/x-ndjson")
+                self.send_header("Transfer-Encoding", "chunked")
+                self.end_headers()
+                for line, chunk in zip(lines, chunks):
+                    self._write_chunk(json.dumps(line) + "\n")
+                    time.sleep(stub.token_latency_sec * (len(chunk) / 4))
+                self._finish(final, start, prompt_done)
+                self._write_chunk(json.dumps(final) + "\n")
+                self.wfile.write(b"0\r\n\r\n")
+
+            @staticmethod
+            def _finish(final, start, prompt_done):
+                now = time.perf_counter()
+                final["eval_duration"] = max(1, int((now - prompt_done) * 1e9))
+                final["total_duration"] = int((now - start) * 1e9)
+
+            def _chunk(self, body, content, done):
+                part = {"model": body.get("model", ""), "done": done}
+                if self.path == "/api/chat":
+                    part["message"] = {"role": "assistant", "content": content}
+                else:
+                    part["response"] = content
+                return part
+
+            def _write_chunk(self, text):
+                data = text.encode("utf-8")
+                self.wfile.write(f"{len(data):X}\r\n".encode() + data + b"\r\n")
+                self.wfile.flush()
+
+        return Handler
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=11434)
+    parser.add_argument("--recordings", default=RECORDINGS_PATH)
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds added to every reply")
+    parser.add_argument("--token-latency", type=float, default=0.0, help="Seconds added per output token")
+    parser.add_argument("--service-time", help="Per-reply delay distribution, e.g. exp:0.8 (overrides --latency)")
+    parser.add_argument("--parallel", type=int, help="Replies generated at once; the rest wait")
+    parser.add_argument("--record", metavar="OLLAMA_URL", help="Forward to this server and save its replies")
+    args = parser.parse_args()
+
+    stub = OllamaStub(args.recordings, args.latency, args.token_latency, args.host, args.port, args.record,
+                      service_time=service_time_sampler(args.service_time) if args.service_time else None,
+                      parallel=args.parallel)
+    print(f"Ollama stub listening on {stub.url}")
+    try:
+        stub._server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
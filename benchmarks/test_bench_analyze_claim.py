@@ -0,0 +1,53 @@
+"""End-to-end claim analysis against the Ollama stub (--bench-latency adds model time)."""
+import json
+
+import pytest
+
+import app
+from ollama_stub import load_recordings
+from test_bench_extraction import PAGE_TEXT
+
+CLAIM = ("My car was rear-ended at a red light on Main St on 14 March 2024. "
+         "Policy AB123456. The bumper and trunk are damaged and my neck hurts. John Carter, 555-0142.")
+DOCUMENTS = [
+    {"text": PAGE_TEXT * 30, "type": "pdf"},
+    {"text": "Emergency department discharge summary. Diagnosis: cervical strain. " * 20, "type": "text"},
+]
+
+@pytest.fixture(autouse=True)
+def model(ollama_stub, claims_db):
+    return ollama_stub
+
+
+def test_analyze_claim(bench):
+    result = json.loads(bench(app.analyze_claim, CLAIM, documents=DOCUMENTS, rounds=5))
+    assert "error" not in result and result["claimant"]["name"]
+
+
+def test_analyze_claim_stream(bench):
+    events = bench(lambda: list(app.analyze_claim_stream(CLAIM, documents=DOCUMENTS)), rounds=5)
+    assert "error" not in json.loads(events[-1]["result"])
+
+
+def test_analyze_claim_single_pass(bench):
+    result = json.loads(bench(app.analyze_claim_single_pass, CLAIM, documents=DOCUMENTS, rounds=5))
+    assert "error" not in result and result["followup_questions"]
+
+
+def test_analyze_claim_incremental(bench):
+    previous = next(rule["content"] for rule in load_recordings()["rules"]
+                    if rule["match"] == "Analyze this claim and provide structured output")
+    result = json.loads(bench(app.analyze_claim_incremental, "The police report number is SPD-2024-0311.",
+                              previous, rounds=5))
+    assert "error" not in result and result["assessment"]["completeness_score"] == 80
+
+
+def test_generate_claim_outputs(bench):
+    questions, settlement = bench(app.generate_claim_outputs, {"summary": CLAIM, "incident": {"type": "Auto"}},
+                                  rounds=5)
+    assert questions and settlement["confidence"]
+
+
+def test_generate_document_summary(bench):
+    summary = bench(app.generate_document_summary, {"text": PAGE_TEXT * 400, "type": "pdf"}, rounds=5)
+    assert "Key points" in summary
@@ -0,0 +1,111 @@
+"""Every database.py operation, against a seeded temporary database."""
+import hashlib
+import itertools
+
+import pytest
+
+import analytics
+import database
+
+SEED_CLAIMS = 2000
+INCIDENT_TYPES = ("Auto collision", "Water damage", "Theft", "Medical", "Fire")
+DOCUMENT_TEXT = "Repair invoice. Rear bumper replacement $820.00, paint and labour $410.00. " * 200
+
+_counter = itertools.count()
+
+
+def claim(i):
+    return {"claimant": {"name": f"Claimant {i}"},
+            "policy": {"number": f"PN{i:06d}", "type": "Auto"},
+            "incident": {"type": INCIDENT_TYPES[i % len(INCIDENT_TYPES)], "date": "2024-03-14"},
+            "assessment": {"estimated_loss": f"${1000 + i % 9000:,}", "fraud_risk": i % 100,
+                           "completeness_score": 60},
+            "summary": f"Seeded claim {i}"}
+
+
+@pytest.fixture(scope="module")
+def seeded(claims_db):
+    """Claim ids plus one claim with messages, documents, a blob and a settlement"""
+    with database.transaction():
+        ids = [database.save_claim(claim(i)) for i in range(SEED_CLAIMS)]
+    claim_id = ids[-1]
+    for i in range(20):
+        database.save_message(claim_id, "user" if i % 2 else "ai", f"message {i}")
+    sha256 = hashlib.sha256(DOCUMENT_TEXT.encode()).hexdigest()
+    database.save_document_blob(sha256, DOCUMENT_TEXT, {"type": "pdf", "page_count": 3})
+    database.save_document(claim_id, "invoice.pdf", "pdf", DOCUMENT_TEXT, {"type": "pdf"}, blob_sha256=sha256)
+    database.save_document(claim_id, "notes.txt", "text", DOCUMENT_TEXT, {"type": "text"})
+    database.save_settlement(claim_id, "hash", {"settlement_prediction": "Full", "confidence": 80})
+    document_id = database.get_claim_documents(claim_id)[0]["id"]
+    return {"ids": ids, "claim_id": claim_id, "sha256": sha256, "document_id": document_id}
+
+
+def _unique_sha():
+    return hashlib.sha256(f"blob {next(_counter)}".encode()).hexdigest()
+
+
+OPERATIONS = {
+    "save_claim": lambda s: database.save_claim(claim(next(_counter))),
+    "update_claim_data": lambda s: database.update_claim_data(s["claim_id"], claim(next(_counter))),
+    "update_claim_status": lambda s: database.update_claim_status(
+        s["claim_id"], ("processing", "completed")[next(_counter) % 2]),
+    "save_message": lambda s: database.save_message(s["claim_id"], "user", "Here is the police report number."),
+    "save_document": lambda s: database.save_document(s["claim_id"], "scan.txt", "text", DOCUMENT_TEXT),
+    "get_document_content": lambda s: database.get_document_content(s["document_id"]),
+    "save_document_blob": lambda s: database.save_document_blob(_unique_sha(), DOCUMENT_TEXT),
+    "update_document_blob": lambda s: database.update_document_blob(s["sha256"], summary="Invoice for repairs"),
+    "get_document_blob": lambda s: database.get_document_blob(s["sha256"]),
+    "get_document_blob_metadata": lambda s: database.get_document_blob(s["sha256"], with_text=False),
+    "save_settlement": lambda s: database.save_settlement(s["claim_id"], "hash", {"confidence": 80}),
+    "get_settlement": lambda s: database.get_settlement(s["claim_id"]),
+    "get_claim": lambda s: database.get_claim(s["claim_id"]),
+    "get_claim_conversation": lambda s: database.get_claim_conversation(s["claim_id"]),
+    "get_claim_documents": lambda s: database.get_claim_documents(s["claim_id"]),
+    "load_claim_bundle": lambda s: database.load_claim_bundle(s["claim_id"]),
+    "find_claims": lambda s: database.find_claims(incident_type="Theft", min_fraud_risk=50),
+    "list_claims_page": lambda s: database.list_claims_page(limit=20),
+    "list_claims_page_filtered": lambda s: database.list_claims_page(status="new", incident_type="Fire"),
+    "claim_statuses": lambda s: database.claim_statuses(),
+    "list_claims": lambda s: database.list_claims(),
+    "get_analytics": lambda s: database.get_analytics(),
+    "get_labelled_documents": lambda s: list(database.get_labelled_documents(("invoice", "policy"), limit=100)),
+}
+
+
+NUMERIC_FIELDS = [
+    ("$1,328.40", 12, 1328.4, 12),
+    ("₹50,000", "12%", 50000.0, 12),
+    ("USD 1,200", "Low", 1200.0, None),
+    ("Rs. 50,000", "35", 50000.0, 35),
+    (1200, 45, 1200.0, 45),
+    ("Not provided", None, None, None),
+    ("$1,000-$2,000", "30/100", None, None),
+]
+
+
+@pytest.mark.parametrize("loss, risk, expected_loss, expected_risk", NUMERIC_FIELDS)
+def test_numeric_claim_columns(claims_db, loss, risk, expected_loss, expected_risk):
+    """Amounts and scores parse through currency text; anything else is NULL, not 0"""
+    claim_id = database.save_claim({"assessment": {"estimated_loss": loss, "fraud_risk": risk}})
+    row = database.get_connection().execute(
+        "SELECT estimated_loss, fraud_risk FROM claims WHERE id=?", (claim_id,)).fetchone()
+    assert tuple(row) == (expected_loss, expected_risk)
+
+
+def test_update_unparsable_claim_data(claims_db):
+    """Replacing claim_data that isn't JSON leaves the rollups as a full rebuild would"""
+    claim_id = database.save_claim({"policy": {"type": "Auto"}, "assessment": {"fraud_risk": 40}})
+    with database.transaction() as c:
+        c.execute("UPDATE claims SET claim_data = 'not json' WHERE id = ?", (claim_id,))
+        analytics.rebuild(c)
+    database.update_claim_data(claim_id, {"policy": {"type": "Home"}, "assessment": {"fraud_risk": 20}})
+    query = "SELECT * FROM claim_rollup_monthly WHERE claim_count != 0 ORDER BY month, category"
+    rollups = database.get_connection().execute(query).fetchall()
+    with database.transaction() as c:
+        analytics.rebuild(c)
+    assert rollups == database.get_connection().execute(query).fetchall()
+
+
+@pytest.mark.parametrize("operation", sorted(OPERATIONS))
+def test_database_operation(bench, seeded, operation):
+    bench(OPERATIONS[operation], seeded, name=f"database.{operation}")
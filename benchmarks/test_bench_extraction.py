@@ -0,0 +1,85 @@
+"""Document extraction stages: PDF text, OCR and spaCy NER."""
+import io
+import itertools
+import shutil
+
+import fitz
+import pytest
+import spacy
+from PIL import Image, ImageDraw
+
+import document_processor
+
+PAGE_TEXT = ("Invoice 4471 for policy AB123456. Rear bumper replacement, paint and labour. "
+             "Total due $1,328.40. Claimant John Carter, Springfield, 14 March 2024.\n")
+
+_counter = itertools.count()
+
+
+def make_pdf(pages):
+    with fitz.open() as doc:
+        for number in range(pages):
+            page = doc.new_page()
+            page.insert_textbox(fitz.Rect(50, 50, 550, 800), f"Page {number + 1}\n" + PAGE_TEXT * 12, fontsize=9)
+        return doc.tobytes()
+
+
+def tesseract_available():
+    return shutil.which("tesseract") is not None
+
+
+def ner_model_available():
+    try:
+        document_processor.get_nlp()
+    except OSError:
+        return False
+    return True
+
+
+@pytest.mark.parametrize("pages", [5, 40])
+def test_pdf_extraction(bench, pages):
+    data = make_pdf(pages)
+    result = bench(document_processor.extract_pdf, data, rounds=5)
+    assert result["page_count"] == pages and "Total due" in result["text"]
+
+
+def test_pdf_extraction_page_budget(bench):
+    data = make_pdf(40)
+    result = bench(document_processor.extract_pdf, data, page_budget=document_processor.INTERACTIVE_PAGE_BUDGET,
+                   rounds=5)
+    assert result["pages"]
+
+
+@pytest.mark.skipif(not tesseract_available(), reason="tesseract binary not installed")
+def test_ocr_image(bench):
+    img = Image.new("RGB", (1700, 1100), "white")
+    draw = ImageDraw.Draw(img)
+    for line in range(20):
+        draw.text((60, 60 + line * 48), PAGE_TEXT.strip(), fill="black")
+    buffer = io.BytesIO()
+    img.save(buffer, format="PNG")
+    text, _ = bench(document_processor.ocr_image, Image.open(io.BytesIO(buffer.getvalue())), rounds=3)
+    assert text.strip()
+
+
+@pytest.mark.skipif(not ner_model_available(), reason=f"spaCy model {document_processor.NER_MODEL} not installed")
+def test_spacy_ner(bench):
+    # Fresh texts each round so the entity cache doesn't answer
+    def extract():
+        texts = [f"Document {next(_counter)}. " + PAGE_TEXT * 20 for _ in range(4)]
+        return document_processor.extract_document_entities(texts)
+
+    entities = bench(extract, rounds=5)
+    assert len(entities) == 4
+
+
+@pytest.mark.skipif(not ner_model_available(), reason=f"spaCy model {document_processor.NER_MODEL} not installed")
+def test_spacy_ner_pipeline(bench):
+    """The shared tok2vec is only kept if ner listens to it; time what keeping it would cost"""
+    nlp = document_processor.get_nlp()
+    if "tok2vec" in nlp.pipe_names:
+        assert "ner" in nlp.get_pipe("tok2vec").listening_components
+    full = spacy.load(document_processor.NER_MODEL, exclude=document_processor.NER_EXCLUDE)
+    texts = [PAGE_TEXT * 20 for _ in range(4)]
+    bench(lambda: list(nlp.pipe(texts)), rounds=5, name="spacy_ner_pipeline")
+    bench(lambda: list(full.pipe(texts)), rounds=5, name="spacy_ner_pipeline_with_shared_tok2vec")
@@ -0,0 +1,51 @@
+"""Parsing model replies: schema validation, local repair and incremental stream parsing."""
+import json
+
+from app import ANALYSIS_RESULT, CLAIM_DELTA_RESULT, merge_claim_delta
+from json_stream import IncrementalJSONParser
+from ollama_stub import load_recordings
+
+ANALYSIS = json.dumps(next(rule["content"] for rule in load_recordings()["rules"]
+                           if rule["match"] == "Analyze this claim and provide structured output"))
+# What a model without format constraints tends to send back
+NEAR_MISS = "Here is the analysis:\n```json\n" + ANALYSIS[:-1].replace('"fraud_risk": 12', '"fraud_risk": "12%"') + ",\n}\n```"
+TRUNCATED = ANALYSIS[:int(len(ANALYSIS) * 0.8)]
+# An incremental update that knows the new police report but not the scores
+DELTA = '{"incident": {"description": "Police report SPD-2024-0311 filed"}, ' \
+        '"assessment": {"fraud_risk": null, "completeness_score": null, "liability": null}}'
+
+
+def test_parse_clean_reply(bench):
+    result = bench(ANALYSIS_RESULT.parse, ANALYSIS, rounds=200)
+    assert result["assessment"]["fraud_risk"] == 12
+
+
+def test_parse_near_miss_reply(bench):
+    result = bench(ANALYSIS_RESULT.parse, NEAR_MISS, rounds=200)
+    assert result["assessment"]["fraud_risk"] == 12
+
+
+def test_parse_truncated_reply(bench):
+    result = bench(ANALYSIS_RESULT.parse, TRUNCATED, rounds=200)
+    assert result["claimant"]["name"] == "John Carter"
+
+
+def test_incremental_stream_parser(bench):
+    chunks = [ANALYSIS[i:i + 16] for i in range(0, len(ANALYSIS), 16)]
+
+    def parse_stream():
+        parser = IncrementalJSONParser()
+        for chunk in chunks:
+            parser.feed(chunk)
+        return parser
+
+    parser = bench(parse_stream, rounds=200)
+    assert parser.done and parser.result == json.loads(ANALYSIS)
+
+
+def test_delta_nulls_keep_known_values():
+    """A null in an incremental delta means unknown, never clear the field"""
+    state = json.loads(ANALYSIS)
+    merged = merge_claim_delta(state, CLAIM_DELTA_RESULT.parse(DELTA))
+    assert merged["incident"]["description"] == "Police report SPD-2024-0311 filed"
+    assert merged["assessment"] == state["assessment"]
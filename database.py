@@ -1,80 +1,489 @@
+import os
 import sqlite3
 import json
-from datetime import datetime
+import zlib
+import time
+import threading
+from contextlib import contextmanager
+from datetime import datetime, timezone
 
-def init_db():
-    conn = sqlite3.connect('claims_ai.db')
-    c = conn.cursor()
-    
-    # Create tables
-    c.execute('''CREATE TABLE IF NOT EXISTS claims (
-                 id INTEGER PRIMARY KEY AUTOINCREMENT,
-                 claim_data TEXT NOT NULL,
-                 status TEXT DEFAULT 'new',
+import analytics
+import tracing
+
+try:
+    import zstandard
+except ImportError:  # optional; zlib is used without it
+    zstandard = None
+
+# Database location; override with CLAIMS_DB_PATH or configure()
+DB_PATH = os.environ.get("CLAIMS_DB_PATH", "claims_ai.db")
+
+# Applied to every connection we open
+PRAGMAS = (
+    "PRAGMA journal_mode=WAL",        # readers don't block the writer
+    "PRAGMA synchronous=NORMAL",      # fsync at checkpoints only; safe with WAL
+    "PRAGMA cache_size=-16000",       # ~16 MB page cache per connection
+    "PRAGMA mmap_size=134217728",     # 128 MB memory-mapped reads
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA busy_timeout=5000",
+)
+
+# Compression for stored document text: "zstd" (needs the zstandard package) or "zlib"
+CONTENT_CODEC = os.environ.get("CLAIMS_CONTENT_CODEC", "zstd" if zstandard else "zlib")
+CONTENT_LEVEL = int(os.environ.get("CLAIMS_CONTENT_LEVEL", "6"))
+
+# Prepared statements kept per connection (sqlite3 reuses them for identical SQL)
+STATEMENT_CACHE_SIZE = 256
+
+_local = threading.local()
+
+# Time transaction() spent waiting for the write lock, for load tests and diagnostics
+_lock_stats = {"transactions": 0, "waited": 0, "wait_sec": 0.0, "max_wait_sec": 0.0}
+_lock_stats_lock = threading.Lock()
+# Waits shorter than this are not counted as contended
+LOCK_WAIT_THRESHOLD_SEC = 0.001
+
+def configure(path):
+    """Point the module at another database file"""
+    global DB_PATH
+    close_connection()
+    DB_PATH = path
+
+def open_connection(path):
+    """Open a tuned SQLite connection"""
+    conn = sqlite3.connect(path, timeout=30, cached_statements=STATEMENT_CACHE_SIZE)
+    for pragma in PRAGMAS:
+        conn.execute(pragma)
+    return conn
+
+def get_connection():
+    """This thread's connection to DB_PATH, opened on first use"""
+    conn = getattr(_local, "conn", None)
+    # A connection inherited through fork() must not be reused by the child
+    if conn is None or _local.path != DB_PATH or _local.pid != os.getpid():
+        if conn is not None and _local.pid == os.getpid():
+            conn.close()
+        conn = open_connection(DB_PATH)
+        _local.conn = conn
+        _local.path = DB_PATH
+        _local.pid = os.getpid()
+        _local.depth = 0
+    return conn
+
+def close_connection():
+    """Close this thread's connection, if any"""
+    conn = getattr(_local, "conn", None)
+    if conn is not None:
+        conn.close()
+        _local.conn = None
+
+@contextmanager
+def transaction(write=True):
+    """
+    Cursor inside a transaction on this thread's connection.
+    Nested blocks join the outer transaction, which commits (or rolls back) once.
+    Read-only blocks pass write=False so they don't queue for the write lock.
+    """
+    conn = get_connection()
+    depth = _local.depth
+    if write and depth == 0 and not conn.in_transaction:
+        # Take the write lock up front so the wait for it is measurable (and a
+        # deferred read lock can't fail to upgrade halfway through)
+        start = time.perf_counter()
+        conn.execute("BEGIN IMMEDIATE")
+        _record_lock_wait(time.perf_counter() - start)
+    _local.depth = depth + 1
+    try:
+        yield conn.cursor()
+        if depth == 0:
+            conn.commit()
+    except Exception:
+        if depth == 0:
+            conn.rollback()
+        raise
+    finally:
+        _local.depth = depth
+
+def _record_lock_wait(seconds):
+    with _lock_stats_lock:
+        _lock_stats["transactions"] += 1
+        if seconds >= LOCK_WAIT_THRESHOLD_SEC:
+            _lock_stats["waited"] += 1
+        _lock_stats["wait_sec"] += seconds
+        _lock_stats["max_wait_sec"] = max(_lock_stats["max_wait_sec"], seconds)
+
+def lock_stats():
+    """Write transactions, how many waited for the lock, and total/max seconds waited"""
+    with _lock_stats_lock:
+        return dict(_lock_stats)
+
+def reset_lock_stats():
+    with _lock_stats_lock:
+        _lock_stats.update(transactions=0, waited=0, wait_sec=0.0, max_wait_sec=0.0)
+
+def _json_field(path):
+    """SQL expression extracting a claim_data field (NULL for unparseable rows)"""
+    return f"CASE WHEN json_valid(claim_data) THEN json_extract(claim_data, '{path}') END"
+
+# Currency symbols and words (USD, Rs., approx) around numbers in model output
+_NUMBER_PREFIX = "$€£₹¥ .abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ"
+_NUMBER_SUFFIX = "$€£₹¥% .abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ"
+
+def _numeric_field(path, col_type):
+    """
+    SQL expression for a numeric claim_data field: "$1,328.40", "USD 1,200" or "12%" give the
+    number, anything else ("Not provided", "Low", "$1,000-$2,000") gives NULL rather than 0
+    """
+    text = f"RTRIM(LTRIM(REPLACE({_json_field(path)}, ',', ''), '{_NUMBER_PREFIX}'), '{_NUMBER_SUFFIX}')"
+    return (f"CASE WHEN {text} GLOB '*[0-9]*' AND {text} NOT GLOB '*[^0-9.]*' "
+            f"THEN CAST({text} AS {col_type}) END")
+
+# Generated columns on claims: (name, type, expression)
+CLAIM_COLUMNS = (
+    ("incident_type", "TEXT", _json_field("$.incident.type")),
+    ("fraud_risk", "INTEGER", _numeric_field("$.assessment.fraud_risk", "INTEGER")),
+    ("estimated_loss", "REAL", _numeric_field("$.assessment.estimated_loss", "REAL")),
+    ("policy_number", "TEXT", _json_field("$.policy.number")),
+)
+
+def _migrate_hot_query_indexes(c):
+    c.execute("CREATE INDEX IF NOT EXISTS idx_conversations_claim_ts ON conversations(claim_id, timestamp, id)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_documents_claim ON documents(claim_id)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_claims_created ON claims(created_at, id)")
+
+def _migrate_claim_columns(c):
+    existing = {row[1] for row in c.execute("PRAGMA table_xinfo(claims)")}
+    for name, col_type, expr in CLAIM_COLUMNS:
+        if name not in existing:
+            c.execute(f"ALTER TABLE claims ADD COLUMN {name} {col_type} GENERATED ALWAYS AS ({expr}) VIRTUAL")
+        c.execute(f"CREATE INDEX IF NOT EXISTS idx_claims_{name} ON claims({name}, created_at)")
+
+def _migrate_numeric_claim_columns(c):
+    """Re-create the numeric generated columns, which used to read unparseable values as 0"""
+    for name in ("fraud_risk", "estimated_loss"):
+        c.execute(f"DROP INDEX IF EXISTS idx_claims_{name}")
+        c.execute(f"ALTER TABLE claims DROP COLUMN {name}")
+    _migrate_claim_columns(c)
+
+def _migrate_analytics_rollups(c):
+    analytics.create_tables(c)
+    analytics.rebuild(c)
+
+def _migrate_document_blobs(c):
+    c.execute('''CREATE TABLE IF NOT EXISTS document_blobs (
+                 sha256 TEXT PRIMARY KEY,
+                 text TEXT,
+                 extraction TEXT,
+                 classification TEXT,
+                 entities TEXT,
+                 summary TEXT,
                  created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)''')
-    
-    c.execute('''CREATE TABLE IF NOT EXISTS conversations (
+    existing = {row[1] for row in c.execute("PRAGMA table_info(documents)")}
+    if "blob_sha256" not in existing:
+        c.execute("ALTER TABLE documents ADD COLUMN blob_sha256 TEXT REFERENCES document_blobs(sha256)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_documents_blob ON documents(blob_sha256)")
+
+def _migrate_document_content(c):
+    c.execute('''CREATE TABLE IF NOT EXISTS document_content (
                  id INTEGER PRIMARY KEY AUTOINCREMENT,
-                 claim_id INTEGER NOT NULL,
-                 role TEXT NOT NULL,
-                 content TEXT NOT NULL,
-                 timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                 FOREIGN KEY (claim_id) REFERENCES claims(id))''')
-    
-    c.execute('''CREATE TABLE IF NOT EXISTS documents (
+                 codec TEXT NOT NULL,
+                 size INTEGER NOT NULL,
+                 data BLOB NOT NULL)''')
+    for table in ("documents", "document_blobs"):
+        existing = {row[1] for row in c.execute(f"PRAGMA table_info({table})")}
+        if "content_id" not in existing:
+            c.execute(f"ALTER TABLE {table} ADD COLUMN content_id INTEGER REFERENCES document_content(id)")
+
+    # Move inline text into the compressed store and drop the copy embedded in analysis
+    rows = c.execute("SELECT id, content, analysis FROM documents WHERE content IS NOT NULL OR analysis IS NOT NULL")
+    for doc_id, content, analysis in rows.fetchall():
+        try:
+            analysis = json.dumps(_document_metadata(json.loads(analysis))) if analysis else None
+        except json.JSONDecodeError:
+            pass
+        c.execute("UPDATE documents SET content = NULL, content_id = COALESCE(?, content_id), analysis = ? WHERE id = ?",
+                  (_store_content(c, content), analysis, doc_id))
+    for sha256, text in c.execute("SELECT sha256, text FROM document_blobs WHERE text IS NOT NULL").fetchall():
+        c.execute("UPDATE document_blobs SET text = NULL, content_id = ? WHERE sha256 = ?",
+                  (_store_content(c, text), sha256))
+
+def _migrate_status_index(c):
+    # (status, created_at) plus the implicit rowid serves status-filtered keyset pages
+    c.execute("CREATE INDEX IF NOT EXISTS idx_claims_status ON claims(status, created_at)")
+
+def _migrate_classification_source(c):
+    # Who labelled the document ("llm" or "local"); only LLM labels train the local classifier
+    existing = {row[1] for row in c.execute("PRAGMA table_info(document_blobs)")}
+    if "classification_source" not in existing:
+        c.execute("ALTER TABLE document_blobs ADD COLUMN classification_source TEXT")
+
+def _migrate_traces(c):
+    # Spans written by tracing.py; started_at is Unix seconds
+    c.execute('''CREATE TABLE IF NOT EXISTS traces (
                  id INTEGER PRIMARY KEY AUTOINCREMENT,
+                 trace_id TEXT NOT NULL,
+                 span_id TEXT NOT NULL,
+                 parent_id TEXT,
+                 claim_id INTEGER,
+                 name TEXT NOT NULL,
+                 started_at REAL NOT NULL,
+                 duration_ms REAL NOT NULL,
+                 status TEXT NOT NULL,
+                 tags TEXT)''')
+    c.execute("CREATE INDEX IF NOT EXISTS idx_traces_claim ON traces(claim_id, started_at)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_traces_trace ON traces(trace_id)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_traces_started ON traces(started_at)")
+
+def _migrate_ingested_claims(c):
+    # Claims batch_ingest.py has written, keyed by manifest source and claim key
+    c.execute('''CREATE TABLE IF NOT EXISTS ingested_claims (
+                 source TEXT NOT NULL,
+                 key TEXT NOT NULL,
                  claim_id INTEGER NOT NULL,
-                 filename TEXT NOT NULL,
-                 doc_type TEXT NOT NULL,
-                 content TEXT,
-                 analysis TEXT,
+                 ingested_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                 PRIMARY KEY (source, key),
                  FOREIGN KEY (claim_id) REFERENCES claims(id))''')
-    
-    conn.commit()
-    conn.close()
 
+# Schema migrations, applied in order; PRAGMA user_version records how many have run
+MIGRATIONS = (
+    _migrate_hot_query_indexes,
+    _migrate_claim_columns,
+    _migrate_analytics_rollups,
+    _migrate_document_blobs,
+    _migrate_document_content,
+    _migrate_status_index,
+    _migrate_classification_source,
+    _migrate_traces,
+    _migrate_numeric_claim_columns,
+    _migrate_ingested_claims,
+)
+
+def migrate(c):
+    version = c.execute("PRAGMA user_version").fetchone()[0]
+    for number, step in enumerate(MIGRATIONS[version:], start=version + 1):
+        step(c)
+        c.execute(f"PRAGMA user_version = {number}")
+
+def init_db():
+    with transaction() as c:
+        # Create tables
+        c.execute('''CREATE TABLE IF NOT EXISTS claims (
+                     id INTEGER PRIMARY KEY AUTOINCREMENT,
+                     claim_data TEXT NOT NULL,
+                     status TEXT DEFAULT 'new',
+                     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)''')
+
+        c.execute('''CREATE TABLE IF NOT EXISTS conversations (
+                     id INTEGER PRIMARY KEY AUTOINCREMENT,
+                     claim_id INTEGER NOT NULL,
+                     role TEXT NOT NULL,
+                     content TEXT NOT NULL,
+                     timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                     FOREIGN KEY (claim_id) REFERENCES claims(id))''')
+
+        c.execute('''CREATE TABLE IF NOT EXISTS documents (
+                     id INTEGER PRIMARY KEY AUTOINCREMENT,
+                     claim_id INTEGER NOT NULL,
+                     filename TEXT NOT NULL,
+                     doc_type TEXT NOT NULL,
+                     content TEXT,
+                     analysis TEXT,
+                     FOREIGN KEY (claim_id) REFERENCES claims(id))''')
+
+        c.execute('''CREATE TABLE IF NOT EXISTS settlements (
+                     claim_id INTEGER PRIMARY KEY,
+                     input_hash TEXT NOT NULL,
+                     prediction TEXT NOT NULL,
+                     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                     FOREIGN KEY (claim_id) REFERENCES claims(id))''')
+
+        migrate(c)
+
+def _claim_month(c, claim_id):
+    row = c.execute("SELECT substr(created_at, 1, 7) FROM claims WHERE id=?", (claim_id,)).fetchone()
+    return row[0] if row else _current_month()
+
+def _current_month():
+    # CURRENT_TIMESTAMP defaults are UTC
+    return datetime.now(timezone.utc).strftime("%Y-%m")
+
+# Writes below also maintain the analytics rollups in the same transaction
+
+@tracing.traced("db.save_claim", root=False)
 def save_claim(claim_data):
-    conn = sqlite3.connect('claims_ai.db')
-    c = conn.cursor()
-    c.execute("INSERT INTO claims (claim_data) VALUES (?)", 
-              (json.dumps(claim_data),))
-    claim_id = c.lastrowid
-    conn.commit()
-    conn.close()
-    return claim_id
+    with transaction() as c:
+        c.execute("INSERT INTO claims (claim_data) VALUES (?)",
+                  (json.dumps(claim_data),))
+        claim_id = c.lastrowid
+        month = _claim_month(c, claim_id)
+        analytics.apply_claim(c, month, claim_data)
+        analytics.apply_status(c, month, "new")
+        return claim_id
+
+@tracing.traced("db.update_claim_data", root=False)
+def update_claim_data(claim_id, claim_data):
+    with transaction() as c:
+        row = c.execute("SELECT claim_data, substr(created_at, 1, 7) FROM claims WHERE id=?", (claim_id,)).fetchone()
+        c.execute("UPDATE claims SET claim_data = ? WHERE id = ?", (json.dumps(claim_data), claim_id))
+        if row:
+            analytics.apply_claim(c, row[1], row[0], sign=-1)
+            analytics.apply_claim(c, row[1], claim_data)
 
+@tracing.traced("db.update_claim_status", root=False)
 def update_claim_status(claim_id, status):
-    conn = sqlite3.connect('claims_ai.db')
-    c = conn.cursor()
-    c.execute("UPDATE claims SET status = ? WHERE id = ?", (status, claim_id))
-    conn.commit()
-    conn.close()
+    with transaction() as c:
+        row = c.execute("SELECT status, substr(created_at, 1, 7) FROM claims WHERE id=?", (claim_id,)).fetchone()
+        c.execute("UPDATE claims SET status = ? WHERE id = ?", (status, claim_id))
+        if row and row[0] != status:
+            analytics.apply_status(c, row[1], row[0] or "new", sign=-1)
+            analytics.apply_status(c, row[1], status)
 
+@tracing.traced("db.save_message", root=False)
 def save_message(claim_id, role, content):
-    conn = sqlite3.connect('claims_ai.db')
-    c = conn.cursor()
-    c.execute("INSERT INTO conversations (claim_id, role, content) VALUES (?, ?, ?)",
-              (claim_id, role, content))
-    conn.commit()
-    conn.close()
-
-def save_document(claim_id, filename, doc_type, content, analysis=None):
-    conn = sqlite3.connect('claims_ai.db')
-    c = conn.cursor()
-    c.execute('''INSERT INTO documents 
-                 (claim_id, filename, doc_type, content, analysis) 
-                 VALUES (?, ?, ?, ?, ?)''',
-              (claim_id, filename, doc_type, content, 
-               json.dumps(analysis) if analysis else None))
-    conn.commit()
-    conn.close()
+    with transaction() as c:
+        c.execute("INSERT INTO conversations (claim_id, role, content) VALUES (?, ?, ?)",
+                  (claim_id, role, content))
+        analytics.apply_activity(c, _current_month(), messages=1)
 
-def get_claim(claim_id):
-    conn = sqlite3.connect('claims_ai.db')
-    c = conn.cursor()
-    c.execute("SELECT claim_data, status, created_at FROM claims WHERE id=?", (claim_id,))
-    row = c.fetchone()
-    conn.close()
+def compress_content(text):
+    """(codec, bytes) for a document's text"""
+    raw = text.encode("utf-8")
+    if CONTENT_CODEC == "zstd" and zstandard is not None:
+        return "zstd", zstandard.ZstdCompressor(level=CONTENT_LEVEL).compress(raw)
+    return "zlib", zlib.compress(raw, CONTENT_LEVEL)
+
+def decompress_content(codec, data):
+    if codec == "zstd":
+        if zstandard is None:
+            raise RuntimeError("Document content is zstd-compressed; install the zstandard package")
+        return zstandard.ZstdDecompressor().decompress(data).decode("utf-8")
+    return zlib.decompress(data).decode("utf-8")
+
+def _store_content(c, text):
+    """Compress text into document_content; returns the new row id (None for no text)"""
+    if text is None:
+        return None
+    codec, data = compress_content(text)
+    c.execute("INSERT INTO document_content (codec, size, data) VALUES (?, ?, ?)", (codec, len(text), data))
+    return c.lastrowid
+
+def _load_content(c, content_id):
+    row = c.execute("SELECT codec, data FROM document_content WHERE id=?", (content_id,)).fetchone()
+    return decompress_content(*row) if row else None
+
+def _document_metadata(analysis):
+    """Extraction result without the text itself, which lives in the content store"""
+    if isinstance(analysis, dict):
+        return {k: v for k, v in analysis.items() if k != "text"}
+    return analysis
+
+@tracing.traced("db.save_document", root=False)
+def save_document(claim_id, filename, doc_type, content, analysis=None, blob_sha256=None):
+    with transaction() as c:
+        # Text of fingerprinted uploads lives once, with their document_blobs row;
+        # the document keeps its own copy if that row has no text
+        if blob_sha256 and not c.execute("SELECT 1 FROM document_blobs WHERE sha256=? AND content_id IS NOT NULL",
+                                         (blob_sha256,)).fetchone():
+            blob_sha256 = None
+        content_id = None if blob_sha256 else _store_content(c, content)
+        c.execute('''INSERT INTO documents
+                     (claim_id, filename, doc_type, analysis, blob_sha256, content_id)
+                     VALUES (?, ?, ?, ?, ?, ?)''',
+                  (claim_id, filename, doc_type,
+                   json.dumps(_document_metadata(analysis)) if analysis else None, blob_sha256, content_id))
+        analytics.apply_activity(c, _claim_month(c, claim_id), documents=1)
+
+def get_document_content(document_id):
+    """Full text of one stored document, decompressed on demand"""
+    c = get_connection()
+    row = c.execute('''SELECT COALESCE(d.content_id, b.content_id), d.content FROM documents d
+                        LEFT JOIN document_blobs b ON b.sha256 = d.blob_sha256
+                        WHERE d.id=?''', (document_id,)).fetchone()
+    if not row:
+        return None
+    content_id, inline = row
+    return _load_content(c, content_id) if content_id is not None else inline
+
+# Derived fields stored per unique document (text goes through save_document_blob);
+# extraction and entities are JSON-encoded
+BLOB_FIELDS = ("extraction", "classification", "classification_source", "entities", "summary")
+
+@tracing.traced("db.save_document_blob", root=False)
+def save_document_blob(sha256, text, extraction=None):
+    with transaction() as c:
+        c.execute("INSERT OR IGNORE INTO document_blobs (sha256) VALUES (?)", (sha256,))
+        old = c.execute("SELECT content_id FROM document_blobs WHERE sha256=?", (sha256,)).fetchone()[0]
+        c.execute("UPDATE document_blobs SET content_id = ?, extraction = ? WHERE sha256 = ?",
+                  (_store_content(c, text), json.dumps(extraction) if extraction is not None else None, sha256))
+        if old is not None:
+            c.execute("DELETE FROM document_content WHERE id=?", (old,))
+
+@tracing.traced("db.update_document_blob", root=False)
+def update_document_blob(sha256, **fields):
+    """Set derived fields (classification, entities, summary) on a stored blob"""
+    unknown = set(fields) - set(BLOB_FIELDS)
+    if unknown:
+        raise ValueError(f"Unknown document blob fields: {', '.join(sorted(unknown))}")
+    if not fields:
+        return
+    assignments = ", ".join(f"{name} = ?" for name in fields)
+    values = [json.dumps(value) if name in ("extraction", "entities") else value
+              for name, value in fields.items()]
+    with transaction() as c:
+        c.execute(f"UPDATE document_blobs SET {assignments} WHERE sha256 = ?", values + [sha256])
+
+@tracing.traced("db.get_document_blob", root=False)
+def get_document_blob(sha256, with_text=True):
+    """Stored blob fields; the text is only decompressed when with_text is set"""
+    c = get_connection()
+    row = c.execute(
+        "SELECT content_id, extraction, classification, entities, summary FROM document_blobs WHERE sha256=?",
+        (sha256,)).fetchone()
+    if row:
+        blob = {
+            "sha256": sha256,
+            "extraction": json.loads(row[1]) if row[1] else None,
+            "classification": row[2],
+            "entities": json.loads(row[3]) if row[3] else None,
+            "summary": row[4]
+        }
+        if with_text:
+            blob["text"] = _load_content(c, row[0]) if row[0] is not None else None
+        return blob
+    return None
+
+def get_labelled_documents(labels, source=None, limit=None):
+    """(classification, text) of stored documents labelled with one of labels, newest first"""
+    c = get_connection()
+    clauses = [f"classification IN ({', '.join('?' for _ in labels)})", "content_id IS NOT NULL"]
+    params = list(labels)
+    if source is not None:
+        # Labels stored before sources were recorded all came from the LLM
+        clauses.append("COALESCE(classification_source, 'llm') = ?")
+        params.append(source)
+    rows = c.execute(f"""SELECT classification, content_id FROM document_blobs
+                         WHERE {' AND '.join(clauses)} ORDER BY created_at DESC LIMIT ?""",
+                     params + [-1 if limit is None else limit]).fetchall()
+    for label, content_id in rows:
+        yield label, _load_content(c, content_id)
+
+@tracing.traced("db.save_settlement", root=False)
+def save_settlement(claim_id, input_hash, prediction):
+    with transaction() as c:
+        c.execute('''INSERT OR REPLACE INTO settlements (claim_id, input_hash, prediction)
+                     VALUES (?, ?, ?)''',
+                  (claim_id, input_hash, json.dumps(prediction)))
+
+@tracing.traced("db.get_settlement", root=False)
+def get_settlement(claim_id):
+    row = get_connection().execute(
+        "SELECT input_hash, prediction, created_at FROM settlements WHERE claim_id=?", (claim_id,)).fetchone()
+    if row:
+        return {"input_hash": row[0], "prediction": json.loads(row[1]), "created_at": row[2]}
+    return None
+
+def _fetch_claim(c, claim_id):
+    row = c.execute("SELECT claim_data, status, created_at FROM claims WHERE id=?", (claim_id,)).fetchone()
     if row:
         return {
             "id": claim_id,
@@ -84,31 +493,208 @@ def get_claim(claim_id):
         }
     return None
 
-def get_claim_conversation(claim_id):
-    conn = sqlite3.connect('claims_ai.db')
-    c = conn.cursor()
-    c.execute("SELECT role, content, timestamp FROM conversations WHERE claim_id=? ORDER BY timestamp", (claim_id,))
-    rows = c.fetchall()
-    conn.close()
+def _fetch_conversation(c, claim_id):
+    rows = c.execute(
+        "SELECT role, content, timestamp FROM conversations WHERE claim_id=? ORDER BY timestamp", (claim_id,)).fetchall()
     return [{"role": row[0], "content": row[1], "timestamp": row[2]} for row in rows]
 
-def get_claim_documents(claim_id):
-    conn = sqlite3.connect('claims_ai.db')
-    c = conn.cursor()
-    c.execute("SELECT id, filename, doc_type, analysis FROM documents WHERE claim_id=?", (claim_id,))
-    rows = c.fetchall()
-    conn.close()
+def _fetch_documents(c, claim_id):
+    rows = c.execute(
+        '''SELECT d.id, d.filename, d.doc_type, d.analysis, dc.size FROM documents d
+           LEFT JOIN document_blobs b ON b.sha256 = d.blob_sha256
+           LEFT JOIN document_content dc ON dc.id = COALESCE(d.content_id, b.content_id)
+           WHERE d.claim_id=?''', (claim_id,)).fetchall()
     return [{
         "id": row[0],
         "filename": row[1],
         "type": row[2],
-        "analysis": json.loads(row[3]) if row[3] else None
+        "analysis": json.loads(row[3]) if row[3] else None,
+        "content_size": row[4]
+    } for row in rows]
+
+def get_claim(claim_id):
+    return _fetch_claim(get_connection(), claim_id)
+
+def get_claim_conversation(claim_id):
+    return _fetch_conversation(get_connection(), claim_id)
+
+def get_claim_documents(claim_id):
+    """Document metadata for a claim; load the text itself with get_document_content"""
+    return _fetch_documents(get_connection(), claim_id)
+
+@tracing.traced("db.load_claim_bundle", root=False)
+def load_claim_bundle(claim_id):
+    """Claim, conversation and document metadata read from one snapshot; None if no such claim"""
+    with transaction(write=False) as c:
+        if not c.connection.in_transaction:
+            c.execute("BEGIN")
+        claim = _fetch_claim(c, claim_id)
+        if claim is None:
+            return None
+        return {
+            "claim": claim,
+            "conversation": _fetch_conversation(c, claim_id),
+            "documents": _fetch_documents(c, claim_id)
+        }
+
+def save_spans(rows):
+    """Insert (trace_id, span_id, parent_id, claim_id, name, started_at, duration_ms, status, tags) rows"""
+    with transaction() as c:
+        c.executemany('''INSERT INTO traces
+                         (trace_id, span_id, parent_id, claim_id, name, started_at, duration_ms, status, tags)
+                         VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)''', rows)
+
+def set_trace_claim(trace_id, claim_id):
+    with transaction() as c:
+        c.execute("UPDATE traces SET claim_id = ? WHERE trace_id = ?", (claim_id, trace_id))
+
+def get_claim_spans(claim_id):
+    """Every span of the claim's traces, oldest first"""
+    rows = get_connection().execute(
+        '''SELECT trace_id, span_id, parent_id, name, started_at, duration_ms, status, tags FROM traces
+           WHERE trace_id IN (SELECT DISTINCT trace_id FROM traces WHERE claim_id = ?)
+           ORDER BY started_at''', (claim_id,)).fetchall()
+    return [{
+        "trace_id": row[0],
+        "span_id": row[1],
+        "parent_id": row[2],
+        "name": row[3],
+        "started_at": row[4],
+        "duration_ms": row[5],
+        "status": row[6],
+        "tags": json.loads(row[7]) if row[7] else {}
+    } for row in rows]
+
+def get_stage_latencies(since, percentiles=(50, 95, 99)):
+    """
+    Per span name since a Unix time: (name, count, errors, max_ms, *nearest-rank percentile ms),
+    aggregated in SQL so only one row per stage comes back
+    """
+    ranks = ", ".join(f"MAX(CASE WHEN rank = MAX(1, MIN(n, CAST(ROUND({p / 100} * n) AS INTEGER))) "
+                      f"THEN duration_ms END)" for p in percentiles)
+    return get_connection().execute(
+        f'''WITH ranked AS (
+               SELECT name, duration_ms, status,
+                      ROW_NUMBER() OVER (PARTITION BY name ORDER BY duration_ms) AS rank,
+                      COUNT(*) OVER (PARTITION BY name) AS n
+               FROM traces WHERE started_at >= ?)
+            SELECT name, COUNT(*), SUM(status = 'error'), MAX(duration_ms), {ranks}
+            FROM ranked GROUP BY name''', (since,)).fetchall()
+
+def prune_spans(before, batch_size=10000):
+    """Delete spans started before a Unix time, a batch per transaction; returns how many"""
+    deleted = 0
+    while True:
+        with transaction() as c:
+            count = c.execute('''DELETE FROM traces WHERE id IN
+                                 (SELECT id FROM traces WHERE started_at < ? LIMIT ?)''',
+                              (before, batch_size)).rowcount
+        deleted += count
+        if count < batch_size:
+            return deleted
+
+def list_traced_claims(limit=50):
+    """Ids of the claims traced most recently, newest first"""
+    rows = get_connection().execute(
+        '''SELECT claim_id FROM traces WHERE claim_id IS NOT NULL
+           GROUP BY claim_id ORDER BY MAX(started_at) DESC LIMIT ?''', (limit,)).fetchall()
+    return [row[0] for row in rows]
+
+def get_ingested_keys(source):
+    """Keys of the claims already ingested from a batch source"""
+    rows = get_connection().execute("SELECT key FROM ingested_claims WHERE source=?", (source,)).fetchall()
+    return {row[0] for row in rows}
+
+def is_ingested(source, key):
+    return get_connection().execute(
+        "SELECT 1 FROM ingested_claims WHERE source=? AND key=?", (source, key)).fetchone() is not None
+
+def save_ingested_key(source, key, claim_id):
+    """Record an ingested claim; call inside the transaction that saved it so both commit together"""
+    with transaction() as c:
+        c.execute("INSERT INTO ingested_claims (source, key, claim_id) VALUES (?, ?, ?)", (source, key, claim_id))
+
+# Columns find_claims may sort by
+CLAIM_SORT_COLUMNS = ("created_at", "incident_type", "fraud_risk", "estimated_loss", "policy_number")
+
+def find_claims(incident_type=None, min_fraud_risk=None, policy_number=None,
+                order_by="created_at", descending=True, limit=50):
+    """Filter and sort claims on the indexed generated columns (no JSON parsing per row)"""
+    if order_by not in CLAIM_SORT_COLUMNS:
+        raise ValueError(f"Cannot sort claims by {order_by}")
+    clauses, params = [], []
+    if incident_type is not None:
+        clauses.append("incident_type = ?")
+        params.append(incident_type)
+    if min_fraud_risk is not None:
+        clauses.append("fraud_risk >= ?")
+        params.append(min_fraud_risk)
+    if policy_number is not None:
+        clauses.append("policy_number = ?")
+        params.append(policy_number)
+    where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+    direction = "DESC" if descending else "ASC"
+    rows = get_connection().execute(
+        f"""SELECT id, status, created_at, incident_type, fraud_risk, estimated_loss, policy_number
+            FROM claims {where} ORDER BY {order_by} {direction}, id {direction} LIMIT ?""",
+        params + [limit]).fetchall()
+    return [{
+        "id": row[0],
+        "status": row[1],
+        "created_at": row[2],
+        "incident_type": row[3],
+        "fraud_risk": row[4],
+        "estimated_loss": row[5],
+        "policy_number": row[6]
     } for row in rows]
 
+def list_claims_page(cursor=None, status=None, incident_type=None, limit=20):
+    """
+    One page of claims, newest first.
+    cursor is the (created_at, id) of the last claim on the previous page; returns
+    (claims, next_cursor) with next_cursor None on the last page. Each page is an
+    index range scan, so its cost doesn't grow with how far back it is. incident_type
+    is a virtual column: it is computed from claim_data, but only for the page's rows.
+    """
+    clauses, params = [], []
+    if cursor is not None:
+        clauses.append("(created_at, id) < (?, ?)")
+        params.extend(cursor)
+    if status is not None:
+        clauses.append("status = ?")
+        params.append(status)
+    if incident_type is not None:
+        clauses.append("incident_type = ?")
+        params.append(incident_type)
+    where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+    # One row past the page tells us whether there is a next page
+    rows = get_connection().execute(
+        f"""SELECT id, status, created_at, incident_type,
+                   (SELECT MAX(timestamp) FROM conversations WHERE claim_id = claims.id)
+            FROM claims {where} ORDER BY created_at DESC, id DESC LIMIT ?""",
+        params + [limit + 1]).fetchall()
+    claims = [{
+        "id": row[0],
+        "status": row[1],
+        "created_at": row[2],
+        "incident_type": row[3],
+        "last_activity": row[4] or row[2]
+    } for row in rows[:limit]]
+    next_cursor = (claims[-1]["created_at"], claims[-1]["id"]) if len(rows) > limit else None
+    return claims, next_cursor
+
+def claim_statuses():
+    """Statuses that have ever been used (read from the small status rollup)"""
+    rows = get_connection().execute(
+        '''SELECT status FROM status_rollup_monthly
+           GROUP BY status HAVING SUM(claim_count) > 0 ORDER BY status''').fetchall()
+    return [row[0] for row in rows]
+
 def list_claims(limit=10):
-    conn = sqlite3.connect('claims_ai.db')
-    c = conn.cursor()
-    c.execute("SELECT id, status, created_at FROM claims ORDER BY created_at DESC LIMIT ?", (limit,))
-    claims = [{"id": row[0], "status": row[1], "created_at": row[2]} for row in c.fetchall()]
-    conn.close()
-    return claims
\ No newline at end of file
+    rows = get_connection().execute(
+        "SELECT id, status, created_at FROM claims ORDER BY created_at DESC, id DESC LIMIT ?", (limit,)).fetchall()
+    return [{"id": row[0], "status": row[1], "created_at": row[2]} for row in rows]
+
+def get_analytics(months=12):
+    """Dashboard data read from the pre-aggregated rollup tables"""
+    return analytics.load_dashboard(get_connection(), months)
@@ -0,0 +1,249 @@
+"""
+Local document-type classifier.
+
+Hashed word unigram/bigram features and a softmax linear model over the same
+labels classify_document asks the LLM for. It is trained from labelled seeds
+plus the LLM's own past labels stored with uploaded documents; documents it
+is unsure about still go to the LLM, and every DOC_CLASSIFIER_RETRAIN_LABELS
+new LLM labels the model is retrained in the background to learn from them.
+
+Seeds alone are only confident on text close to them, so a fresh install
+sends most documents to the LLM at first; the share classified locally grows
+as labels accumulate (see benchmarks/bench_doc_classifier.py --simulate).
+
+    python doc_classifier.py --db claims_ai.db     # retrain and save the model
+"""
+import os
+import re
+import sys
+import zlib
+import sqlite3
+import argparse
+import logging
+import threading
+
+import numpy as np
+
+import database
+
+logger = logging.getLogger(__name__)
+
+LABELS = ("policy", "claim_form", "medical_report", "invoice", "identification",
+          "damage_photos", "correspondence", "other")
+
+MODEL_PATH = os.environ.get("DOC_CLASSIFIER_PATH", "doc_classifier.npz")
+# Below this probability for the best label the LLM is asked instead
+CONFIDENCE_THRESHOLD = float(os.environ.get("DOC_CLASSIFIER_THRESHOLD", "0.8"))
+# New LLM labels that trigger a background retrain; 0 keeps the loaded model
+RETRAIN_AFTER_LABELS = int(os.environ.get("DOC_CLASSIFIER_RETRAIN_LABELS", "50"))
+
+HASH_BITS = 16                # 65,536 feature buckets
+MAX_CHARS = 4000              # text past this is ignored
+TRAIN_EPOCHS = 12
+TRAIN_STEPS = 5000            # minimum SGD updates, so small training sets still converge
+LEARNING_RATE = 2.0
+L2 = 1e-5
+
+_TOKEN = re.compile(r"[a-z][a-z0-9']+|\d+")
+
+# Labelled examples so the model is usable before any LLM labels exist
+SEEDS = (
+    ("policy", "Policy number HX-20931 declarations page. Insured: Maria Lopez. Policy period 01/01/2024 to "
+               "01/01/2025. Coverage A dwelling limit $350,000, deductible $1,000. Premium $1,240 annually."),
+    ("policy", "This insurance policy is a contract between you and the insurer. Coverages, exclusions and "
+               "conditions. Liability coverage, collision coverage, comprehensive coverage, endorsements."),
+    ("policy", "Certificate of insurance. Named insured, policy effective date, expiration date, limits of "
+               "liability, premium, underwriter, renewal terms and conditions of coverage."),
+    ("claim_form", "Claim form. Claimant name, policy number, date of loss, time of loss, location of "
+                   "incident, description of what happened, claimant signature, date signed."),
+    ("claim_form", "First notice of loss. Please complete all sections. Section 1 insured details. Section 2 "
+                   "incident details. Section 3 witnesses. I declare the information provided is true."),
+    ("claim_form", "Proof of loss statement. Amount claimed, cause of loss, sworn statement of claimant, "
+                   "claim number, adjuster assigned, attach supporting documents."),
+    ("medical_report", "Patient: John Smith. Diagnosis: cervical strain following motor vehicle accident. "
+                       "Treatment: physiotherapy twice weekly, prescribed ibuprofen. Attending physician Dr. Patel."),
+    ("medical_report", "Emergency department discharge summary. Chief complaint, history of present illness, "
+                       "examination findings, x-ray results, diagnosis, medication, follow-up with GP."),
+    ("medical_report", "Hospital admission record. Injury assessment, fracture of left wrist, surgery performed, "
+                       "clinical notes, prognosis, recommended rehabilitation and treatment plan."),
+    ("invoice", "Invoice #4471. Bill to: Jane Doe. Rear bumper replacement $820.00, paint and labour "
+                "$410.00, subtotal $1,230.00, tax $98.40, total due $1,328.40. Payment terms net 30."),
+    ("invoice", "Repair estimate and invoice. Parts, labour hours, rate per hour, quantity, unit price, "
+                "amount, subtotal, VAT, balance due. Thank you for your business."),
+    ("invoice", "Receipt for payment. Item description, qty, price, total paid by card. Invoice date, "
+                "invoice number, supplier address, tax registration number."),
+    ("identification", "Driver licence. Class C. Date of birth 04/12/1985. Licence number D1234-5678. Expires "
+                       "04/12/2028. Sex F. Height 5-06. Address 12 Oak Street."),
+    ("identification", "Passport. Surname, given names, nationality, date of birth, place of birth, date of "
+                       "issue, date of expiry, passport number, authority."),
+    ("identification", "National identity card. ID number, holder photograph, signature of holder, issued by, "
+                       "valid until. Vehicle registration certificate, VIN, registered owner."),
+    ("damage_photos", "Photo of vehicle damage. Dented rear bumper, cracked tail light, scratches on the "
+                      "passenger door. Image taken at the scene showing the collision damage."),
+    ("damage_photos", "Photographs of water damage in kitchen: stained ceiling, warped flooring, mould on "
+                      "wall. Pictures of burst pipe under sink. Photo 1 of 6."),
+    ("damage_photos", "Image shows broken window and damaged door frame after the burglary, smoke damage to "
+                      "living room walls, fire damaged roof. Close-up photo of the damage."),
+    ("correspondence", "Dear Mr. Brown, thank you for your letter regarding claim 55821. We have reviewed your "
+                       "request and will contact you shortly. Kind regards, Claims Department."),
+    ("correspondence", "From: adjuster@insurer.com To: claimant Subject: Re: your claim. Hi, following up on "
+                       "our phone call, please send the repair estimate. Best regards."),
+    ("correspondence", "Letter to policyholder. We are writing to inform you of the decision on your claim. If "
+                       "you have questions please reply to this email. Sincerely, customer service."),
+    ("other", "Meeting notes. Agenda items, action points, next steps. Lorem ipsum general information "
+              "unrelated to the claim."),
+    ("other", "Weather report for the region: heavy rain and strong winds expected, temperatures falling "
+              "overnight. Traffic updates and road closures."),
+    ("other", "Table of contents. Chapter 1 introduction. Chapter 2 background. Appendix. Index. Page 1 of 12."),
+)
+
+
+def _hash(feature):
+    return zlib.crc32(feature.encode("utf-8")) & ((1 << HASH_BITS) - 1)
+
+
+def features(text):
+    """Sparse (indices, values) for text: hashed word unigrams and bigrams, log-scaled, L2-normalized"""
+    tokens = _TOKEN.findall(text[:MAX_CHARS].lower())
+    counts = {}
+    for i, token in enumerate(tokens):
+        index = _hash(token)
+        counts[index] = counts.get(index, 0) + 1
+        if i:
+            index = _hash(f"{tokens[i - 1]} {token}")
+            counts[index] = counts.get(index, 0) + 1
+    if not counts:
+        return np.zeros(0, dtype=np.int64), np.zeros(0)
+    indices = np.fromiter(counts.keys(), dtype=np.int64, count=len(counts))
+    values = np.log1p(np.fromiter(counts.values(), dtype=float, count=len(counts)))
+    return indices, values / np.linalg.norm(values)
+
+
+class DocumentClassifier:
+    """Softmax regression over hashed n-gram features"""
+
+    def __init__(self, weights=None, bias=None):
+        self.weights = weights if weights is not None else np.zeros((1 << HASH_BITS, len(LABELS)))
+        self.bias = bias if bias is not None else np.zeros(len(LABELS))
+
+    def probabilities(self, text):
+        indices, values = features(text)
+        scores = self.bias + values @ self.weights[indices]
+        scores = np.exp(scores - scores.max())
+        return scores / scores.sum()
+
+    def predict(self, text):
+        """(label, confidence)"""
+        probs = self.probabilities(text)
+        best = int(probs.argmax())
+        return LABELS[best], float(probs[best])
+
+    def fit(self, examples, epochs=None, seed=0):
+        """Train on (label, text) pairs with plain SGD; unknown labels are skipped"""
+        data = [(features(text), LABELS.index(label)) for label, text in examples if label in LABELS]
+        if epochs is None:
+            epochs = max(TRAIN_EPOCHS, TRAIN_STEPS // max(1, len(data)))
+        rng = np.random.default_rng(seed)
+        for epoch in range(epochs):
+            rate = LEARNING_RATE / (1 + epoch)
+            for n in rng.permutation(len(data)):
+                (indices, values), target = data[n]
+                scores = self.bias + values @ self.weights[indices]
+                probs = np.exp(scores - scores.max())
+                probs /= probs.sum()
+                probs[target] -= 1
+                self.weights[indices] -= rate * (np.outer(values, probs) + L2 * self.weights[indices])
+                self.bias -= rate * probs
+        return self
+
+    def save(self, path=MODEL_PATH):
+        np.savez_compressed(path, weights=self.weights, bias=self.bias, labels=np.array(LABELS))
+
+    @classmethod
+    def load(cls, path=MODEL_PATH):
+        data = np.load(path)
+        if tuple(data["labels"]) != LABELS or data["weights"].shape[0] != 1 << HASH_BITS:
+            raise ValueError(f"{path} was trained for a different label set or feature size")
+        return cls(data["weights"], data["bias"])
+
+
+def training_examples(limit=None):
+    """Seeds plus the LLM labels stored with previously uploaded documents"""
+    try:
+        return list(SEEDS) + list(database.get_labelled_documents(LABELS, source="llm", limit=limit))
+    except sqlite3.Error as e:
+        logger.warning(f"Could not read labelled documents, training on seeds only: {str(e)}")
+        return list(SEEDS)
+
+
+def train(limit=None):
+    examples = training_examples(limit)
+    logger.info(f"Training document classifier on {len(examples)} examples")
+    return DocumentClassifier().fit(examples)
+
+
+# Bounded so training on first use (and each retrain) stays quick
+TRAIN_LIMIT = 2000
+
+_classifier = None
+_classifier_lock = threading.Lock()
+_new_labels = 0
+_retraining = False
+
+
+def get_classifier():
+    """Process-wide classifier: the saved model if there is one, else trained now"""
+    global _classifier
+    with _classifier_lock:
+        if _classifier is None:
+            try:
+                _classifier = DocumentClassifier.load()
+            except (OSError, ValueError) as e:
+                logger.info(f"No usable saved document classifier ({str(e)}); training one")
+                _classifier = train(limit=TRAIN_LIMIT)
+        return _classifier
+
+
+def record_llm_label():
+    """Count a label the LLM just gave; retrain in the background every RETRAIN_AFTER_LABELS of them"""
+    global _new_labels, _retraining
+    with _classifier_lock:
+        _new_labels += 1
+        if not RETRAIN_AFTER_LABELS or _new_labels < RETRAIN_AFTER_LABELS or _retraining:
+            return
+        _new_labels = 0
+        _retraining = True
+    threading.Thread(target=_retrain, name="doc-classifier-retrain", daemon=True).start()
+
+
+def _retrain():
+    global _classifier, _retraining
+    try:
+        classifier = train(limit=TRAIN_LIMIT)
+        with _classifier_lock:
+            _classifier = classifier
+    except Exception as e:
+        logger.warning(f"Document classifier retrain failed: {str(e)}")
+    finally:
+        with _classifier_lock:
+            _retraining = False
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--db", help="SQLite database with labelled documents (default: CLAIMS_DB_PATH)")
+    parser.add_argument("--output", default=MODEL_PATH)
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+    if args.db:
+        database.configure(args.db)
+    database.init_db()
+    classifier = train()
+    classifier.save(args.output)
+    print(f"Saved document classifier to {args.output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,68 @@
+"""
+Process-pool workers for document extraction.
+Kept free of heavy imports (spaCy, Ollama) so spawned workers start quickly.
+"""
+import time
+
+import fitz  # PyMuPDF
+import pytesseract
+from PIL import Image, ImageOps
+
+# Pages with less extractable text than this are treated as scanned
+TEXT_LAYER_MIN_CHARS = 20
+
+def extract_page_range(path, start, stop):
+    """Text of pages [start, stop) of the PDF at path, as (page_number, text) pairs"""
+    with fitz.open(path) as doc:
+        return [(number, doc[number].get_text()) for number in range(start, stop)]
+
+def has_text_layer(text):
+    return len(text.strip()) >= TEXT_LAYER_MIN_CHARS
+
+def _otsu_threshold(gray):
+    """Threshold that best separates ink from background (Otsu's method)"""
+    histogram = gray.histogram()[:256]
+    total = sum(histogram)
+    sum_all = sum(level * count for level, count in enumerate(histogram))
+    sum_background, weight_background = 0.0, 0
+    best_level, best_variance = 127, 0.0
+    for level, count in enumerate(histogram):
+        weight_background += count
+        if weight_background == 0:
+            continue
+        weight_foreground = total - weight_background
+        if weight_foreground == 0:
+            break
+        sum_background += level * count
+        mean_background = sum_background / weight_background
+        mean_foreground = (sum_all - sum_background) / weight_foreground
+        variance = weight_background * weight_foreground * (mean_background - mean_foreground) ** 2
+        if variance > best_variance:
+            best_level, best_variance = level, variance
+    return best_level
+
+def preprocess_for_ocr(img, max_side):
+    """Grayscale, downscale so the long side is at most max_side, and binarize"""
+    gray = ImageOps.exif_transpose(img).convert("L")
+    scale = max_side / max(gray.size)
+    if scale < 1:
+        gray = gray.resize((max(1, int(gray.width * scale)), max(1, int(gray.height * scale))),
+                           Image.Resampling.LANCZOS)
+    gray = ImageOps.autocontrast(gray)
+    threshold = _otsu_threshold(gray)
+    return gray.point(lambda p: 255 if p > threshold else 0, mode="1")
+
+def ocr_image(img):
+    """Tesseract on an already-preprocessed image; returns (text, seconds)"""
+    start = time.time()
+    text = pytesseract.image_to_string(img)
+    return text, time.time() - start
+
+def ocr_pdf_page(path, number, dpi, max_side):
+    """Rasterize one PDF page at dpi and OCR it; returns (text, seconds)"""
+    start = time.time()
+    with fitz.open(path) as doc:
+        pix = doc[number].get_pixmap(dpi=dpi, colorspace=fitz.csGRAY)
+        img = Image.frombytes("L", (pix.width, pix.height), pix.samples)
+    text, _ = ocr_image(preprocess_for_ocr(img, max_side))
+    return text, time.time() - start
@@ -0,0 +1,64 @@
+import json
+
+
+class IncrementalJSONParser:
+    """
+    Incremental parser for a streamed JSON object.
+    Feed it text chunks as they arrive; it returns each top-level
+    (key, value) member as soon as that member is complete.
+    Text before the opening brace (prose, code fences) is ignored.
+    """
+
+    def __init__(self):
+        self.buffer = ""
+        self.result = {}
+        self.done = False
+        self._pos = 0
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self._member_start = None
+
+    def feed(self, chunk):
+        """Consume a chunk and return the list of newly completed (key, value) members"""
+        self.buffer += chunk
+        members = []
+        while self._pos < len(self.buffer) and not self.done:
+            ch = self.buffer[self._pos]
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif ch == "\\":
+                    self._escape = True
+                elif ch == '"':
+                    self._in_string = False
+            elif self._depth == 0:
+                if ch == "{":
+                    self._depth = 1
+                    self._member_start = self._pos + 1
+            elif ch == '"':
+                self._in_string = True
+            elif ch in "{[":
+                self._depth += 1
+            elif ch in "}]":
+                self._depth -= 1
+                if self._depth == 0:
+                    members += self._close_member(self._pos)
+                    self.done = True
+            elif ch == "," and self._depth == 1:
+                members += self._close_member(self._pos)
+                self._member_start = self._pos + 1
+            self._pos += 1
+        return members
+
+    def _close_member(self, end):
+        text = self.buffer[self._member_start:end].strip()
+        if not text:
+            return []
+        try:
+            member = json.loads("{" + text + "}")
+        except json.JSONDecodeError:
+            # Leave malformed members to the full-response parse
+            return []
+        self.result.update(member)
+        return list(member.items())
@@ -0,0 +1,247 @@
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+
+import ollama_client
+import llm_scheduler
+from database import open_connection
+
+logger = logging.getLogger(__name__)
+
+CACHE_PATH = os.environ.get("LLM_CACHE_PATH", "llm_cache.db")
+CACHE_TTL_SEC = int(os.environ.get("LLM_CACHE_TTL_SEC", str(7 * 24 * 3600)))
+CACHE_MAX_BYTES = int(os.environ.get("LLM_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+CACHE_MEMORY_ENTRIES = int(os.environ.get("LLM_CACHE_MEMORY_ENTRIES", "256"))
+CACHE_ENABLED = os.environ.get("LLM_CACHE_DISABLED", "") == ""
+
+# How many writes between size checks on the SQLite tier
+EVICTION_INTERVAL = 50
+
+
+class LLMCache:
+    """Two-tier (in-memory LRU + SQLite) cache for LLM responses"""
+
+    def __init__(self, path=CACHE_PATH, ttl_sec=CACHE_TTL_SEC, max_bytes=CACHE_MAX_BYTES,
+                 memory_entries=CACHE_MEMORY_ENTRIES):
+        self.path = path
+        self.ttl_sec = ttl_sec
+        self.max_bytes = max_bytes
+        self.memory_entries = memory_entries
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._writes = 0
+        self._stats = {"memory_hits": 0, "disk_hits": 0, "misses": 0,
+                       "stores": 0, "evictions": 0, "saved_sec": 0.0}
+        self._init_disk()
+
+    @staticmethod
+    def make_key(kind, model, prompt, options=None, format=None):
+        """Content address for a request: hash of (kind, model, prompt, options, format)"""
+        payload = json.dumps({
+            "kind": kind,
+            "model": model,
+            "prompt": prompt,
+            "options": options or {},
+            "format": format or ""
+        }, sort_keys=True, ensure_ascii=False)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = open_connection(self.path)
+            self._local.conn = conn
+        return conn
+
+    def _init_disk(self):
+        conn = self._conn()
+        conn.execute('''CREATE TABLE IF NOT EXISTS llm_cache (
+                        key TEXT PRIMARY KEY,
+                        kind TEXT NOT NULL,
+                        model TEXT,
+                        value TEXT NOT NULL,
+                        size INTEGER NOT NULL,
+                        cost_sec REAL DEFAULT 0,
+                        created_at REAL NOT NULL,
+                        accessed_at REAL NOT NULL)''')
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_llm_cache_accessed ON llm_cache(accessed_at)")
+        conn.commit()
+
+    def get(self, key):
+        """Return the cached value for key, or None on a miss"""
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None and now - entry["created_at"] <= self.ttl_sec:
+                self._memory.move_to_end(key)
+                self._stats["memory_hits"] += 1
+                self._stats["saved_sec"] += entry["cost_sec"]
+                return entry["value"]
+            if entry is not None:
+                del self._memory[key]
+
+        try:
+            conn = self._conn()
+            row = conn.execute("SELECT value, cost_sec, created_at FROM llm_cache WHERE key=?",
+                               (key,)).fetchone()
+            if row and now - row[2] <= self.ttl_sec:
+                conn.execute("UPDATE llm_cache SET accessed_at=? WHERE key=?", (now, key))
+                conn.commit()
+                value = json.loads(row[0])
+                with self._lock:
+                    self._remember(key, value, row[1], row[2])
+                    self._stats["disk_hits"] += 1
+                    self._stats["saved_sec"] += row[1]
+                return value
+            if row:
+                conn.execute("DELETE FROM llm_cache WHERE key=?", (key,))
+                conn.commit()
+        except sqlite3.Error as e:
+            logger.warning(f"LLM cache read failed: {str(e)}")
+
+        with self._lock:
+            self._stats["misses"] += 1
+        return None
+
+    def put(self, key, value, kind="", model="", cost_sec=0.0):
+        """Store value in both tiers"""
+        now = time.time()
+        with self._lock:
+            self._remember(key, value, cost_sec, now)
+            self._stats["stores"] += 1
+            self._writes += 1
+            evict = self._writes % EVICTION_INTERVAL == 0
+
+        data = json.dumps(value)
+        try:
+            conn = self._conn()
+            conn.execute('''INSERT OR REPLACE INTO llm_cache
+                            (key, kind, model, value, size, cost_sec, created_at, accessed_at)
+                            VALUES (?, ?, ?, ?, ?, ?, ?, ?)''',
+                         (key, kind, model, data, len(data), cost_sec, now, now))
+            conn.commit()
+            if evict:
+                self.evict()
+        except sqlite3.Error as e:
+            logger.warning(f"LLM cache write failed: {str(e)}")
+
+    def _remember(self, key, value, cost_sec, created_at):
+        self._memory[key] = {"value": value, "cost_sec": cost_sec, "created_at": created_at}
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_entries:
+            self._memory.popitem(last=False)
+
+    def evict(self):
+        """Drop expired rows, then least recently used rows until under max_bytes"""
+        conn = self._conn()
+        removed = conn.execute("DELETE FROM llm_cache WHERE created_at < ?",
+                               (time.time() - self.ttl_sec,)).rowcount
+        total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM llm_cache").fetchone()[0]
+        if total > self.max_bytes:
+            # Trim to 90% of the budget so we don't evict on every write
+            target = total - int(self.max_bytes * 0.9)
+            freed = 0
+            keys = []
+            for key, size in conn.execute("SELECT key, size FROM llm_cache ORDER BY accessed_at"):
+                keys.append((key,))
+                freed += size
+                if freed >= target:
+                    break
+            conn.executemany("DELETE FROM llm_cache WHERE key=?", keys)
+            removed += len(keys)
+        conn.commit()
+        with self._lock:
+            self._stats["evictions"] += removed
+        return removed
+
+    def stats(self):
+        """Hit/miss counters plus the model time saved by hits"""
+        with self._lock:
+            stats = dict(self._stats)
+            stats["memory_entries"] = len(self._memory)
+        lookups = stats["memory_hits"] + stats["disk_hits"] + stats["misses"]
+        stats["hit_rate"] = round((stats["memory_hits"] + stats["disk_hits"]) / lookups, 3) if lookups else 0.0
+        stats["saved_sec"] = round(stats["saved_sec"], 2)
+        return stats
+
+    def clear(self):
+        with self._lock:
+            self._memory.clear()
+        conn = self._conn()
+        conn.execute("DELETE FROM llm_cache")
+        conn.commit()
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_cache():
+    """Process-wide cache instance, created on first use"""
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = LLMCache()
+        return _cache
+
+
+def get_stats():
+    return get_cache().stats()
+
+
+def cached_chat(model, messages, options=None, format=None, priority=None, validate=None):
+    """
+    Ollama /api/chat with response caching, run through the LLM scheduler on a miss.
+    Responses validate() rejects are returned but not cached
+    """
+    if not CACHE_ENABLED:
+        return llm_scheduler.chat(model, messages, options=options, format=format, priority=priority)
+
+    cache = get_cache()
+    key = cache.make_key("chat", model, messages, options, format)
+    cached = cache.get(key)
+    if cached is not None:
+        return cached
+
+    def call():
+        start_time = time.time()
+        response = ollama_client.chat(model, messages, options=options, format=format)
+        if validate is None or validate(response):
+            cache.put(key, response, kind="chat", model=model, cost_sec=time.time() - start_time)
+        return response
+
+    # Concurrent misses on the same key share one model call
+    return llm_scheduler.get_scheduler().run(key, call, priority)
+
+
+def cached_generate(payload, priority=None, validate=None):
+    """
+    Ollama /api/generate with response caching; returns the decoded JSON body.
+    Responses validate() rejects are returned but not cached
+    """
+    if not CACHE_ENABLED:
+        return llm_scheduler.generate(payload, priority=priority)
+
+    cache = get_cache()
+    extra = {k: v for k, v in payload.items() if k not in ("model", "prompt", "format", "options", "stream")}
+    key = cache.make_key("generate", payload.get("model"), payload.get("prompt"),
+                         dict(payload.get("options") or {}, **extra), payload.get("format"))
+    cached = cache.get(key)
+    if cached is not None:
+        return cached
+
+    def call():
+        start_time = time.time()
+        data = ollama_client.generate(payload)
+        # Never cache server-side errors
+        if "error" not in data and (validate is None or validate(data)):
+            cache.put(key, data, kind="generate", model=payload.get("model", ""), cost_sec=time.time() - start_time)
+        return data
+
+    return llm_scheduler.get_scheduler().run(key, call, priority)
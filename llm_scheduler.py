@@ -0,0 +1,262 @@
+"""
+Scheduler in front of every model call.
+
+Calls wait for one of LLM_MAX_CONCURRENCY slots. Free slots go to the highest
+priority lane with work queued, and within a lane round-robin across users so
+one busy session can't starve the others. Identical requests already in flight
+are coalesced: later callers wait for the first call's result instead of
+sending the prompt again, and a waiting caller of higher priority moves the
+still-queued call up to its lane.
+
+Priority and user come from the caller's context (see request_context), so a
+whole interactive analysis, including the document stages it fans out to,
+runs at interactive priority while the same functions called from a
+background thread run behind it. A call site may also name a priority; the
+lower of the two applies, so work marked BACKGROUND stays in the background
+lane even inside an interactive request, and a background context keeps
+everything it runs there. Calls with neither run at NORMAL.
+"""
+import os
+import json
+import time
+import hashlib
+import logging
+import threading
+import contextvars
+from collections import OrderedDict, deque
+from concurrent.futures import Future
+from contextlib import contextmanager
+
+import ollama_client
+
+logger = logging.getLogger(__name__)
+
+# Priority lanes, served in this order
+INTERACTIVE, NORMAL, BACKGROUND = 0, 1, 2
+LANE_NAMES = ("interactive", "normal", "background")
+
+# Model calls running at once; match it to what the GPU serves in parallel (OLLAMA_NUM_PARALLEL)
+LLM_MAX_CONCURRENCY = int(os.environ.get("LLM_MAX_CONCURRENCY", "2"))
+
+_priority = contextvars.ContextVar("llm_priority", default=None)
+_user = contextvars.ContextVar("llm_user", default="anonymous")
+
+
+@contextmanager
+def request_context(priority=None, user=None):
+    """Run the enclosed model calls at this priority and/or on behalf of this user"""
+    tokens = []
+    if priority is not None:
+        tokens.append((_priority, _priority.set(priority)))
+    if user is not None:
+        tokens.append((_user, _user.set(str(user))))
+    try:
+        yield
+    finally:
+        for var, token in reversed(tokens):
+            var.reset(token)
+
+
+def set_priority(priority):
+    """Set the priority for the rest of the current context (e.g. a thread's copied context)"""
+    _priority.set(priority)
+
+
+def request_key(kind, payload):
+    """Identity of a model request for coalescing"""
+    data = json.dumps({"kind": kind, "payload": payload}, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(data.encode("utf-8")).hexdigest()
+
+
+class _Ticket:
+    __slots__ = ("granted", "queued_at", "priority", "user")
+
+    def __init__(self, priority, user):
+        self.granted = False
+        self.queued_at = time.time()
+        self.priority = priority
+        self.user = user
+
+
+class LLMScheduler:
+    """Concurrency-capped, prioritized, per-user fair dispatcher with single-flight coalescing"""
+
+    def __init__(self, max_concurrency=LLM_MAX_CONCURRENCY):
+        self.max_concurrency = max(1, max_concurrency)
+        self._cond = threading.Condition()
+        self._running = 0
+        # One lane per priority: user -> queue of waiting tickets, in round-robin order
+        self._lanes = [OrderedDict() for _ in LANE_NAMES]
+        self._inflight = {}
+        self._stats = {"requests": 0, "coalesced": 0, "completed": 0, "failed": 0}
+        self._waits = [{"count": 0, "total_sec": 0.0, "max_sec": 0.0} for _ in LANE_NAMES]
+
+    def _dispatch(self):
+        """Grant free slots to queued tickets (caller holds the condition)"""
+        granted = False
+        while self._running < self.max_concurrency:
+            lane = next((lane for lane in self._lanes if lane), None)
+            if lane is None:
+                break
+            user, queue = next(iter(lane.items()))
+            ticket = queue.popleft()
+            # The user goes to the back of the lane until their next turn
+            del lane[user]
+            if queue:
+                lane[user] = queue
+            ticket.granted = True
+            self._running += 1
+            granted = True
+        if granted:
+            self._cond.notify_all()
+
+    def _acquire(self, ticket):
+        with self._cond:
+            self._lanes[ticket.priority].setdefault(ticket.user, deque()).append(ticket)
+            self._dispatch()
+            self._cond.wait_for(lambda: ticket.granted)
+            waited = time.time() - ticket.queued_at
+            stats = self._waits[ticket.priority]
+            stats["count"] += 1
+            stats["total_sec"] += waited
+            stats["max_sec"] = max(stats["max_sec"], waited)
+        if waited > 1:
+            logger.info(f"LLM call waited {waited:.2f}s in the {LANE_NAMES[ticket.priority]} lane")
+
+    def _promote(self, ticket, priority):
+        """Move a queued ticket up to a higher priority lane (caller holds the condition)"""
+        if ticket.granted or priority >= ticket.priority:
+            return
+        lane = self._lanes[ticket.priority]
+        queue = lane.get(ticket.user)
+        if not queue or ticket not in queue:
+            return
+        queue.remove(ticket)
+        if not queue:
+            del lane[ticket.user]
+        ticket.priority = priority
+        self._lanes[priority].setdefault(ticket.user, deque()).append(ticket)
+
+    def _release(self):
+        with self._cond:
+            self._running -= 1
+            self._dispatch()
+
+    @contextmanager
+    def slot(self, priority=None, user=None):
+        """Hold one model slot for the enclosed block (for streamed calls)"""
+        with self._held(_Ticket(_resolve_priority(priority), user or _user.get())):
+            yield
+
+    @contextmanager
+    def _held(self, ticket):
+        self._acquire(ticket)
+        try:
+            yield
+        finally:
+            self._release()
+
+    def run(self, key, func, priority=None, user=None):
+        """
+        Return func() run in a model slot. While a call with the same key is in
+        flight, callers share its result (or exception) instead of running func again;
+        a sharing caller of higher priority promotes the call if it is still queued,
+        so it never waits behind lower-priority work.
+        """
+        ticket = _Ticket(_resolve_priority(priority), user or _user.get())
+        with self._cond:
+            self._stats["requests"] += 1
+            flight = self._inflight.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._inflight[key] = (Future(), ticket)
+            else:
+                self._stats["coalesced"] += 1
+                self._promote(flight[1], ticket.priority)
+        if not leader:
+            return flight[0].result()
+
+        try:
+            with self._held(ticket):
+                result = func()
+        except BaseException as e:
+            with self._cond:
+                self._stats["failed"] += 1
+                del self._inflight[key]
+            flight[0].set_exception(e)
+            raise
+        with self._cond:
+            self._stats["completed"] += 1
+            del self._inflight[key]
+        flight[0].set_result(result)
+        return result
+
+    def stats(self):
+        """Queue depth per lane, running calls, coalescing counters and wait times"""
+        with self._cond:
+            stats = dict(self._stats)
+            stats["max_concurrency"] = self.max_concurrency
+            stats["running"] = self._running
+            stats["in_flight"] = len(self._inflight)
+            stats["queued"] = {name: sum(len(queue) for queue in lane.values())
+                               for name, lane in zip(LANE_NAMES, self._lanes)}
+            stats["wait"] = {name: {"count": w["count"],
+                                    "mean_sec": round(w["total_sec"] / w["count"], 3) if w["count"] else 0.0,
+                                    "max_sec": round(w["max_sec"], 3)}
+                             for name, w in zip(LANE_NAMES, self._waits)}
+        return stats
+
+    def reset_stats(self):
+        """Zero the counters and wait times (queued and running calls are unaffected)"""
+        with self._cond:
+            self._stats = dict.fromkeys(self._stats, 0)
+            self._waits = [{"count": 0, "total_sec": 0.0, "max_sec": 0.0} for _ in LANE_NAMES]
+
+
+def _resolve_priority(priority):
+    """
+    The lower of the context's priority and the call site's (the higher lane number);
+    a context can't raise a call its site marked BACKGROUND. NORMAL when neither is set
+    """
+    priorities = [p for p in (_priority.get(), priority) if p is not None]
+    return max(priorities) if priorities else NORMAL
+
+
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+
+def get_scheduler():
+    """Process-wide scheduler, created on first use"""
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is None:
+            _scheduler = LLMScheduler()
+        return _scheduler
+
+
+def get_stats():
+    return get_scheduler().stats()
+
+
+def reset_stats():
+    get_scheduler().reset_stats()
+
+
+def chat(model, messages, options=None, format=None, priority=None):
+    """Scheduled, coalesced ollama_client.chat"""
+    key = request_key("chat", {"model": model, "messages": messages, "options": options, "format": format})
+    return get_scheduler().run(key, lambda: ollama_client.chat(model, messages, options=options, format=format),
+                               priority)
+
+
+def stream_chat(model, messages, options=None, format=None, priority=None, call_site=None):
+    """Streamed ollama_client.chat; the slot is held until the stream is exhausted or closed"""
+    with get_scheduler().slot(priority):
+        yield from ollama_client.chat(model, messages, options=options, format=format, stream=True,
+                                      call_site=call_site)
+
+
+def generate(payload, priority=None):
+    """Scheduled, coalesced ollama_client.generate"""
+    return get_scheduler().run(request_key("generate", payload), lambda: ollama_client.generate(payload), priority)
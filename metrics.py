@@ -0,0 +1,187 @@
+"""
+Ollama token and timing metrics in the Prometheus text format.
+
+ollama_client reports every finished model response here with the call site
+that made it (the enclosing tracing span unless the caller names one) and the
+model. The counters Ollama returns (prompt_eval_count, eval_count,
+eval_duration, load_duration, total_duration) feed histograms of prompt size,
+output throughput, model load time and request time, served at /metrics by a
+small local HTTP server:
+
+    curl http://127.0.0.1:9464/metrics
+"""
+import os
+import bisect
+import logging
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+logger = logging.getLogger(__name__)
+
+# Where the /metrics endpoint listens; port 0 disables it
+METRICS_HOST = os.environ.get("CLAIMS_METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.environ.get("CLAIMS_METRICS_PORT", "9464"))
+# A load_duration at least this long means the model was (re)loaded, not already resident
+MODEL_LOAD_THRESHOLD_SEC = float(os.environ.get("MODEL_LOAD_THRESHOLD_SEC", "0.5"))
+
+LABELS = ("call_site", "model")
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def _number(value):
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(names, values, extra=()):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in list(zip(names, values)) + list(extra)]
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Counter:
+    def __init__(self, name, help):
+        self.name = name
+        self.help = help
+        self._values = {}
+
+    def inc(self, labels, amount=1):
+        self._values[labels] = self._values.get(labels, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        for labels, value in sorted(self._values.items()):
+            lines.append(f"{self.name}{_labels(LABELS, labels)} {_number(value)}")
+        return lines
+
+
+class Histogram:
+    """Cumulative-bucket histogram per label set"""
+
+    def __init__(self, name, help, buckets):
+        self.name = name
+        self.help = help
+        self.buckets = tuple(sorted(buckets))
+        self._series = {}
+
+    def observe(self, labels, value):
+        series = self._series.setdefault(labels, {"counts": [0] * (len(self.buckets) + 1), "sum": 0.0})
+        # Per-bucket counts here; render() makes them cumulative
+        series["counts"][bisect.bisect_left(self.buckets, value)] += 1
+        series["sum"] += value
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for labels, series in sorted(self._series.items()):
+            total = 0
+            for bound, count in zip(self.buckets + (float("inf"),), series["counts"]):
+                total += count
+                le = "+Inf" if bound == float("inf") else _number(bound)
+                lines.append(f"{self.name}_bucket{_labels(LABELS, labels, [('le', le)])} {total}")
+            lines.append(f"{self.name}_sum{_labels(LABELS, labels)} {_number(round(series['sum'], 6))}")
+            lines.append(f"{self.name}_count{_labels(LABELS, labels)} {total}")
+        return lines
+
+
+REQUESTS = Counter("ollama_requests_total", "Finished Ollama responses")
+MODEL_LOADS = Counter("ollama_model_loads_total",
+                      f"Responses whose load_duration was at least {MODEL_LOAD_THRESHOLD_SEC}s (model loaded or reloaded)")
+PROMPT_TOKENS = Histogram("ollama_prompt_tokens", "Prompt tokens evaluated per request (prompt_eval_count)",
+                          (64, 128, 256, 512, 1024, 2048, 4096, 8192, 16384, 32768))
+OUTPUT_TOKENS = Histogram("ollama_output_tokens", "Tokens generated per request (eval_count)",
+                          (16, 32, 64, 128, 256, 512, 1024, 2048, 4096))
+OUTPUT_TOKENS_PER_SEC = Histogram("ollama_output_tokens_per_second", "Generation speed (eval_count / eval_duration)",
+                                  (1, 2, 5, 10, 15, 20, 30, 40, 60, 80, 120, 200))
+PROMPT_TOKENS_PER_SEC = Histogram("ollama_prompt_tokens_per_second",
+                                  "Prompt processing speed (prompt_eval_count / prompt_eval_duration)",
+                                  (50, 100, 200, 500, 1000, 2000, 5000, 10000))
+LOAD_SECONDS = Histogram("ollama_load_duration_seconds", "Time spent loading the model per request (load_duration)",
+                         (0.001, 0.01, 0.05, 0.1, 0.5, 1, 2, 5, 10, 30))
+REQUEST_SECONDS = Histogram("ollama_request_duration_seconds", "Server-side time per request (total_duration)",
+                            (0.1, 0.25, 0.5, 1, 2, 5, 10, 20, 30, 60, 120, 300))
+METRICS = (REQUESTS, MODEL_LOADS, PROMPT_TOKENS, OUTPUT_TOKENS, OUTPUT_TOKENS_PER_SEC, PROMPT_TOKENS_PER_SEC,
+           LOAD_SECONDS, REQUEST_SECONDS)
+
+_lock = threading.Lock()
+
+
+def observe_response(body, call_site, model=None):
+    """Record one finished Ollama response (the final body, which carries the counters)"""
+    labels = (call_site or "other", body.get("model") or model or "unknown")
+    prompt_tokens = body.get("prompt_eval_count")
+    output_tokens = body.get("eval_count")
+    prompt_sec = (body.get("prompt_eval_duration") or 0) / 1e9
+    eval_sec = (body.get("eval_duration") or 0) / 1e9
+    load_sec = body.get("load_duration")
+    total_sec = body.get("total_duration")
+    with _lock:
+        REQUESTS.inc(labels)
+        if prompt_tokens is not None:
+            PROMPT_TOKENS.observe(labels, prompt_tokens)
+            if prompt_tokens and prompt_sec:
+                PROMPT_TOKENS_PER_SEC.observe(labels, prompt_tokens / prompt_sec)
+        if output_tokens is not None:
+            OUTPUT_TOKENS.observe(labels, output_tokens)
+            if output_tokens and eval_sec:
+                OUTPUT_TOKENS_PER_SEC.observe(labels, output_tokens / eval_sec)
+        if load_sec is not None:
+            LOAD_SECONDS.observe(labels, load_sec / 1e9)
+            if load_sec / 1e9 >= MODEL_LOAD_THRESHOLD_SEC:
+                MODEL_LOADS.inc(labels)
+        if total_sec is not None:
+            REQUEST_SECONDS.observe(labels, total_sec / 1e9)
+
+
+def render():
+    """All metrics in the Prometheus text exposition format"""
+    with _lock:
+        lines = [line for metric in METRICS for line in metric.render()]
+    return "\n".join(lines) + "\n"
+
+
+class _Handler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        data = render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", CONTENT_TYPE)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+_server = None
+_server_lock = threading.Lock()
+_server_attempted = False
+
+
+def start_server(host=None, port=None):
+    """
+    Serve /metrics from a background thread, once per process; returns the server,
+    or None when disabled or the port is taken (e.g. by another app process)
+    """
+    global _server, _server_attempted
+    host = host or METRICS_HOST
+    port = METRICS_PORT if port is None else port
+    with _server_lock:
+        if _server_attempted:
+            return _server
+        _server_attempted = True
+        if not port:
+            return None
+        try:
+            _server = ThreadingHTTPServer((host, port), _Handler)
+        except OSError as e:
+            logger.warning(f"Metrics endpoint not started on {host}:{port}: {str(e)}")
+            return None
+        _server.daemon_threads = True
+        threading.Thread(target=_server.serve_forever, name="metrics-server", daemon=True).start()
+        logger.info(f"Serving Prometheus metrics at http://{host}:{_server.server_address[1]}/metrics")
+        return _server
@@ -0,0 +1,221 @@
+"""
+Shared HTTP client for the Ollama API.
+
+One keep-alive connection pool per process, connect/read timeouts on every
+request, and a bounded number of retries with jittered exponential backoff
+for failures where the request never reached a working model server.
+"""
+import os
+import json
+import time
+import random
+import asyncio
+import logging
+import threading
+import contextvars
+from contextlib import contextmanager
+
+import requests
+from requests.adapters import HTTPAdapter
+
+import metrics
+import tracing
+
+logger = logging.getLogger(__name__)
+
+# Same variable the ollama CLI and Python library read
+OLLAMA_HOST = os.environ.get("OLLAMA_HOST", "http://localhost:11434").rstrip("/")
+if "://" not in OLLAMA_HOST:
+    OLLAMA_HOST = f"http://{OLLAMA_HOST}"
+OLLAMA_CONNECT_TIMEOUT = float(os.environ.get("OLLAMA_CONNECT_TIMEOUT", "5"))
+# Longest wait for the next bytes of a response (for streams: between chunks)
+OLLAMA_READ_TIMEOUT = float(os.environ.get("OLLAMA_READ_TIMEOUT", "300"))
+OLLAMA_RETRIES = int(os.environ.get("OLLAMA_RETRIES", "2"))
+OLLAMA_BACKOFF_SEC = float(os.environ.get("OLLAMA_BACKOFF_SEC", "0.5"))
+OLLAMA_POOL_SIZE = int(os.environ.get("OLLAMA_POOL_SIZE", "16"))
+
+# Responses meaning "busy or restarting, try again"; anything else is final
+RETRY_STATUSES = (429, 502, 503, 504)
+
+
+class OllamaError(Exception):
+    """The Ollama server could not be reached or rejected the request"""
+
+    def __init__(self, message, status_code=None):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+class Usage:
+    """Model calls and token counts recorded inside a track_usage() block"""
+
+    def __init__(self, parent=None):
+        self.parent = parent
+        self.calls = 0
+        self.prompt_tokens = 0
+        self.output_tokens = 0
+        self.model_sec = 0.0
+        self._lock = threading.Lock()
+
+    def add(self, body):
+        """Count one finished response (Ollama reports tokens and durations on the final body)"""
+        with self._lock:
+            self.calls += 1
+            self.prompt_tokens += body.get("prompt_eval_count") or 0
+            self.output_tokens += body.get("eval_count") or 0
+            self.model_sec += (body.get("total_duration") or 0) / 1e9
+        if self.parent is not None:
+            self.parent.add(body)
+
+    def summary(self):
+        return {"calls": self.calls, "prompt_tokens": self.prompt_tokens,
+                "output_tokens": self.output_tokens, "model_sec": round(self.model_sec, 2)}
+
+
+_usage = contextvars.ContextVar("ollama_usage", default=None)
+
+
+@contextmanager
+def track_usage():
+    """Record every model response in the enclosed block, including ones from stage threads"""
+    usage = Usage(parent=_usage.get())
+    token = _usage.set(usage)
+    try:
+        yield usage
+    finally:
+        _usage.reset(token)
+
+
+def _call_site(call_site=None):
+    """Label for a model call: the caller's name for it, else the span it runs in"""
+    if call_site:
+        return call_site
+    span = tracing.current_span()
+    return span.name if span is not None else "other"
+
+
+def _record(body, call_site, model=None):
+    usage = _usage.get()
+    if usage is not None:
+        usage.add(body)
+    metrics.observe_response(body, call_site, model)
+
+
+_session = None
+_session_pid = None
+_session_lock = threading.Lock()
+
+
+def get_session():
+    """Process-wide requests.Session with a pooled, keep-alive adapter"""
+    global _session, _session_pid
+    with _session_lock:
+        # Sockets inherited through fork() are shared with the parent; start a fresh pool
+        if _session is None or _session_pid != os.getpid():
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=OLLAMA_POOL_SIZE)
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+            _session, _session_pid = session, os.getpid()
+        return _session
+
+
+def _backoff(attempt):
+    """Full-jitter exponential backoff, so retrying clients don't arrive in lockstep"""
+    return random.uniform(0, OLLAMA_BACKOFF_SEC * 2 ** attempt)
+
+
+def _error_message(response):
+    try:
+        return response.json().get("error", response.text)
+    except ValueError:
+        return response.text
+
+
+def post(path, payload, stream=False, timeout=None):
+    """
+    POST payload to an Ollama endpoint; returns the open requests.Response.
+    Connection failures and busy responses are retried; read timeouts are not,
+    since the server may still be generating and a retry would double its load.
+    """
+    url = f"{OLLAMA_HOST}{path}"
+    timeout = timeout or (OLLAMA_CONNECT_TIMEOUT, OLLAMA_READ_TIMEOUT)
+    for attempt in range(OLLAMA_RETRIES + 1):
+        last_try = attempt == OLLAMA_RETRIES
+        try:
+            response = get_session().post(url, json=payload, stream=stream, timeout=timeout)
+        except (requests.ConnectionError, requests.ConnectTimeout) as e:
+            if last_try:
+                raise OllamaError(f"Cannot reach Ollama at {OLLAMA_HOST}: {str(e)}") from e
+            logger.warning(f"Ollama connection failed ({str(e)}); retrying")
+        except requests.Timeout as e:
+            raise OllamaError(f"Ollama did not respond within {timeout[1]}s") from e
+        else:
+            if response.ok:
+                return response
+            message = _error_message(response)
+            response.close()
+            if last_try or response.status_code not in RETRY_STATUSES:
+                raise OllamaError(f"Ollama returned {response.status_code}: {message}", response.status_code)
+            logger.warning(f"Ollama returned {response.status_code}; retrying")
+        time.sleep(_backoff(attempt))
+
+
+def _iter_stream(response, call_site, model):
+    """Decode a newline-delimited JSON response, closing it when done"""
+    try:
+        for line in response.iter_lines():
+            if line:
+                chunk = json.loads(line)
+                if "error" in chunk:
+                    raise OllamaError(chunk["error"])
+                if chunk.get("done"):
+                    _record(chunk, call_site, model)
+                yield chunk
+    except requests.Timeout as e:
+        raise OllamaError(f"Ollama stalled for more than {OLLAMA_READ_TIMEOUT}s mid-response") from e
+    finally:
+        response.close()
+
+
+def _chat_payload(model, messages, options, format, stream):
+    payload = {"model": model, "messages": messages, "stream": stream}
+    if options:
+        payload["options"] = options
+    if format:
+        payload["format"] = format
+    return payload
+
+
+def chat(model, messages, options=None, format=None, stream=False, call_site=None):
+    """
+    /api/chat; returns the response dict (response["message"]["content"] holds the reply),
+    or with stream=True an iterator of response chunks
+    call_site labels the call's metrics (default: the current tracing span)
+    """
+    call_site = _call_site(call_site)
+    response = post("/api/chat", _chat_payload(model, messages, options, format, stream), stream=stream)
+    if stream:
+        return _iter_stream(response, call_site, model)
+    body = response.json()
+    _record(body, call_site, model)
+    return body
+
+
+def generate(payload, call_site=None):
+    """/api/generate with a full request payload; returns the decoded response body"""
+    payload = dict(payload, stream=False)
+    call_site = _call_site(call_site)
+    body = post("/api/generate", payload).json()
+    _record(body, call_site, payload.get("model"))
+    return body
+
+
+async def achat(model, messages, options=None, format=None):
+    """chat() for asyncio callers; runs on a worker thread sharing the same connection pool"""
+    return await asyncio.to_thread(chat, model, messages, options, format)
+
+
+async def agenerate(payload):
+    """generate() for asyncio callers"""
+    return await asyncio.to_thread(generate, payload)
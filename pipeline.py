@@ -0,0 +1,109 @@
+import os
+import time
+import logging
+import contextvars
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+logger = logging.getLogger(__name__)
+
+# Upper bound on stages running at once (most stages are blocking Ollama calls)
+DEFAULT_MAX_WORKERS = int(os.environ.get("CLAIMS_MAX_WORKERS", "4"))
+
+
+class StageGraph:
+    """Run named stages concurrently, respecting the dependencies between them"""
+
+    def __init__(self, max_workers=None):
+        self.max_workers = max(1, max_workers or DEFAULT_MAX_WORKERS)
+        self._stages = {}
+
+    def add(self, name, func, *args, deps=(), **kwargs):
+        """
+        Register a stage. The stage is called as func(*args, *dep_results, **kwargs)
+        once every stage listed in deps has finished.
+        """
+        if name in self._stages:
+            raise ValueError(f"Duplicate stage: {name}")
+        for dep in deps:
+            if dep not in self._stages:
+                raise ValueError(f"Stage {name} depends on unknown stage {dep}")
+        self._stages[name] = {"func": func, "args": args, "kwargs": kwargs, "deps": tuple(deps)}
+        return name
+
+    def run(self):
+        """Execute all stages and return a PipelineRun with results and timings"""
+        results = {}
+        timings = {}
+        pending = dict(self._stages)
+        running = {}
+        error = None
+        start = time.time()
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            while pending or running:
+                # Submit every stage whose dependencies are satisfied
+                if error is None:
+                    for name, stage in list(pending.items()):
+                        if all(dep in results for dep in stage["deps"]):
+                            dep_results = [results[dep] for dep in stage["deps"]]
+                            # Stages see the caller's context (e.g. LLM priority and user)
+                            context = contextvars.copy_context()
+                            future = executor.submit(context.run, self._timed, stage, dep_results)
+                            running[future] = name
+                            del pending[name]
+                elif not running:
+                    break
+
+                if not running:
+                    raise RuntimeError(f"Unresolvable stages: {', '.join(pending)}")
+
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    name = running.pop(future)
+                    try:
+                        results[name], timings[name] = future.result()
+                    except Exception as e:
+                        logger.error(f"Stage {name} failed: {str(e)}")
+                        error = error or e
+
+        if error is not None:
+            raise error
+
+        run = PipelineRun(results, timings, self._critical_path(timings), time.time() - start)
+        logger.info(f"Pipeline finished: {len(results)} stages, wall {run.wall_sec:.2f}s, "
+                    f"critical path {run.critical_path_sec:.2f}s ({' -> '.join(run.critical_path)})")
+        return run
+
+    @staticmethod
+    def _timed(stage, dep_results):
+        stage_start = time.time()
+        result = stage["func"](*stage["args"], *dep_results, **stage["kwargs"])
+        return result, time.time() - stage_start
+
+    def _critical_path(self, timings):
+        """Longest chain of stage durations through the dependency graph"""
+        best = {}
+        # Stages are registered after their dependencies, so insertion order is topological
+        for name, stage in self._stages.items():
+            prev = max((best[dep] for dep in stage["deps"]), key=lambda item: item[0], default=(0.0, []))
+            best[name] = (prev[0] + timings.get(name, 0.0), prev[1] + [name])
+        return max(best.values(), key=lambda item: item[0], default=(0.0, []))
+
+
+class PipelineRun:
+    """Outcome of a StageGraph run"""
+
+    def __init__(self, results, timings, critical_path, wall_sec):
+        self.results = results
+        self.timings = timings
+        self.critical_path_sec, self.critical_path = critical_path
+        self.wall_sec = wall_sec
+
+    def summary(self):
+        """Compact timing report suitable for the processing metadata"""
+        return {
+            "wall_sec": round(self.wall_sec, 2),
+            "critical_path_sec": round(self.critical_path_sec, 2),
+            "critical_path": self.critical_path,
+            "stages": {name: round(sec, 2) for name, sec in self.timings.items()}
+        }
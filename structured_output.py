@@ -0,0 +1,296 @@
+"""
+Schema-constrained model output.
+
+Structured calls pass their JSON Schema to Ollama as `format`, so decoding can
+only produce JSON of that shape. Replies are still checked against a
+ResultModel: near misses (code fences, prose around the object, trailing
+commas, raw newlines or stray backslashes in strings, truncation, "75%" where
+an integer belongs) are repaired locally. Only output that can't be repaired
+is re-asked, at most STRUCTURED_MAX_REASKS times. Per-model counters show how
+often each of those happens.
+"""
+import os
+import re
+import json
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+# Extra model calls allowed per structured request when the reply can't be repaired
+STRUCTURED_MAX_REASKS = int(os.environ.get("STRUCTURED_MAX_REASKS", "1"))
+
+STRING = {"type": "string"}
+STRINGS = {"type": "array", "items": STRING}
+
+
+def object_schema(**properties):
+    return {"type": "object", "properties": properties, "required": list(properties)}
+
+
+def integer_schema(minimum=None, maximum=None):
+    schema = {"type": "integer"}
+    if minimum is not None:
+        schema["minimum"] = minimum
+    if maximum is not None:
+        schema["maximum"] = maximum
+    return schema
+
+
+def enum_schema(*values):
+    return {"type": "string", "enum": list(values)}
+
+
+def optional_schema(schema):
+    """The same shape with no required properties, for partial updates"""
+    if schema.get("type") == "object":
+        return dict(schema, required=[],
+                    properties={k: optional_schema(v) for k, v in schema["properties"].items()})
+    return schema
+
+
+class StructuredOutputError(ValueError):
+    """A model reply that could not be parsed or repaired into its result model"""
+
+    def __init__(self, message, output=None):
+        super().__init__(message)
+        self.output = output
+
+
+_stats = {}
+_stats_lock = threading.Lock()
+
+
+def _count(name, outcome):
+    with _stats_lock:
+        counts = _stats.setdefault(name, {"parsed": 0, "repaired": 0, "failed": 0, "reasks": 0})
+        counts[outcome] += 1
+
+
+def get_stats():
+    """Per result model: clean parses, local repairs, failures and re-asks, with rates"""
+    with _stats_lock:
+        stats = {name: dict(counts) for name, counts in _stats.items()}
+    for counts in stats.values():
+        replies = counts["parsed"] + counts["repaired"] + counts["failed"]
+        counts["failure_rate"] = round(counts["failed"] / replies, 4) if replies else 0.0
+        counts["reask_rate"] = round(counts["reasks"] / replies, 4) if replies else 0.0
+    return stats
+
+
+_FENCE = re.compile(r"```(?:json)?\s*([\s\S]*?)(?:```|$)")
+_PY_LITERALS = {"True": "true", "False": "false", "None": "null"}
+
+
+def _repair_text(text):
+    """
+    Rewrite the first JSON object in text into valid JSON: escape control
+    characters and drop invalid escapes inside strings, drop trailing commas,
+    map Python literals, and close whatever a truncated reply left open
+    """
+    start = text.find("{")
+    if start < 0:
+        raise StructuredOutputError("No JSON object in model output", text)
+    out, stack = [], []
+    in_string = escape = False
+    i = start
+    while i < len(text):
+        ch = text[i]
+        if in_string:
+            if escape:
+                # Keep valid escapes; "\$" or "\_" become the bare character
+                if ch in '"\\/bfnrt' or (ch == "u" and re.match(r"[0-9a-fA-F]{4}", text[i + 1:i + 5])):
+                    out.append("\\" + ch)
+                else:
+                    out.append(ch)
+                escape = False
+            elif ch == "\\":
+                escape = True
+            elif ch == '"':
+                in_string = False
+                out.append(ch)
+            elif ch in "\n\r\t":
+                out.append({"\n": "\\n", "\r": "\\r", "\t": "\\t"}[ch])
+            else:
+                out.append(ch)
+        elif ch == '"':
+            in_string = True
+            out.append(ch)
+        elif ch in "{[":
+            stack.append("}" if ch == "{" else "]")
+            out.append(ch)
+        elif ch in "}]":
+            while out and out[-1].isspace():
+                out.pop()
+            if out and out[-1] == ",":
+                out.pop()
+            if stack:
+                stack.pop()
+            out.append(ch)
+            if not stack:
+                break
+        elif ch.isalpha():
+            word = re.match(r"[A-Za-z]+", text[i:]).group(0)
+            out.append(_PY_LITERALS.get(word, word))
+            i += len(word)
+            continue
+        else:
+            out.append(ch)
+        i += 1
+
+    if in_string:
+        out.append('"')
+    repaired = "".join(out).rstrip()
+    if stack:
+        # Truncated reply: drop a dangling key or comma, then close what is still open
+        if stack[-1] == "}":
+            repaired = re.sub(r'([,{])\s*"[^"]*"\s*:?\s*$', r"\1", repaired)
+        repaired = re.sub(r"[,:]\s*$", "", repaired)
+    return repaired + "".join(reversed(stack))
+
+
+def repair_json(output):
+    """(value, repaired) for a model reply; raises StructuredOutputError"""
+    try:
+        return json.loads(output), False
+    except (json.JSONDecodeError, TypeError):
+        pass
+    text = output or ""
+    fenced = _FENCE.search(text)
+    if fenced and "{" in fenced.group(1):
+        text = fenced.group(1)
+    try:
+        return json.loads(_repair_text(text)), True
+    except json.JSONDecodeError as e:
+        raise StructuredOutputError(f"Unrepairable JSON: {str(e)}", output) from e
+
+
+def _coerce(schema, value, path, partial=False):
+    """
+    (value in the schema's shape, whether anything had to change); raises StructuredOutputError.
+    Missing and null values become the type's empty value, except that with partial null
+    numbers and strings stay None (unknown, which a merge must not mistake for 0 or "")
+    """
+    kind = schema.get("type")
+    if kind == "object":
+        if value is None:
+            value = {}
+        if not isinstance(value, dict):
+            raise StructuredOutputError(f"{path or 'reply'} should be an object, got {type(value).__name__}")
+        result, changed = dict(value), False
+        for key, prop in schema.get("properties", {}).items():
+            if key in value or key in schema.get("required", ()):
+                result[key], fixed = _coerce(prop, value.get(key), f"{path}.{key}" if path else key, partial)
+                changed = changed or fixed or key not in value
+        return result, changed
+    if kind == "array":
+        if value is None:
+            return [], True
+        items, changed = (value, False) if isinstance(value, list) else ([value], True)
+        coerced = []
+        for i, item in enumerate(items):
+            item, fixed = _coerce(schema.get("items", {}), item, f"{path}[{i}]", partial)
+            coerced.append(item)
+            changed = changed or fixed
+        return coerced, changed
+    if partial and value is None and kind in ("integer", "number", "string"):
+        return None, False
+    if kind in ("integer", "number"):
+        if value is None:
+            return 0, True
+        if isinstance(value, bool) or not isinstance(value, (int, float)):
+            match = re.search(r"-?\d+(?:\.\d+)?", str(value).replace(",", ""))
+            if match is None:
+                raise StructuredOutputError(f"{path} should be a number, got {value!r}")
+            number = float(match.group(0))
+        else:
+            number = value
+        coerced = int(round(number)) if kind == "integer" else number
+        coerced = max(schema.get("minimum", coerced), min(schema.get("maximum", coerced), coerced))
+        return coerced, coerced != value or type(coerced) is not type(value)
+    if kind == "string":
+        if "enum" in schema:
+            answer = str(value or "").strip().lower().replace(" ", "_")
+            match = next((option for option in schema["enum"] if option == answer), None)
+            match = match or next((option for option in schema["enum"] if option in answer), None)
+            if match is None:
+                raise StructuredOutputError(f"{path} should be one of {', '.join(schema['enum'])}, got {value!r}")
+            return match, match != value
+        if isinstance(value, str):
+            return value, False
+        if value is None:
+            return "", True
+        if isinstance(value, list):
+            return ", ".join(str(item) for item in value), True
+        if isinstance(value, (dict, bool)):
+            return json.dumps(value), True
+        return str(value), True
+    return value, False
+
+
+class ResultModel:
+    """
+    The typed result of one kind of structured call: its schema plus validation against it.
+    A partial model (an update to merge into known values) keeps null fields as None
+    """
+
+    def __init__(self, name, schema, partial=False):
+        self.name = name
+        self.schema = schema
+        self.partial = partial
+
+    def validate(self, value):
+        """Value coerced into the schema's shape; raises StructuredOutputError"""
+        return _coerce(self.schema, value, "", self.partial)[0]
+
+    def accepts(self, response):
+        """Whether a chat or generate response is usable, without counting it (for cache admission)"""
+        output = response["message"]["content"] if "message" in response else response.get("response")
+        try:
+            _coerce(self.schema, repair_json(output)[0], "", self.partial)
+        except StructuredOutputError:
+            return False
+        return True
+
+    def parse(self, output):
+        """Parse, repair and validate a model reply; raises StructuredOutputError"""
+        try:
+            value, repaired = repair_json(output)
+            value, fixed = _coerce(self.schema, value, "", self.partial)
+        except StructuredOutputError as e:
+            e.output = output
+            _count(self.name, "failed")
+            logger.warning(f"Unusable {self.name} output ({str(e)}): {output!r:.500}")
+            raise
+        _count(self.name, "repaired" if repaired or fixed else "parsed")
+        if repaired or fixed:
+            logger.info(f"Repaired {self.name} output locally")
+        return value
+
+
+def reask_messages(result_model, messages, output, error):
+    """Conversation that shows the model its unusable reply and asks again"""
+    _count(result_model.name, "reasks")
+    return list(messages) + [
+        {"role": "assistant", "content": output or ""},
+        {"role": "user", "content": f"That reply could not be used ({str(error)}). "
+                                    f"Reply again with only the JSON object, matching the required fields."}
+    ]
+
+
+def structured_chat(result_model, send, messages, max_reasks=None):
+    """
+    (result, response) for send(messages=..., format=schema), a chat call such as
+    cached_chat or llm_scheduler.chat with its other arguments bound. Unusable
+    replies are re-asked up to max_reasks times; the last failure is raised.
+    """
+    max_reasks = STRUCTURED_MAX_REASKS if max_reasks is None else max_reasks
+    for attempt in range(max_reasks + 1):
+        response = send(messages=messages, format=result_model.schema)
+        output = response['message']['content']
+        try:
+            return result_model.parse(output), response
+        except StructuredOutputError as e:
+            if attempt == max_reasks:
+                raise
+            messages = reask_messages(result_model, messages, output, e)
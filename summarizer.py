@@ -0,0 +1,182 @@
+"""
+Map-reduce summaries of long documents.
+
+Text is split into chunks on page boundaries (PDF page offsets) or, without
+pages, on blank-line section breaks. Chunks are summarized concurrently, with
+the prompt tokens in flight capped by SUMMARY_INFLIGHT_TOKENS, and the chunk
+summaries are then reduced into one claim-relevant summary.
+
+Chunks are packed greedily from the start of the document, so appending pages
+leaves every earlier chunk unchanged. Every prompt goes through the LLM
+response cache, so only the changed last chunk (and the reduce step) reaches
+the model again.
+"""
+import os
+import re
+import logging
+import threading
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+
+import llm_scheduler
+from llm_cache import cached_chat
+
+logger = logging.getLogger(__name__)
+
+# Rough prompt-size estimate; good enough for budgeting
+CHARS_PER_TOKEN = 4
+# Target size of one chunk, in tokens
+SUMMARY_CHUNK_TOKENS = int(os.environ.get("SUMMARY_CHUNK_TOKENS", "1500"))
+# Chunk prompt tokens being summarized at once for one document
+SUMMARY_INFLIGHT_TOKENS = int(os.environ.get("SUMMARY_INFLIGHT_TOKENS", "6000"))
+
+_SECTION_BREAK = re.compile(r"\n\s*\n")
+
+SUMMARY_FORMAT = """Output format:
+- Key points
+- Relevant details for claim
+- Any concerns or missing information"""
+
+
+def estimate_tokens(text):
+    return len(text) // CHARS_PER_TOKEN + 1
+
+
+def _pieces(text, pages):
+    """(label, text) units the chunks are built from: pages, else sections"""
+    if pages:
+        return [(f"page {page['page']}", text[page["start"]:page["end"]]) for page in pages
+                if text[page["start"]:page["end"]].strip()]
+    return [("", section) for section in _SECTION_BREAK.split(text) if section.strip()]
+
+
+def _split_long(label, text, max_chars):
+    """A unit bigger than one chunk, cut at line breaks where possible"""
+    parts = []
+    while len(text) > max_chars:
+        cut = text.rfind("\n", 0, max_chars)
+        cut = cut if cut > max_chars // 2 else max_chars
+        parts.append((label, text[:cut]))
+        text = text[cut:]
+    parts.append((label, text))
+    return parts
+
+
+def split_chunks(text, pages=None, max_tokens=SUMMARY_CHUNK_TOKENS):
+    """Greedy, append-stable chunks of at most max_tokens: list of {"label", "text"}"""
+    max_chars = max_tokens * CHARS_PER_TOKEN
+    chunks, labels, parts, size = [], [], [], 0
+
+    def flush():
+        if parts:
+            span = labels[0] if labels[0] == labels[-1] else f"{labels[0]}-{labels[-1].split()[-1]}"
+            chunks.append({"label": span.strip(), "text": "\n\n".join(parts)})
+
+    for label, piece in _pieces(text, pages):
+        for label, piece in _split_long(label, piece, max_chars):
+            if parts and size + len(piece) > max_chars:
+                flush()
+                labels, parts, size = [], [], 0
+            labels.append(label)
+            parts.append(piece)
+            size += len(piece)
+    flush()
+    return chunks
+
+
+def _summarize(prompt):
+    response = cached_chat(
+        model="llama3",
+        messages=[{'role': 'user', 'content': prompt}],
+        priority=llm_scheduler.BACKGROUND
+    )
+    return response['message']['content']
+
+
+def summarize_chunk(chunk, doc_type):
+    # Only the chunk's own pages go in the prompt: its position or the chunk count
+    # would change every cached prompt whenever a page is appended
+    where = chunk["label"] or "part"
+    return _summarize(f"""
+Summarize {where} of a document for claim processing.
+Keep names, dates, amounts, policy numbers and anything that affects the claim.
+
+Document type: {doc_type}
+Content:
+{chunk['text']}
+
+{SUMMARY_FORMAT}
+""")
+
+
+def _reduce(summaries, doc_type):
+    return _summarize(f"""
+Combine these summaries of consecutive parts of one document into a single concise summary
+for claim processing. Merge duplicates and keep every detail relevant to the claim.
+
+Document type: {doc_type}
+Part summaries:
+{chr(10).join(f"[{i + 1}] {summary}" for i, summary in enumerate(summaries))}
+
+{SUMMARY_FORMAT}
+""")
+
+
+def map_chunks(chunks, doc_type):
+    """Chunk summaries in order, run concurrently within SUMMARY_INFLIGHT_TOKENS"""
+    cond = threading.Condition()
+    inflight = [0]
+
+    def run(index):
+        # A chunk bigger than the whole budget still runs, just on its own
+        tokens = min(estimate_tokens(chunks[index]["text"]), SUMMARY_INFLIGHT_TOKENS)
+        with cond:
+            cond.wait_for(lambda: inflight[0] + tokens <= SUMMARY_INFLIGHT_TOKENS)
+            inflight[0] += tokens
+        try:
+            return summarize_chunk(chunks[index], doc_type)
+        finally:
+            with cond:
+                inflight[0] -= tokens
+                cond.notify_all()
+
+    workers = max(1, SUMMARY_INFLIGHT_TOKENS // SUMMARY_CHUNK_TOKENS)
+    with ThreadPoolExecutor(max_workers=min(workers, len(chunks))) as executor:
+        # Chunk calls see the caller's context (LLM user, trace span, usage accounting)
+        futures = [executor.submit(contextvars.copy_context().run, run, index) for index in range(len(chunks))]
+        return [future.result() for future in futures]
+
+
+def summarize_document(text, doc_type="unknown", pages=None):
+    """Claim-relevant summary of the whole document"""
+    chunks = split_chunks(text, pages)
+    if not chunks:
+        return ""
+    if len(chunks) == 1:
+        return _summarize(f"""
+Generate a concise summary of this document for claim processing:
+
+Document type: {doc_type}
+Content:
+{chunks[0]['text']}
+
+{SUMMARY_FORMAT}
+""")
+
+    summaries = map_chunks(chunks, doc_type)
+    logger.info(f"Summarized {len(chunks)} chunks of a {estimate_tokens(text)}-token {doc_type} document")
+    # Reduce in groups that fit one prompt until a single summary is left
+    while len(summaries) > 1:
+        groups, group, size = [], [], 0
+        for summary in summaries:
+            if group and size + estimate_tokens(summary) > SUMMARY_CHUNK_TOKENS:
+                groups.append(group)
+                group, size = [], 0
+            group.append(summary)
+            size += estimate_tokens(summary)
+        groups.append(group)
+        if len(groups) == len(summaries):
+            # Summaries too large to pair up; reduce them all at once rather than loop
+            groups = [summaries]
+        summaries = [_reduce(group, doc_type) if len(group) > 1 else group[0] for group in groups]
+    return summaries[0]
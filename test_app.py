@@ -3,8 +3,8 @@ import os
 import json
 import time
 
-# Add src directory to path
-sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../src')))
+# Modules live next to this script
+sys.path.insert(0, os.path.abspath(os.path.dirname(__file__)))
 
 from app import analyze_claim
 
@@ -0,0 +1,277 @@
+"""
+Lightweight tracing: timed spans for the stages of a claim turn.
+
+    with tracing.span("turn", claim_id=claim_id, mode="stream"):
+        ...
+
+    @tracing.traced("pdf_extraction")
+    def extract_pdf(data): ...
+
+Spans opened inside another span (including in StageGraph stage threads and
+other threads started with a copy of the context) join its trace; a span
+opened outside any becomes the root of a new trace. Finished spans are
+buffered and written to the traces table in batches by a background thread,
+so callers never wait on the database.
+"""
+import os
+import json
+import time
+import atexit
+import logging
+import functools
+import threading
+import contextvars
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+TRACING_ENABLED = os.environ.get("CLAIMS_TRACING", "1") != "0"
+# Seconds between background writes, and the buffered span count that triggers one sooner
+TRACE_FLUSH_SEC = float(os.environ.get("TRACE_FLUSH_SEC", "2"))
+TRACE_BATCH_SIZE = int(os.environ.get("TRACE_BATCH_SIZE", "200"))
+# Spans beyond this many waiting to be written are dropped rather than queued without bound
+TRACE_BUFFER_SIZE = int(os.environ.get("TRACE_BUFFER_SIZE", "20000"))
+# Stored spans older than this are deleted by the writer thread, at most once per TRACE_PRUNE_SEC
+TRACE_RETENTION_DAYS = float(os.environ.get("TRACE_RETENTION_DAYS", "7"))
+TRACE_PRUNE_SEC = 3600
+
+
+class _Trace:
+    __slots__ = ("trace_id", "claim_id")
+
+    def __init__(self, claim_id=None):
+        self.trace_id = os.urandom(8).hex()
+        self.claim_id = claim_id
+
+
+class Span:
+    """One timed operation; add details with tag()"""
+
+    def __init__(self, name, trace, parent_id=None, tags=None):
+        self.name = name
+        self.trace = trace
+        self.span_id = os.urandom(8).hex()
+        self.parent_id = parent_id
+        self.tags = dict(tags or {})
+        self.started_at = time.time()
+        self._start = time.perf_counter()
+
+    def tag(self, **tags):
+        self.tags.update(tags)
+
+    def _row(self, duration_sec, status):
+        tags = json.dumps(self.tags, default=str) if self.tags else None
+        return (self.trace.trace_id, self.span_id, self.parent_id, self.trace.claim_id, self.name,
+                self.started_at, round(duration_sec * 1000, 3), status, tags)
+
+
+_current = contextvars.ContextVar("tracing_span", default=None)
+
+
+def current_span():
+    return _current.get()
+
+
+def _start_span(name, claim_id, tags):
+    parent = _current.get()
+    if parent is None:
+        return Span(name, _Trace(claim_id), tags=tags)
+    if claim_id is not None:
+        set_claim(claim_id)
+    return Span(name, parent.trace, parent.span_id, tags)
+
+
+@contextmanager
+def span(name, claim_id=None, **tags):
+    """Time the enclosed block as a span; claim_id tags the whole trace"""
+    current = _start_span(name, claim_id, tags)
+    token = _current.set(current)
+    status = "ok"
+    try:
+        yield current
+    # Only real failures; BaseException control flow (e.g. Streamlit's rerun) isn't an error
+    except Exception:
+        status = "error"
+        raise
+    finally:
+        _current.reset(token)
+        if TRACING_ENABLED:
+            _enqueue(current._row(time.perf_counter() - current._start, status))
+
+
+def traced(name=None, root=True):
+    """
+    Decorator running the function inside span(name or the function's name).
+    With root=False the call is only traced when it is part of an existing trace.
+    """
+    def decorate(func):
+        span_name = name or func.__name__
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not root and _current.get() is None:
+                return func(*args, **kwargs)
+            with span(span_name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+def record(name, started_at, duration_sec, status="ok", **tags):
+    """Record an interval timed elsewhere (e.g. across a generator's yields) as a child of the current span"""
+    current = _start_span(name, None, tags)
+    current.started_at = started_at
+    if TRACING_ENABLED:
+        _enqueue(current._row(duration_sec, status))
+
+
+def set_claim(claim_id):
+    """Tag the current trace, including its already-finished spans, with a claim id"""
+    current = _current.get()
+    if current is None or current.trace.claim_id == claim_id:
+        return
+    current.trace.claim_id = claim_id
+    if TRACING_ENABLED:
+        with _cond:
+            _claims[current.trace.trace_id] = claim_id
+
+
+# Background writer
+_buffer = []
+_claims = {}
+_cond = threading.Condition()
+_write_lock = threading.Lock()
+_writer_pid = None
+_last_prune = 0.0
+_stats = {"recorded": 0, "dropped": 0, "written": 0, "write_errors": 0, "pruned": 0}
+
+
+def _enqueue(row):
+    with _cond:
+        if len(_buffer) >= TRACE_BUFFER_SIZE:
+            _stats["dropped"] += 1
+            return
+        _stats["recorded"] += 1
+        _buffer.append(row)
+        if len(_buffer) >= TRACE_BATCH_SIZE:
+            _cond.notify()
+        _ensure_writer()
+
+
+def _ensure_writer():
+    """Start the writer thread on first use in this process (caller holds _cond)"""
+    global _writer_pid
+    if _writer_pid != os.getpid():
+        _writer_pid = os.getpid()
+        threading.Thread(target=_write_loop, name="trace-writer", daemon=True).start()
+
+
+def _write_loop():
+    while True:
+        with _cond:
+            _cond.wait_for(lambda: len(_buffer) >= TRACE_BATCH_SIZE, timeout=TRACE_FLUSH_SEC)
+        flush()
+        if time.time() - _last_prune >= TRACE_PRUNE_SEC:
+            prune()
+
+
+def prune():
+    """Delete stored spans older than TRACE_RETENTION_DAYS (0 keeps them all)"""
+    global _last_prune
+    # database imports this module for its spans
+    import database
+
+    _last_prune = time.time()
+    if TRACE_RETENTION_DAYS <= 0:
+        return
+    try:
+        deleted = database.prune_spans(time.time() - TRACE_RETENTION_DAYS * 86400)
+    except Exception as e:
+        logger.warning(f"Could not prune old trace spans: {str(e)}")
+        return
+    if deleted:
+        logger.info(f"Pruned {deleted} trace spans older than {TRACE_RETENTION_DAYS:g} days")
+        with _cond:
+            _stats["pruned"] += deleted
+
+
+def flush():
+    """Write buffered spans now; returns once everything recorded so far is stored"""
+    # database imports this module for its spans
+    import database
+
+    with _write_lock:
+        with _cond:
+            rows, claims = _buffer[:], dict(_claims)
+            _buffer.clear()
+            _claims.clear()
+        if not rows and not claims:
+            return
+        try:
+            with database.transaction():
+                database.save_spans(rows)
+                for trace_id, claim_id in claims.items():
+                    database.set_trace_claim(trace_id, claim_id)
+        except Exception as e:
+            logger.warning(f"Could not write {len(rows)} trace spans: {str(e)}")
+            with _cond:
+                _stats["write_errors"] += 1
+            return
+        with _cond:
+            _stats["written"] += len(rows)
+
+
+atexit.register(flush)
+
+
+def get_stats():
+    with _cond:
+        return dict(_stats, buffered=len(_buffer))
+
+
+# Reading traces back
+
+def stage_latencies(hours=24):
+    """Per-stage span count, error count and p50/p95/p99/max milliseconds over the last hours"""
+    import database
+
+    latencies = []
+    for name, count, errors, max_ms, p50, p95, p99 in database.get_stage_latencies(time.time() - hours * 3600):
+        latencies.append({"stage": name, "count": count, "errors": errors,
+                          "p50_ms": round(p50, 1), "p95_ms": round(p95, 1), "p99_ms": round(p99, 1),
+                          "max_ms": round(max_ms, 1)})
+    return sorted(latencies, key=lambda row: row["p95_ms"], reverse=True)
+
+
+def claim_traces(claim_id):
+    """
+    The claim's traces, newest first, each with its spans in tree order:
+    [{"trace_id", "name", "started_at", "duration_ms", "spans": [span + "depth", "offset_ms"]}]
+    """
+    import database
+
+    by_trace = {}
+    for row in database.get_claim_spans(claim_id):
+        by_trace.setdefault(row["trace_id"], []).append(row)
+
+    traces = []
+    for trace_id, spans in by_trace.items():
+        ids = {s["span_id"] for s in spans}
+        children = {}
+        for s in spans:
+            # Spans whose parent wasn't stored (e.g. dropped) hang off the root
+            parent = s["parent_id"] if s["parent_id"] in ids else None
+            children.setdefault(parent, []).append(s)
+        start = min(s["started_at"] for s in spans)
+        ordered = []
+
+        def walk(parent, depth):
+            for s in sorted(children.get(parent, []), key=lambda s: s["started_at"]):
+                ordered.append(dict(s, depth=depth, offset_ms=round((s["started_at"] - start) * 1000, 3)))
+                walk(s["span_id"], depth + 1)
+
+        walk(None, 0)
+        end = max(s["started_at"] * 1000 + s["duration_ms"] for s in spans)
+        traces.append({"trace_id": trace_id, "name": ordered[0]["name"], "started_at": start,
+                       "duration_ms": round(end - start * 1000, 3), "spans": ordered})
+    return sorted(traces, key=lambda t: t["started_at"], reverse=True)